@@ -1,17 +1,93 @@
+import multiprocessing
 import os
-import urllib
+import urllib2
 import socket
+import struct
 import logging
+from StringIO import StringIO
 
 from lbryum import lbrycrd
-from lbryum.util import hex_to_int, PrintError, int_to_hex, rev_hex
-from lbryum.hashing import hash_encode, Hash, PoWHash
-from lbryum.errors import ChainValidationError
+from lbryum.util import PrintError
+from lbryum.hashing import hash_encode, hash_decode, Hash, PoWHash
+from lbryum.errors import ChainValidationError, CheckpointError
+from lbryum.header_store import HeaderStore, DEFAULT_MAX_PENDING
+from lbryum.header_columns import HeaderColumns
 from lbryum.constants import HEADER_SIZE, HEADERS_URL, BLOCKS_PER_CHUNK, NULL_HASH
+from lbryum.constants import MAX_FORK_DEPTH
 from lbryum.constants import blockchain_params
 
 log = logging.getLogger(__name__)
 
+# version, prev_block_hash, merkle_root, claim_trie_root, timestamp, bits, nonce
+HEADER_STRUCT = struct.Struct('<I32s32s32sIII')
+NULL_HASH_BYTES = '\x00' * 32
+# chunks of the bootstrap headers file verified and saved at a time
+BOOTSTRAP_BATCH_CHUNKS = 16
+
+
+def check_pow(args):
+    """Returns whether a raw header meets its target, module level so it can run in a pool"""
+    raw_header, target = args
+    return int(hash_encode(PoWHash(raw_header)), 16) <= target
+
+
+def read_exactly(f, size):
+    """Read size bytes from a file like object, or fewer at the end of it"""
+    chunks = []
+    while size > 0:
+        data = f.read(size)
+        if not data:
+            break
+        chunks.append(data)
+        size -= len(data)
+    return ''.join(chunks)
+
+
+def header_work(bits):
+    """The expected number of hashes needed to find a header with these bits"""
+    return 2 ** 256 / (ArithUint256.fromCompact(bits) + 1)
+
+
+def chain_work(data):
+    """Total work of contiguous raw headers"""
+    return sum(header_work(HEADER_STRUCT.unpack_from(data, i * HEADER_SIZE)[5])
+               for i in range(len(data) / HEADER_SIZE))
+
+
+class HeaderTree(object):
+    """Headers received from servers that are not on our chain yet, indexed by hash.
+    A branch is followed back from its tip through the prev hashes, so competing
+    tips can be kept, extended and compared by work until one wins.
+    """
+
+    def __init__(self):
+        # hash -> (height, raw header)
+        self.headers = {}
+
+    def add(self, height, raw_header):
+        self.headers[Hash(raw_header)] = height, raw_header
+
+    def branch(self, tip_hash):
+        """The headers leading up to tip_hash that we have, as ascending (height, raw)"""
+        branch = []
+        block_hash = tip_hash
+        while block_hash in self.headers:
+            height, raw_header = self.headers[block_hash]
+            branch.append((height, raw_header))
+            block_hash = HEADER_STRUCT.unpack(raw_header)[1]
+        branch.reverse()
+        return branch
+
+    def discard(self, headers):
+        for _, raw_header in headers:
+            self.headers.pop(Hash(raw_header), None)
+
+    def prune(self, height):
+        """Forget about headers below height"""
+        for block_hash, (h, _) in self.headers.items():
+            if h < height:
+                del self.headers[block_hash]
+
 
 class LbryCrd(PrintError):
     """Manages blockchain headers and their verification"""
@@ -21,14 +97,23 @@ class LbryCrd(PrintError):
     def __init__(self, config, network):
         self.config = config
         self.network = network
-        self.headers_url = HEADERS_URL
+        self.headers_url = self.config.get('headers_url', HEADERS_URL)
+        self.store = HeaderStore(self.path(),
+                                 int(self.config.get('max_pending_headers', DEFAULT_MAX_PENDING)))
+        self.store.refresh()
         self.local_height = 0
         self.set_local_height()
         self.retrieving_headers = False
+        # number of processes checking proof of work of header chunks, 0 or 1 to check inline
+        self.pow_processes = int(self.config.get('pow_verification_processes', 0))
+        self._pow_pool = None
 
         self._MAX_TARGET = blockchain_params[self.BLOCKCHAIN_NAME]['max_target']
         self._N_TARGET_TIMESPAN = blockchain_params[self.BLOCKCHAIN_NAME]['target_timespan']
         self._GENESIS_BITS = blockchain_params[self.BLOCKCHAIN_NAME]['genesis_bits']
+        self.checkpoints = self.load_checkpoints()
+        self.tree = HeaderTree()
+        self.last_checkpoint = max(self.checkpoints) if self.checkpoints else -1
 
     @property
     def MAX_TARGET(self):
@@ -45,44 +130,104 @@ class LbryCrd(PrintError):
     def height(self):
         return self.local_height
 
+    def load_checkpoints(self):
+        """The shipped checkpoints updated with those from the config, as {height: hash}"""
+        checkpoints = dict(blockchain_params[self.BLOCKCHAIN_NAME].get('checkpoints', {}))
+        for height, block_hash in (self.config.get('checkpoints') or {}).iteritems():
+            checkpoints[int(height)] = str(block_hash)
+        return checkpoints
+
     def init(self):
+        self.store.refresh()
         self.init_headers_file()
+        self.store.refresh()
         self.set_local_height()
         log.debug("%d blocks" % self.local_height)
 
     def verify_header(self, header, prev_header, bits, target):
-        prev_hash = self.hash_header(prev_header)
-        assert prev_hash == header.get('prev_block_hash'), "prev hash mismatch: %s vs %s" % (
-            prev_hash, header.get('prev_block_hash'))
-        assert bits == header.get('bits'), "bits mismatch: %s vs %s (hash: %s)" % (
-            bits, header.get('bits'), self.hash_header(header))
-        _pow_hash = self.pow_hash_header(header)
-        assert int('0x' + _pow_hash,
-                   16) <= target, "insufficient proof of work: %s vs target %s" % (
-            int('0x' + _pow_hash, 16), target)
-
-    def verify_chain(self, chain):
-        first_header = chain[0]
-        height = first_header['block_height']
-        prev_header = self.read_header(height - 1)
-        for header in chain:
-            height = header['block_height']
-            if self.read_header(height) is not None:
-                bits, target = self.get_target(height, prev_header, header)
-                self.verify_header(header, prev_header, bits, target)
-            prev_header = header
+        self.verify_raw_header(self.pack_header(header), self.pack_header(prev_header),
+                               bits, target)
+
+    def verify_raw_header(self, raw_header, prev_raw_header, bits, target):
+        self.verify_linkage(raw_header, prev_raw_header, bits)
+        self.verify_pow([(raw_header, target)])
+
+    def verify_linkage(self, raw_header, prev_raw_header, bits):
+        self.verify_prev_hash(raw_header, prev_raw_header)
+        header_bits = HEADER_STRUCT.unpack(raw_header)[5]
+        assert bits == header_bits, "bits mismatch: %s vs %s (hash: %s)" % (
+            bits, header_bits, hash_encode(Hash(raw_header)))
+
+    def verify_prev_hash(self, raw_header, prev_raw_header):
+        prev_hash = HEADER_STRUCT.unpack(raw_header)[1]
+        expected_prev_hash = Hash(prev_raw_header) if prev_raw_header else NULL_HASH_BYTES
+        assert expected_prev_hash == prev_hash, "prev hash mismatch: %s vs %s" % (
+            hash_encode(expected_prev_hash), hash_encode(prev_hash))
+
+    def verify_checkpoints(self, height, data):
+        """Check the hashes of raw headers starting at height against the checkpoints"""
+        count = len(data) / HEADER_SIZE
+        for checkpoint_height, block_hash in self.checkpoints.iteritems():
+            if height <= checkpoint_height < height + count:
+                i = checkpoint_height - height
+                raw_header = data[i * HEADER_SIZE:(i + 1) * HEADER_SIZE]
+                if hash_encode(Hash(raw_header)) != block_hash:
+                    raise CheckpointError("checkpoint mismatch at height %i" % checkpoint_height)
+
+    def verify_pow(self, checks):
+        """Check a list of (raw_header, target) pairs, on the process pool if there is one"""
+        pool = self.get_pow_pool() if len(checks) > 1 else None
+        if pool is not None:
+            chunksize = max(1, len(checks) / (self.pow_processes * 4))
+            results = pool.map(check_pow, checks, chunksize)
+        else:
+            results = map(check_pow, checks)
+        for (raw_header, target), ok in zip(checks, results):
+            assert ok, "insufficient proof of work: %s vs target %s" % (
+                int(hash_encode(PoWHash(raw_header)), 16), target)
+
+    def get_pow_pool(self):
+        if self.pow_processes <= 1:
+            return None
+        if self._pow_pool is None:
+            log.info("starting %i proof of work verification processes", self.pow_processes)
+            self._pow_pool = multiprocessing.Pool(self.pow_processes)
+        return self._pow_pool
 
     def verify_chunk(self, index, data):
-        prev_header = None
-        if index != 0:
-            prev_header = self.read_header(index * BLOCKS_PER_CHUNK - 1)
-        for i in range(BLOCKS_PER_CHUNK):
+        if len(data) != BLOCKS_PER_CHUNK * HEADER_SIZE:
+            raise ChainValidationError("Chunk is wrong size: %i" % len(data))
+        self.verify_headers(index * BLOCKS_PER_CHUNK, data)
+
+    def verify_headers(self, height, data):
+        """Verify contiguous raw headers starting at height against the local chain.
+        Linkage and difficulty are checked sequentially, then proof of work for the
+        whole batch is checked at once since it doesn't depend on the other headers.
+        Headers at or below the last checkpoint only need to link up to it.
+        """
+        count = len(data) / HEADER_SIZE
+        fast = height + count - 1 <= self.last_checkpoint
+        prev_raw_header = None
+        prev_timestamp = None
+        if height != 0:
+            prev_raw_header = self.read_raw_header(height - 1)
+            if prev_raw_header is None:
+                raise ChainValidationError("Missing header at height %i" % (height - 1))
+            prev_timestamp = HEADER_STRUCT.unpack(prev_raw_header)[4]
+        pow_checks = []
+        for i in range(count):
             raw_header = data[i * HEADER_SIZE:(i + 1) * HEADER_SIZE]
-            header = self.deserialize_header(raw_header)
-            bits, target = self.get_target(index * BLOCKS_PER_CHUNK + i, prev_header, header)
-            if header is not None:
-                self.verify_header(header, prev_header, bits, target)
-            prev_header = header
+            if fast:
+                self.verify_prev_hash(raw_header, prev_raw_header)
+            else:
+                timestamp, bits = HEADER_STRUCT.unpack(raw_header)[4:6]
+                bits, target = self.calculate_target(height + i, prev_timestamp, timestamp, bits)
+                self.verify_linkage(raw_header, prev_raw_header, bits)
+                pow_checks.append((raw_header, target))
+                prev_timestamp = timestamp
+            prev_raw_header = raw_header
+        self.verify_checkpoints(height, data)
+        self.verify_pow(pow_checks)
 
     def get_block_hash(self, header):
         block_hash = header.get('prev_block_hash')
@@ -92,97 +237,179 @@ class LbryCrd(PrintError):
             assert header.get('block_height') == 0
             return NULL_HASH
 
-    def serialize_header(self, res):
-        s = int_to_hex(res.get('version'), 4) \
-            + rev_hex(self.get_block_hash(res)) \
-            + rev_hex(res.get('merkle_root')) \
-            + rev_hex(res.get('claim_trie_root')) \
-            + int_to_hex(int(res.get('timestamp')), 4) \
-            + int_to_hex(int(res.get('bits')), 4) \
-            + int_to_hex(int(res.get('nonce')), 4)
+    def pack_header(self, header):
+        """Serialize a header dict to its raw 112 byte form"""
+        if header is None:
+            return None
+        return HEADER_STRUCT.pack(
+            header.get('version'),
+            hash_decode(self.get_block_hash(header)),
+            hash_decode(header.get('merkle_root')),
+            hash_decode(header.get('claim_trie_root')),
+            int(header.get('timestamp')),
+            int(header.get('bits')),
+            int(header.get('nonce')))
 
-        return s
+    def serialize_header(self, res):
+        return self.pack_header(res).encode('hex')
 
     def deserialize_header(self, s):
-        h = {}
-        h['version'] = hex_to_int(s[0:4])
-        h['prev_block_hash'] = hash_encode(s[4:36])
-        h['merkle_root'] = hash_encode(s[36:68])
-        h['claim_trie_root'] = hash_encode(s[68:100])
-        h['timestamp'] = hex_to_int(s[100:104])
-        h['bits'] = hex_to_int(s[104:108])
-        h['nonce'] = hex_to_int(s[108:112])
-        return h
+        version, prev_hash, merkle_root, claim_trie_root, timestamp, bits, nonce = \
+            HEADER_STRUCT.unpack(s)
+        return {
+            'version': version,
+            'prev_block_hash': hash_encode(prev_hash),
+            'merkle_root': hash_encode(merkle_root),
+            'claim_trie_root': hash_encode(claim_trie_root),
+            'timestamp': timestamp,
+            'bits': bits,
+            'nonce': nonce,
+        }
 
     def hash_header(self, header):
         if header is None:
             return '0' * 64
-        return hash_encode(Hash(self.serialize_header(header).decode('hex')))
+        return hash_encode(Hash(self.pack_header(header)))
 
     def pow_hash_header(self, header):
         if header is None:
             return '0' * 64
-        return hash_encode(PoWHash(self.serialize_header(header).decode('hex')))
+        return hash_encode(PoWHash(self.pack_header(header)))
 
     def path(self):
         return os.path.join(self.config.path, 'blockchain_headers')
 
+    def bootstrap_marker_path(self):
+        return self.path() + '.bootstrap'
+
     def init_headers_file(self):
+        """Download the headers file from headers_url, verifying it as it arrives.
+        A marker file is kept next to the headers while downloading, so that an
+        interrupted download resumes from the last verified chunk.
+        """
         filename = self.path()
-        if os.path.exists(filename):
+        marker = self.bootstrap_marker_path()
+        if os.path.exists(filename) and not os.path.exists(marker):
             return
+        open(marker, 'a').close()
         try:
             socket.setdefaulttimeout(30)
             log.info("downloading headers from %s", self.headers_url)
             self.retrieving_headers = True
             try:
-                urllib.urlretrieve(self.headers_url, filename)
-            except:
-                raise
+                self.download_headers()
             finally:
                 self.retrieving_headers = False
             log.info("done.")
+            os.remove(marker)
+        except (AssertionError, ChainValidationError) as e:
+            log.warning("invalid headers in %s: %s", self.headers_url, e)
+            os.remove(marker)
         except Exception:
-            log.warning("download failed. creating empty headers file: %s", filename)
+            log.warning("download failed, will resume at next start: %s", filename)
+        if not os.path.exists(filename):
             open(filename, 'wb+').close()
 
+    def open_headers_source(self, offset):
+        """Open headers_url, a local path or a URL, at byte offset"""
+        if os.path.exists(self.headers_url):
+            f = open(self.headers_url, 'rb')
+            f.seek(offset)
+            return f
+        request = urllib2.Request(self.headers_url)
+        if offset:
+            request.add_header('Range', 'bytes=%i-' % offset)
+        try:
+            response = urllib2.urlopen(request)
+        except urllib2.HTTPError as e:
+            if e.code == 416:
+                # we already have the whole file
+                return StringIO()
+            raise
+        if offset and response.getcode() != 206:
+            # no support for ranges, skip what we already have
+            while offset > 0:
+                skipped = len(response.read(min(offset, 1 << 20)))
+                if not skipped:
+                    break
+                offset -= skipped
+        return response
+
+    def download_headers(self):
+        """Stream headers from headers_url, verifying and saving them a batch of chunks
+        at a time, starting at the first chunk we don't have entirely.  If a batch
+        doesn't verify, what was saved since the previous checkpoint is dropped."""
+        idx = (self.local_height + 1) / BLOCKS_PER_CHUNK
+        batch_size = BOOTSTRAP_BATCH_CHUNKS * BLOCKS_PER_CHUNK * HEADER_SIZE
+        source = self.open_headers_source(idx * BLOCKS_PER_CHUNK * HEADER_SIZE)
+        try:
+            while True:
+                data = read_exactly(source, batch_size)
+                data = data[:len(data) - len(data) % HEADER_SIZE]
+                if not data:
+                    break
+                try:
+                    self.verify_headers(idx * BLOCKS_PER_CHUNK, data)
+                except (AssertionError, ChainValidationError):
+                    # batches saved below a checkpoint were only checked for linkage
+                    self.rollback_to_checkpoint(idx * BLOCKS_PER_CHUNK)
+                    raise
+                self.save_chunk(idx, data)
+                self.flush()
+                log.debug("verified %i bootstrap headers", self.local_height + 1)
+                if len(data) < batch_size:
+                    break
+                idx += BOOTSTRAP_BATCH_CHUNKS
+        finally:
+            source.close()
+
     def save_chunk(self, index, chunk):
-        filename = self.path()
-        f = open(filename, 'rb+')
-        f.seek(index * BLOCKS_PER_CHUNK * HEADER_SIZE)
-        h = f.write(chunk)
-        f.close()
+        self.store.write(index * BLOCKS_PER_CHUNK, chunk)
         self.set_local_height()
 
     def save_header(self, header):
-        data = self.serialize_header(header).decode('hex')
+        data = self.pack_header(header)
         if not len(data) == HEADER_SIZE:
             raise ChainValidationError("Header is wrong size")
         height = header.get('block_height')
-        filename = self.path()
-        f = open(filename, 'rb+')
-        f.seek(height * HEADER_SIZE)
-        h = f.write(data)
-        f.close()
+        self.store.write(height, data)
         self.set_local_height()
 
     def set_local_height(self):
-        name = self.path()
-        if os.path.exists(name):
-            h = os.path.getsize(name) / HEADER_SIZE - 1
-            if self.local_height != h:
-                self.local_height = h
+        if self.store.exists():
+            self.local_height = self.store.count() - 1
+
+    def flush(self):
+        """Write out headers saved since the last flush"""
+        self.store.flush()
+
+    def read_raw_header(self, block_height):
+        return self.store.read_raw(block_height)
 
     def read_header(self, block_height):
-        name = self.path()
-        if os.path.exists(name):
-            f = open(name, 'rb')
-            f.seek(block_height * HEADER_SIZE)
-            h = f.read(HEADER_SIZE)
-            f.close()
-            if len(h) == HEADER_SIZE:
-                h = self.deserialize_header(h)
-                return h
+        h = self.store.read_raw(block_height)
+        if h is not None:
+            return self.deserialize_header(h)
+
+    def header_columns(self):
+        """NumPy columns of the local headers, see HeaderColumns (requires numpy)"""
+        return HeaderColumns.from_store(self.store)
+
+    def get_height(self, block_hash):
+        """Returns the height of the local header with the given hex block hash, or None"""
+        try:
+            raw_hash = hash_decode(block_hash)
+        except TypeError:
+            return None
+        if len(raw_hash) != 32:
+            return None
+        return self.store.find(raw_hash)
+
+    def close(self):
+        if self._pow_pool is not None:
+            self._pow_pool.terminate()
+            self._pow_pool = None
+        self.store.close()
 
     def get_target(self, index, first, last, chain='main'):
         """
@@ -192,13 +419,20 @@ class LbryCrd(PrintError):
         if index == 0:
             return self.GENESIS_BITS, self.MAX_TARGET
         assert last is not None, "Last shouldn't be none"
-        # bits to target
-        bits = last.get('bits')
-        # print_error("Last bits: ", bits)
+        return self.calculate_target(index, first.get('timestamp'), last.get('timestamp'),
+                                     last.get('bits'))
+
+    def calculate_target(self, index, first_timestamp, last_timestamp, bits):
+        """
+        get_target() working on the raw header fields
+        Returns: (bits, target)
+        """
+        if index == 0:
+            return self.GENESIS_BITS, self.MAX_TARGET
         self.check_bits(bits)
 
         # new target
-        nActualTimespan = last.get('timestamp') - first.get('timestamp')
+        nActualTimespan = last_timestamp - first_timestamp
         nTargetTimespan = self.N_TARGET_TIMESPAN
         nModulatedTimespan = nTargetTimespan - (nActualTimespan - nTargetTimespan) / 8
         nMinTimespan = nTargetTimespan - (nTargetTimespan / 8)
@@ -218,42 +452,78 @@ class LbryCrd(PrintError):
             bnNew = ArithUint256(self.MAX_TARGET)
         return bnNew.GetCompact(), bnNew._value
 
-    def connect_header(self, chain, header):
-        '''Builds a header chain until it connects.  Returns True if it has
-        successfully connected, False if verification failed, otherwise the
-        height of the next header needed.'''
-        chain.append(header)  # Ordered by decreasing height
-        height = header['block_height']
-        if height > 0 and self.need_previous(header):
-            return height - 1
-        # The chain is complete so we can save it
-        return self.save_chain(chain, height)
-
-    def save_chain(self, chain, height):
-        # Reverse to order by increasing height
-        chain.reverse()
+    def connect_header(self, header):
+        """Add a header received from a server to the header tree and try to connect
+        the branch it is the tip of.  See connect_tip() for the return values."""
+        raw_header = self.pack_header(header)
+        self.tree.add(header['block_height'], raw_header)
+        return self.connect_tip(Hash(raw_header))
+
+    def connect_ancestors(self, idx, hexdata, tip_hash):
+        """Add a chunk of headers fetched to find where the branch ending at tip_hash
+        forks from our chain, then try to connect it again."""
         try:
-            self.verify_chain(chain)
-            log.debug("connected at height: %i", height)
-            for header in chain:
-                self.save_header(header)
-            return True
-        except BaseException as e:
-            log.exception("error saving chain")
+            data = hexdata.decode('hex')
+        except (AttributeError, TypeError) as e:
+            log.error("bad chunk of ancestors: %s", e)
             return False
+        for i in range(len(data) / HEADER_SIZE):
+            self.tree.add(idx * BLOCKS_PER_CHUNK + i, data[i * HEADER_SIZE:(i + 1) * HEADER_SIZE])
+        return self.connect_tip(tip_hash)
 
-    def need_previous(self, header):
-        """Return True if we're missing the block before the one we just got"""
-        previous_height = header['block_height'] - 1
-        previous_header = self.read_header(previous_height)
-        # Missing header, request it
-        if not previous_header:
-            return True
-        # Does it connect to my chain?
-        prev_hash = self.hash_header(previous_header)
-        if prev_hash != header.get('prev_block_hash'):
-            log.info("reorg")
+    def connect_tip(self, tip_hash):
+        """Connects the branch of the header tree ending at tip_hash to our chain,
+        switching to it if it has more work than the part of our chain it replaces.
+
+        Returns True if it connected (whether or not it became our best chain),
+        False if verification failed, otherwise the height of the next header
+        needed to find where the branch forks from our chain.
+        """
+        branch = self.tree.branch(tip_hash)
+        if not branch:
+            return False
+        first_height, first_raw = branch[0]
+        prev_hash = HEADER_STRUCT.unpack(first_raw)[1]
+        if first_height == 0:
+            if prev_hash != NULL_HASH_BYTES:
+                self.tree.discard(branch)
+                return False
+        else:
+            prev_raw = self.read_raw_header(first_height - 1)
+            if prev_raw is None or Hash(prev_raw) != prev_hash:
+                if first_height - 1 < self.local_height - MAX_FORK_DEPTH:
+                    log.warning("branch forks more than %i blocks deep", MAX_FORK_DEPTH)
+                    self.tree.discard(branch)
+                    return False
+                return first_height - 1
+        # the start of the branch may be headers we already have
+        common = 0
+        while common < len(branch) and self.read_raw_header(branch[common][0]) == branch[common][1]:
+            common += 1
+        self.tree.discard(branch[:common])
+        branch = branch[common:]
+        if not branch:
             return True
+        fork_height = branch[0][0]
+        data = ''.join(raw_header for _, raw_header in branch)
+        if fork_height <= self.local_height:
+            local_data = self.store.read_range(fork_height, self.local_height - fork_height + 1)
+            if chain_work(data) <= chain_work(local_data):
+                log.info("keeping competing branch at height %i", branch[-1][0])
+                return True
+            log.info("reorg at height %i", fork_height)
+        try:
+            self.verify_headers(fork_height, data)
+        except BaseException:
+            log.exception("error connecting branch")
+            self.tree.discard(branch)
+            return False
+        self.store.replace(fork_height, data)
+        self.set_local_height()
+        log.debug("connected at height: %i", self.local_height)
+        self.tree.discard(branch)
+        self.tree.prune(self.local_height - MAX_FORK_DEPTH)
+        return True
 
     def connect_chunk(self, idx, hexdata):
         try:
@@ -264,8 +534,25 @@ class LbryCrd(PrintError):
             return idx + 1
         except BaseException as e:
             log.error('verify_chunk failed: %s', str(e))
+            if isinstance(e, CheckpointError) or idx * BLOCKS_PER_CHUNK <= self.last_checkpoint:
+                # the headers we saved below the checkpoint were only checked for
+                # linkage, so they may be a forged branch this chunk doesn't link to
+                return self.rollback_to_checkpoint(idx * BLOCKS_PER_CHUNK)
             return idx - 1
 
+    def rollback_to_checkpoint(self, height):
+        """Headers below a checkpoint are only trusted once the checkpoint is reached, so
+        when one doesn't match, or a chunk below it doesn't verify, drop those saved
+        since the previous checkpoint.
+        Returns the index of the chunk to resume from.
+        """
+        previous = [h for h in self.checkpoints if h < height]
+        idx = (max(previous) + 1) / BLOCKS_PER_CHUNK if previous else 0
+        log.warning("rolling back headers to chunk %i", idx)
+        self.store.truncate(idx * BLOCKS_PER_CHUNK)
+        self.set_local_height()
+        return idx
+
     def check_bits(self, bits):
         bitsN = (bits >> 24) & 0xff
         assert 0x03 <= bitsN <= 0x1f, \
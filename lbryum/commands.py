@@ -398,6 +398,14 @@ class Commands(object):
             time.sleep(0.1)
         return self.network.get_servers()
 
+    @command('n')
+    def getnetworkstats(self):
+        """Return network statistics. Requests, errors, timeouts, bytes and
+        response times by method and by server, time spent in each phase of
+        the network loop and in each callback, loop stalls with a sample of
+        their stack, and the lengths of the request queues"""
+        return self.network.get_network_stats()
+
     @command('')
     def version(self):
         """Return the version of lbryum."""
@@ -23,10 +23,86 @@ HEADERS_URL = "https://s3.amazonaws.com/lbry-blockchain-headers/blockchain_heade
 DEFAULT_PORTS = {'t': '50001', 's': '50002', 'h': '8081', 'g': '8082'}
 NODES_RETRY_INTERVAL = 60
 SERVER_RETRY_INTERVAL = 10
+# seconds to wait for each address of a server when connecting from the network loop
+CONNECT_TIMEOUT = 10
+CHUNK_REQUEST_TIMEOUT = 30
+MAX_CHUNK_REWINDS = 10
+# default servers are probed on this many threads at startup, and the last probe
+# results are used instead of waiting for a new probe if younger than
+# SERVER_PROBE_CACHE_AGE seconds
+SERVER_PROBE_WORKERS = 8
+SERVER_PROBE_CACHE_AGE = 24 * 60 * 60
+# servers are picked by score, except for this share of picks made at random
+SERVER_EXPLORATION_RATE = 0.1
+# with auto_connect, switch to a connected server scoring under this ratio of the
+# main server's, checking at most every SERVER_SWITCH_INTERVAL seconds
+SERVER_SWITCH_RATIO = 0.5
+SERVER_SWITCH_INTERVAL = 60
+# responses timed before a server's score is trusted for switching
+MIN_RTT_SAMPLES = 5
+# requests sent to a server at once without an answer, client requests waiting
+# to be sent, and seconds send() blocks while that queue is full
+MAX_INFLIGHT_REQUESTS = 200
+MAX_PENDING_REQUESTS = 10000
+SEND_TIMEOUT = 30
+# seconds a network loop phase may run before its stack is logged, and a
+# callback before it is logged as slow
+LOOP_STALL_THRESHOLD = 1.0
+SLOW_CALLBACK_THRESHOLD = 0.1
+# callbacks queued for each callback worker before the network thread waits
+CALLBACK_QUEUE_SIZE = 1000
+# priorities of requests: interactive ones, the default, and background
+# traffic such as wallet synchronization; and how many requests of each are
+# taken in turn when they compete
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITY_WEIGHTS = (8, 4, 1)
+# seconds client requests may wait for an answer, for idempotent queries and for
+# everything else; the 'request_timeouts' setting overrides them per method
+IDEMPOTENT_REQUEST_TIMEOUT = 15
+REQUEST_TIMEOUT = 30
+# an idempotent query unanswered after the 95th percentile of recent response
+# times for its method (or HEDGE_DELAY before HEDGE_MIN_SAMPLES have been timed),
+# but at least HEDGE_MIN_DELAY, is sent to a second server as well
+HEDGE_DELAY = 1.0
+HEDGE_MIN_DELAY = 0.25
+HEDGE_MIN_SAMPLES = 20
+HEDGE_SAMPLES = 100
+# deepest reorganization followed from header notifications
+MAX_FORK_DEPTH = 2016
 proxy_modes = ['socks4', 'socks5', 'http']
 
+# server queries without side effects; identical ones in flight at the same time
+# are sent once
+IDEMPOTENT_METHODS = frozenset([
+    'blockchain.address.get_balance',
+    'blockchain.address.get_history',
+    'blockchain.address.get_mempool',
+    'blockchain.address.get_proof',
+    'blockchain.address.listunspent',
+    'blockchain.block.get_block',
+    'blockchain.block.get_header',
+    'blockchain.claimtrie.get',
+    'blockchain.claimtrie.getclaimbyid',
+    'blockchain.claimtrie.getclaimsbyids',
+    'blockchain.claimtrie.getclaimsforname',
+    'blockchain.claimtrie.getclaimsintx',
+    'blockchain.claimtrie.getclaimssignedby',
+    'blockchain.claimtrie.getclaimssignedbyid',
+    'blockchain.claimtrie.getnthclaimforname',
+    'blockchain.claimtrie.getvalue',
+    'blockchain.claimtrie.getvaluesforuris',
+    'blockchain.transaction.get',
+    'blockchain.transaction.get_merkle',
+    'blockchain.utxo.get_address',
+])
+
 # Main network and testnet3 definitions
 # these values follow the parameters in lbrycrd/src/chainparams.cpp
+# checkpoints map block heights to block hashes; header chunks wholly below the
+# last checkpoint are only checked to link up to it. More can be set with the
+# 'checkpoints' config setting.
 blockchain_params = {
     'lbrycrd_main': {
         'pubkey_address': 0,
@@ -36,7 +112,10 @@ blockchain_params = {
         'genesis_hash': '9c89283ba0f3227f6c03b70216b9f665f0118d5e0fa729cedf4fb34d6a34f463',
         'max_target': 0x0000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF,
         'genesis_bits': 0x1f00ffff,
-        'target_timespan': 150
+        'target_timespan': 150,
+        'checkpoints': {
+            0: '9c89283ba0f3227f6c03b70216b9f665f0118d5e0fa729cedf4fb34d6a34f463',
+        }
     },
     'lbrycrd_test': {
         'pubkey_address': 0,
@@ -46,7 +125,10 @@ blockchain_params = {
         'genesis_hash': '9c89283ba0f3227f6c03b70216b9f665f0118d5e0fa729cedf4fb34d6a34f463',
         'max_target': 0x0000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF,
         'genesis_bits': 0x1f00ffff,
-        'target_timespan': 150
+        'target_timespan': 150,
+        'checkpoints': {
+            0: '9c89283ba0f3227f6c03b70216b9f665f0118d5e0fa729cedf4fb34d6a34f463',
+        }
     },
     'lbrycrd_regtest': {
         'pubkey_address': 0,
@@ -56,6 +138,7 @@ blockchain_params = {
         'genesis_hash': '6e3fcf1299d4ec5d79c3a4c91d624a4acf9e2e173d95a1a0504f677669687556',
         'max_target': 0x7FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF,
         'genesis_bits': 0x207fffff,
-        'target_timespan': 1
+        'target_timespan': 1,
+        'checkpoints': {}
     }
 }
@@ -0,0 +1,65 @@
+import Queue
+import logging
+import threading
+from functools import partial
+
+log = logging.getLogger(__name__)
+
+
+def subscriber(callback):
+    """The object a callback belongs to: the instance of a bound method, or
+    else the function itself"""
+    func = callback
+    while isinstance(func, partial):
+        func = func.func
+    owner = getattr(func, 'im_self', None)
+    return func if owner is None else owner
+
+
+class CallbackDispatcher(object):
+    """Runs callbacks on a pool of worker threads.
+
+    Everything dispatched with the same key goes to the same worker, so it
+    runs in the order it was dispatched.  Each worker queues at most
+    max_queued callbacks, after which dispatch() blocks until it catches up.
+    Exceptions raised by callbacks are logged and don't stop the worker.
+    """
+
+    def __init__(self, workers, max_queued):
+        self.queues = [Queue.Queue(max_queued) for _ in range(workers)]
+        self.threads = []
+        for i, queue in enumerate(self.queues):
+            thread = threading.Thread(target=self._work, args=(queue,),
+                                      name='callback worker %d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            func, args = item
+            try:
+                func(*args)
+            except Exception:
+                log.exception("callback %r failed", func)
+
+    def dispatch(self, key, func, *args):
+        self.queues[hash((id(key),)) % len(self.queues)].put((func, args))
+
+    def is_worker(self):
+        """Whether the calling thread is one of the workers"""
+        return threading.current_thread() in self.threads
+
+    def queued(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+    def stop(self):
+        """Let the workers finish what is queued, then end them"""
+        for queue in self.queues:
+            queue.put(None)
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
@@ -11,9 +11,17 @@ class Timeout(Exception):
     pass
 
 
+class RequestQueueFull(Exception):
+    pass
+
+
 class InvalidProofError(Exception):
     pass
 
 
 class ChainValidationError(Exception):
     pass
+
+
+class CheckpointError(ChainValidationError):
+    pass
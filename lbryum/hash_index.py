@@ -0,0 +1,146 @@
+import logging
+import mmap
+import os
+import struct
+
+log = logging.getLogger(__name__)
+
+INDEX_MAGIC = 'LBHI'
+# magic, number of slots, number of indexed headers
+INDEX_HEADER = struct.Struct('<4sII')
+# first four bytes of the block hash, height + 1 (0 marks an empty slot)
+INDEX_SLOT = struct.Struct('<II')
+MIN_SLOTS = 1 << 16
+
+
+class HashIndex(object):
+    """An on-disk, linear probing hash table from block hash to height.
+
+    Slots only keep the first four bytes of a hash, so a lookup returns every
+    height whose prefix matches and the caller compares the full hashes.  The
+    table holds the hashes of headers [0, count), is grown to keep it at most
+    half full, and entries are removed with backward shift deletion so that
+    rolling back the tip leaves no tombstones behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self.slots = 0
+        self.count = 0
+
+    def open(self):
+        """Map the index file, creating an empty one if it is missing or unreadable"""
+        self.close()
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size >= INDEX_HEADER.size:
+                    magic, slots, count = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+                    if magic == INDEX_MAGIC and size == INDEX_HEADER.size + slots * INDEX_SLOT.size:
+                        self._map = mmap.mmap(f.fileno(), 0)
+                        self.slots, self.count = slots, count
+                        return
+            log.warning("rebuilding invalid block hash index")
+        self._create(MIN_SLOTS)
+
+    def _create(self, slots):
+        with open(self.path, 'wb+') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, slots, 0))
+            f.truncate(INDEX_HEADER.size + slots * INDEX_SLOT.size)
+            f.flush()
+            self._map = mmap.mmap(f.fileno(), 0)
+        self.slots, self.count = slots, 0
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def flush(self):
+        if self._map is not None:
+            self._map.flush()
+
+    def clear(self):
+        self.close()
+        self._create(MIN_SLOTS)
+
+    def _set_count(self, count):
+        self.count = count
+        INDEX_HEADER.pack_into(self._map, 0, INDEX_MAGIC, self.slots, count)
+
+    def _read_slot(self, slot):
+        return INDEX_SLOT.unpack_from(self._map, INDEX_HEADER.size + slot * INDEX_SLOT.size)
+
+    def _write_slot(self, slot, key, value):
+        INDEX_SLOT.pack_into(self._map, INDEX_HEADER.size + slot * INDEX_SLOT.size, key, value)
+
+    @staticmethod
+    def _key(block_hash):
+        return struct.unpack_from('<I', block_hash)[0]
+
+    def _insert(self, key, value):
+        mask = self.slots - 1
+        slot = key & mask
+        while self._read_slot(slot)[1]:
+            slot = (slot + 1) & mask
+        self._write_slot(slot, key, value)
+
+    def _grow(self):
+        entries = [self._read_slot(slot) for slot in range(self.slots)]
+        count = self.count
+        self.close()
+        self._create(self.slots * 2)
+        for key, value in entries:
+            if value:
+                self._insert(key, value)
+        self._set_count(count)
+
+    def append(self, block_hashes):
+        """Index the hashes of the headers following the last indexed one"""
+        while 2 * (self.count + len(block_hashes)) > self.slots:
+            self._grow()
+        for i, block_hash in enumerate(block_hashes):
+            self._insert(self._key(block_hash), self.count + i + 1)
+        self._set_count(self.count + len(block_hashes))
+
+    def remove(self, block_hashes):
+        """Drop the hashes of the last len(block_hashes) indexed headers"""
+        mask = self.slots - 1
+        first = self.count - len(block_hashes)
+        for i, block_hash in enumerate(block_hashes):
+            key, value = self._key(block_hash), first + i + 1
+            slot = key & mask
+            while self._read_slot(slot) != (key, value):
+                if not self._read_slot(slot)[1]:
+                    raise KeyError(first + i)
+                slot = (slot + 1) & mask
+            # shift back any entry of the probe run that can't be found past the hole
+            empty, slot = slot, (slot + 1) & mask
+            while True:
+                entry = self._read_slot(slot)
+                if not entry[1]:
+                    break
+                home = entry[0] & mask
+                if (slot - home) & mask >= (slot - empty) & mask:
+                    self._write_slot(empty, *entry)
+                    empty = slot
+                slot = (slot + 1) & mask
+            self._write_slot(empty, 0, 0)
+        self._set_count(first)
+
+    def candidates(self, block_hash):
+        """Returns the heights of indexed headers whose hash may be block_hash"""
+        if not self.slots:
+            return []
+        mask = self.slots - 1
+        key = self._key(block_hash)
+        slot = key & mask
+        heights = []
+        while True:
+            entry_key, value = self._read_slot(slot)
+            if not value:
+                return heights
+            if entry_key == key:
+                heights.append(value - 1)
+            slot = (slot + 1) & mask
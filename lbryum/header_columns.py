@@ -0,0 +1,115 @@
+import logging
+
+from lbryum.constants import HEADER_SIZE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger(__name__)
+
+# number of blocks in the median time past, as in lbrycrd
+MEDIAN_TIME_SPAN = 11
+
+if np is not None:
+    # the raw header layout, see HEADER_STRUCT in blockchain.py
+    HEADER_DTYPE = np.dtype([
+        ('version', '<u4'),
+        ('prev_block_hash', 'S32'),
+        ('merkle_root', 'S32'),
+        ('claim_trie_root', 'S32'),
+        ('timestamp', '<u4'),
+        ('bits', '<u4'),
+        ('nonce', '<u4'),
+    ])
+    assert HEADER_DTYPE.itemsize == HEADER_SIZE
+
+
+class HeaderColumns(object):
+    """Columns of a run of raw headers as NumPy arrays, for statistics over the
+    whole chain without building a header dict per block.
+
+    NumPy is an optional dependency; constructing HeaderColumns without it
+    raises ImportError.
+    """
+
+    def __init__(self, data, start_height=0):
+        if np is None:
+            raise ImportError("header columns require numpy")
+        count = len(data) / HEADER_SIZE
+        headers = np.frombuffer(data, dtype=HEADER_DTYPE, count=count)
+        # copy the columns so they don't hold on to the buffer they came from
+        self.timestamps = headers['timestamp'].astype(np.int64)
+        self.bits = headers['bits'].copy()
+        self.heights = np.arange(start_height, start_height + count, dtype=np.int64)
+
+    @classmethod
+    def from_store(cls, store):
+        """The columns of every header in a HeaderStore"""
+        with store.lock:
+            store.flush()
+            return cls(store.buffer())
+
+    def __len__(self):
+        return len(self.heights)
+
+    def _index(self, height):
+        return height - self.heights[0] if len(self.heights) else 0
+
+    def heights_between(self, start_time, end_time):
+        """Heights of the blocks with start_time <= timestamp < end_time"""
+        mask = (self.timestamps >= start_time) & (self.timestamps < end_time)
+        return self.heights[mask]
+
+    def block_intervals(self):
+        """Seconds between each block and the one before it, starting at the second block"""
+        return np.diff(self.timestamps)
+
+    def mean_block_time(self, start_height=None, end_height=None):
+        """Average seconds between blocks from start_height up to end_height (inclusive)"""
+        start = 0 if start_height is None else self._index(start_height)
+        end = len(self) - 1 if end_height is None else self._index(end_height)
+        if end <= start:
+            return None
+        return float(self.timestamps[end] - self.timestamps[start]) / (end - start)
+
+    def median_time_past(self, span=MEDIAN_TIME_SPAN):
+        """The median timestamp of each block and the span - 1 blocks before it"""
+        count = len(self)
+        result = np.empty(count, dtype=np.int64)
+        # the first blocks have fewer ancestors than the span
+        for i in range(min(span - 1, count)):
+            result[i] = np.median(self.timestamps[:i + 1])
+        if count >= span:
+            stride = self.timestamps.strides[0]
+            windows = np.lib.stride_tricks.as_strided(
+                self.timestamps, shape=(count - span + 1, span), strides=(stride, stride))
+            result[span - 1:] = np.median(windows, axis=1)
+        return result
+
+    def valid_bits(self):
+        """Whether each header's compact target passes LbryCrd.check_bits"""
+        exponent = self.bits >> 24
+        mantissa = self.bits & 0xffffff
+        return (exponent >= 0x03) & (exponent <= 0x1f) & \
+               (mantissa >= 0x8000) & (mantissa <= 0x7fffff)
+
+    def targets(self):
+        """Each header's target, as a float since NumPy has no 256 bit integers"""
+        exponent = (self.bits >> 24).astype(np.int64)
+        mantissa = (self.bits & 0xffffff).astype(np.float64)
+        return np.ldexp(mantissa, 8 * (exponent - 3))
+
+    def work(self):
+        """The approximate number of hashes needed to find each block"""
+        return np.ldexp(1.0, 256) / (self.targets() + 1)
+
+    def hash_rate(self, start_height=None, end_height=None):
+        """Estimated network hashes per second over a range of blocks"""
+        start = 0 if start_height is None else self._index(start_height)
+        end = len(self) - 1 if end_height is None else self._index(end_height)
+        elapsed = self.timestamps[end] - self.timestamps[start] if end > start else 0
+        if elapsed <= 0:
+            return None
+        return float(self.work()[start + 1:end + 1].sum()) / elapsed
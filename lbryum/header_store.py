@@ -0,0 +1,234 @@
+import logging
+import mmap
+import os
+import threading
+
+from lbryum.constants import HEADER_SIZE
+from lbryum.hash_index import HashIndex
+from lbryum.hashing import Hash
+
+log = logging.getLogger(__name__)
+
+# headers held in memory before they are written out
+DEFAULT_MAX_PENDING = 1920
+
+
+class HeaderStore(object):
+    """Random access to the raw headers file through a single long-lived mmap.
+
+    Reads are served as slices of the mapping, so looking up a header costs no
+    syscalls.  The mapping is re-created whenever the file grows, either
+    through flush() or after an external change followed by refresh().
+
+    A HashIndex kept next to the headers file maps block hashes back to
+    heights.  It follows every write and truncation, and is caught up with the
+    headers file on refresh().
+
+    Writes are held in memory, where reads see them, until max_pending headers
+    have accumulated or flush() is called.  They are then written out as
+    contiguous runs followed by a single fsync.
+    """
+
+    def __init__(self, path, max_pending=DEFAULT_MAX_PENDING):
+        self.path = path
+        self.max_pending = max_pending
+        self.lock = threading.RLock()
+        self._map = None
+        self._size = 0
+        self._exists = False
+        # height -> raw header not yet written to the file
+        self._pending = {}
+        # number of headers, including pending ones
+        self._count = 0
+        self.index = HashIndex(path + '.index')
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._size = 0
+
+    def _update_count(self):
+        self._count = self._size / HEADER_SIZE
+        if self._pending:
+            self._count = max(self._count, max(self._pending) + 1)
+
+    def refresh(self):
+        """(Re-)map the headers file, picking up any change in its size"""
+        with self.lock:
+            self._exists = os.path.exists(self.path)
+            if not self._exists:
+                self._close_map()
+            else:
+                size = os.path.getsize(self.path)
+                if self._map is None or size != self._size:
+                    self._close_map()
+                    # an empty file cannot be mapped
+                    if size:
+                        with open(self.path, 'rb') as f:
+                            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        self._size = len(self._map)
+            self._update_count()
+            self._refresh_index()
+
+    def _open_index(self):
+        if self.index.slots == 0:
+            self.index.open()
+
+    def _refresh_index(self):
+        self._open_index()
+        last = self.index.count - 1
+        if last >= 0 and (self.index.count > self._count or self.find(self._hash(last)) != last):
+            # the headers file was shrunk or replaced behind our back
+            self.index.clear()
+        self._index_tail()
+
+    def _hash(self, height):
+        raw = self.read_raw(height)
+        return None if raw is None else Hash(raw)
+
+    def _index_tail(self):
+        """Index the headers following the last indexed one, up to the first gap"""
+        self._open_index()
+        hashes = []
+        height = self.index.count
+        while height < self._count:
+            block_hash = self._hash(height)
+            if block_hash is None:
+                break
+            hashes.append(block_hash)
+            height += 1
+        if hashes:
+            self.index.append(hashes)
+
+    def _unindex_from(self, height):
+        """Drop the indexed hashes of headers from height onwards, before they change"""
+        self._open_index()
+        if height < self.index.count:
+            hashes = [self._hash(h) for h in range(height, self.index.count)]
+            try:
+                self.index.remove(hashes)
+            except (KeyError, TypeError):
+                log.warning("rebuilding block hash index")
+                self.index.clear()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self._close_map()
+            self.index.close()
+
+    def exists(self):
+        return self._exists or bool(self._pending)
+
+    def size(self):
+        return self._size
+
+    def count(self):
+        """Number of complete headers, including those not yet flushed"""
+        return self._count
+
+    def read_raw(self, height):
+        """Returns the raw serialized header at height, or None"""
+        if height < 0:
+            return None
+        offset = height * HEADER_SIZE
+        with self.lock:
+            if height in self._pending:
+                return self._pending[height]
+            if offset + HEADER_SIZE > self._size:
+                return None
+            return self._map[offset:offset + HEADER_SIZE]
+
+    def buffer(self):
+        """A zero copy view of the headers written to the file, only valid until
+        the next write, truncation or refresh"""
+        with self.lock:
+            if self._map is None:
+                return ''
+            return buffer(self._map, 0, self._size / HEADER_SIZE * HEADER_SIZE)
+
+    def find(self, block_hash):
+        """Returns the height of the header with the given (raw) hash, or None"""
+        with self.lock:
+            for height in self.index.candidates(block_hash):
+                if self._hash(height) == block_hash:
+                    return height
+
+    def read_range(self, height, count):
+        """Returns the raw serialized headers [height, height + count) that exist"""
+        with self.lock:
+            if self._pending:
+                headers = []
+                for h in range(height, min(height + count, self._count)):
+                    raw = self.read_raw(h)
+                    if raw is None:
+                        break
+                    headers.append(raw)
+                return ''.join(headers)
+            start = height * HEADER_SIZE
+            end = min(start + count * HEADER_SIZE, self._size / HEADER_SIZE * HEADER_SIZE)
+            if start >= end:
+                return ''
+            return self._map[start:end]
+
+    def truncate(self, count):
+        """Drop every header from height count onwards"""
+        with self.lock:
+            self._unindex_from(count)
+            for height in [h for h in self._pending if h >= count]:
+                del self._pending[height]
+            self.flush()
+            if not self._exists:
+                open(self.path, 'wb').close()
+            elif count < self._size / HEADER_SIZE:
+                # the file can't be truncated while it is mapped on some platforms
+                self._close_map()
+                with open(self.path, 'rb+') as f:
+                    f.truncate(count * HEADER_SIZE)
+            self.refresh()
+
+    def replace(self, height, data):
+        """Atomically make data the headers from height onwards"""
+        with self.lock:
+            self.truncate(height)
+            self.write(height, data)
+            self.flush()
+
+    def write(self, height, data):
+        """Queue one or more raw headers starting at height to be written"""
+        with self.lock:
+            count = len(data) / HEADER_SIZE
+            self._unindex_from(height)
+            for i in range(count):
+                self._pending[height + i] = data[i * HEADER_SIZE:(i + 1) * HEADER_SIZE]
+            self._count = max(self._count, height + count)
+            self._index_tail()
+            if len(self._pending) >= self.max_pending:
+                self.flush()
+
+    def flush(self):
+        """Write out pending headers in contiguous runs, then fsync once"""
+        with self.lock:
+            if not self._pending:
+                return
+            heights = sorted(self._pending)
+            runs = []
+            start = prev = heights[0]
+            for height in heights[1:]:
+                if height != prev + 1:
+                    runs.append((start, prev))
+                    start = height
+                prev = height
+            runs.append((start, prev))
+            mode = 'rb+' if os.path.exists(self.path) else 'wb+'
+            with open(self.path, mode) as f:
+                for start, end in runs:
+                    f.seek(start * HEADER_SIZE)
+                    f.write(''.join(self._pending[h] for h in range(start, end + 1)))
+                f.flush()
+                os.fsync(f.fileno())
+            self.index.flush()
+            log.debug("wrote %i headers in %i runs", len(heights), len(runs))
+            self._pending.clear()
+            self.refresh()
@@ -1,3 +1,6 @@
+import Queue
+import bisect
+import errno
 import logging
 import os
 import socket
@@ -6,8 +9,9 @@ import threading
 import time
 import requests.certs
 from lbryum.util import PrintError
+from lbryum.constants import MAX_INFLIGHT_REQUESTS, PRIORITY_NORMAL
 from lbryum.errors import Timeout
-from lbryum.socket_pipe import SocketPipe
+from lbryum.socket_pipe import SocketPipe, DEFAULT_READ_SIZE
 
 if getattr(sys, 'frozen', False) and os.name == "nt":
     # When frozen for windows distribution, get the include cert
@@ -17,12 +21,21 @@ else:
 
 log = logging.getLogger(__name__)
 
+# most requests sent in one JSON-RPC batch
+MAX_BATCH_REQUESTS = 500
+# weight of the latest sample in the moving averages of ServerStats
+EWMA_ALPHA = 0.2
+
 
 def make_dict(args):
     m, p, i = args
     return {'method': m, 'params': p, 'id': i}
 
 
+def make_batch(requests):
+    return [dict(make_dict(args), jsonrpc='2.0') for args in requests]
+
+
 def Connection(server, queue, config_path):
     """Makes asynchronous connections to a remote lbryum server.
     Returns the running thread that is making the connection.
@@ -84,6 +97,132 @@ class TcpConnection(threading.Thread, PrintError):
         self.queue.put((self.server, socket))
 
 
+class Resolver(threading.Thread):
+    """Looks up server addresses one at a time on a single thread, for
+    connections made from the network loop.  Results are put on the queue as
+    (server, addresses), with addresses None if the lookup failed, and
+    on_result is called after each one.
+    """
+
+    def __init__(self, queue, on_result=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.on_result = on_result
+        self.requests = Queue.Queue()
+
+    def resolve(self, server):
+        self.requests.put(server)
+
+    def run(self):
+        while True:
+            server = self.requests.get()
+            host, port, _ = server.split(':')
+            try:
+                addresses = socket.getaddrinfo(str(host), int(port), socket.AF_UNSPEC,
+                                               socket.SOCK_STREAM)
+            except socket.gaierror:
+                log.error("cannot resolve hostname %s", host)
+                addresses = None
+            self.queue.put((server, addresses))
+            if self.on_result:
+                self.on_result()
+
+
+class PendingConnection(object):
+    """A non-blocking connection attempt to a server, driven by the network loop
+    instead of a thread.  Each resolved address is tried in turn, for at most
+    timeout seconds.  Wait for the socket (fileno()) to become writable, then
+    call finish().
+    """
+
+    def __init__(self, server, addresses, timeout):
+        self.server = server
+        self.addresses = list(addresses)
+        self.timeout = timeout
+        self.socket = None
+        self.deadline = None
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def has_timed_out(self):
+        return time.time() > self.deadline
+
+    def connect_next(self):
+        """Start connecting to the next address.  Returns False once there are none left"""
+        self.close()
+        while self.addresses:
+            res = self.addresses.pop(0)
+            s = socket.socket(res[0], socket.SOCK_STREAM)
+            s.setblocking(False)
+            err = s.connect_ex(res[4])
+            if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+                self.socket = s
+                self.deadline = time.time() + self.timeout
+                return True
+            log.error('Failed to connect to %s: %s', res[4], os.strerror(err))
+            s.close()
+        return False
+
+    def finish(self):
+        """Returns the connected socket once the connection is made, otherwise None"""
+        err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            log.error('Failed to connect to %s: %s', self.server, os.strerror(err))
+            return None
+        s, self.socket = self.socket, None
+        s.settimeout(2)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        log.info("connected to %s", self.server)
+        return s
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+class ServerStats(object):
+    """Exponentially weighted moving averages of a server's response time,
+    share of error responses and share of failed connections, kept across
+    connections to it.  A lower score() is better.
+    """
+
+    def __init__(self):
+        self.rtt = None
+        self.error_rate = 0.0
+        self.failure_rate = 0.0
+        self.responses = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    @staticmethod
+    def _average(average, sample):
+        return sample if average is None else average + EWMA_ALPHA * (sample - average)
+
+    def add_response(self, rtt, error):
+        self.responses += 1
+        self.errors += bool(error)
+        self.rtt = self._average(self.rtt, rtt)
+        self.error_rate = self._average(self.error_rate, float(bool(error)))
+
+    def add_connection(self, failed):
+        self.failures += bool(failed)
+        self.failure_rate = self._average(self.failure_rate, float(bool(failed)))
+
+    def add_timeout(self):
+        self.timeouts += 1
+        self.add_connection(True)
+
+    def score(self):
+        """Response time penalized for errors and failures, None until timed"""
+        if self.rtt is None:
+            return None
+        return self.rtt * (1 + 4 * self.error_rate) * (1 + 4 * self.failure_rate)
+
+
 class Interface(PrintError):
     """The Interface class handles a socket connected to a single remote
     lbryum server.  It's exposed API is:
@@ -93,17 +232,35 @@ class Interface(PrintError):
     - Member variable server.
     """
 
-    def __init__(self, server, socket):
+    def __init__(self, server, socket, read_size=DEFAULT_READ_SIZE, batch_requests=False,
+                 stats=None, max_inflight=MAX_INFLIGHT_REQUESTS, network_stats=None):
         self.server = server
         self.host, _, _ = server.split(':')
         self.socket = socket
 
-        self.pipe = SocketPipe(socket)
+        self.pipe = SocketPipe(socket, read_size)
         self.pipe.set_timeout(0.0)  # Don't wait for data
         # Dump network messages.  Set at runtime from the console.
         self.debug = False
+        # requests to send, kept in order of their priorities
         self.unsent_requests = []
+        self.unsent_priorities = []
         self.unanswered_requests = {}
+        # priorities of the unanswered requests, by id
+        self.sent_priorities = {}
+        # at most max_inflight requests are sent without being answered
+        self.max_inflight = max_inflight
+        # Send the requests queued at once as a JSON-RPC 2.0 batch, and the ids
+        # of batched requests not answered yet
+        self.batch_requests = batch_requests
+        self.batched_ids = set()
+        self.stats = stats or ServerStats()
+        # a NetworkStats counting requests by method and server, if any
+        self.network_stats = network_stats
+        # when each unanswered request was written, by id, and the response
+        # times of the requests answered by the last get_responses(), by id
+        self.sent_times = {}
+        self.response_rtts = {}
         # Set last ping to zero to ensure immediate ping
         self.last_request = time.time()
         self.last_ping = 0
@@ -125,27 +282,71 @@ class Interface(PrintError):
         finally:
             self.socket.close()
 
-    def queue_request(self, *args):  # method, params, _id
+    def queue_request(self, method, params, message_id, priority=PRIORITY_NORMAL):
         '''Queue a request, later to be send with send_requests when the
-        socket is available for writing.
+        socket is available for writing.  It goes after the queued requests
+        of the same or a more urgent priority.
         '''
         self.request_time = time.time()
-        self.unsent_requests.append(args)
+        i = bisect.bisect_right(self.unsent_priorities, priority)
+        self.unsent_requests.insert(i, (method, params, message_id))
+        self.unsent_priorities.insert(i, priority)
+
+    def can_send(self):
+        '''Whether there are queued requests and room for them in flight.'''
+        return bool(self.unsent_requests) and len(self.unanswered_requests) < self.max_inflight
 
     def send_requests(self):
-        '''Sends all queued requests.  Returns False on failure.'''
-        wire_requests = map(make_dict, self.unsent_requests)
+        '''Sends queued requests, as many as there is room for in flight.
+        Returns False on failure.'''
+        room = max(0, self.max_inflight - len(self.unanswered_requests))
+        requests = self.unsent_requests[:room]
+        batch = self.batch_requests and len(requests) > 1
+        if batch:
+            wire_requests = [make_batch(requests[i:i + MAX_BATCH_REQUESTS])
+                             for i in range(0, len(requests), MAX_BATCH_REQUESTS)]
+        else:
+            wire_requests = map(make_dict, requests)
         try:
-            self.pipe.send_all(wire_requests)
+            sizes = self.pipe.send_all(wire_requests)
         except socket.error:
             log.exception("socket error")
             return False
-        for request in self.unsent_requests:
+        now = time.time()
+        if self.network_stats:
+            self._count_requests(requests, sizes, batch)
+        for request, priority in zip(requests, self.unsent_priorities):
             log.debug("--> %s", request)
             self.unanswered_requests[request[2]] = request
-        self.unsent_requests = []
+            self.sent_priorities[request[2]] = priority
+            self.sent_times[request[2]] = now
+            if batch:
+                self.batched_ids.add(request[2])
+        self.unsent_requests = self.unsent_requests[room:]
+        self.unsent_priorities = self.unsent_priorities[room:]
         return True
 
+    def _count_requests(self, requests, sizes, batch):
+        if batch:
+            # share the size of each batch between its requests
+            chunks = [requests[i:i + MAX_BATCH_REQUESTS]
+                      for i in range(0, len(requests), MAX_BATCH_REQUESTS)]
+            sizes = [size / len(chunk) for size, chunk in zip(sizes, chunks) for _ in chunk]
+        for request, size in zip(requests, sizes):
+            self.network_stats.add_request(self.server, request[0], size)
+
+    def batch_rejected(self):
+        '''The server answered a batch with an error, so it doesn't support
+        them.  Queue the batched requests again to be sent one by one.'''
+        log.warning("%s doesn't support batched requests", self.server)
+        self.batch_requests = False
+        for wire_id in sorted(self.batched_ids):
+            request = self.unanswered_requests.pop(wire_id, None)
+            priority = self.sent_priorities.pop(wire_id, PRIORITY_NORMAL)
+            if request:
+                self.queue_request(*request, priority=priority)
+        self.batched_ids.clear()
+
     def ping_required(self):
         '''Maintains time since last ping.  Returns True if a ping should
         be sent.
@@ -161,6 +362,7 @@ class Interface(PrintError):
         request_time = time.time() - self.request_time
         if self.unanswered_requests and request_time > 10 and self.pipe.idle_time() > 10:
             log.info("timeout %i", len(self.unanswered_requests))
+            self.stats.add_timeout()
             return True
 
         return False
@@ -175,6 +377,7 @@ class Interface(PrintError):
         or the remote server is misbehaving, a (None, None) will appear.
         '''
         responses = []
+        self.response_rtts = {}
         while True:
             try:
                 response = self.pipe.get()
@@ -186,16 +389,48 @@ class Interface(PrintError):
                 log.warning("connection closed remotely")
                 break
             log.debug("<-- %s", response)
-            wire_id = response.get('id', None)
-            if wire_id is None:  # Notification
-                responses.append((None, response))
-            else:
-                request = self.unanswered_requests.pop(wire_id, None)
-                if request:
-                    responses.append((request, response))
-                else:
-                    log.error("unknown wire ID: %s", wire_id)
-                    responses.append((None, None))  # Signal
-                    break
+            # a batch of responses is handled as if they arrived one by one
+            batch = response if isinstance(response, list) else [response]
+            size = self.pipe.message_size / max(len(batch), 1)
+            if not all(self._add_response(responses, r, size) for r in batch):
+                break
 
         return responses
+
+    def _add_response(self, responses, response, size=0):
+        '''Add a response read from the pipe to responses.  Returns False if
+        the server is misbehaving.'''
+        if not isinstance(response, dict):
+            log.error("invalid response: %s", response)
+            responses.append((None, None))  # Signal
+            return False
+        wire_id = response.get('id', None)
+        if wire_id is None:
+            if 'method' in response:  # Notification
+                if self.network_stats:
+                    self.network_stats.add_notification(self.server, response['method'], size)
+                responses.append((None, response))
+                return True
+            if self.batched_ids and response.get('error'):
+                self.batch_rejected()
+                return True
+            log.error("invalid response: %s", response)
+            responses.append((None, None))  # Signal
+            return False
+        request = self.unanswered_requests.pop(wire_id, None)
+        self.sent_priorities.pop(wire_id, None)
+        if request:
+            self.batched_ids.discard(wire_id)
+            sent_time = self.sent_times.pop(wire_id, None)
+            rtt = None if sent_time is None else time.time() - sent_time
+            if rtt is not None:
+                self.response_rtts[wire_id] = rtt
+                self.stats.add_response(rtt, response.get('error'))
+            if self.network_stats:
+                self.network_stats.add_response(self.server, request[0], rtt, size,
+                                                response.get('error'))
+            responses.append((request, response))
+            return True
+        log.error("unknown wire ID: %s", wire_id)
+        responses.append((None, None))  # Signal
+        return False
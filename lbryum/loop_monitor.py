@@ -0,0 +1,136 @@
+import logging
+import sys
+import threading
+import time
+import traceback
+import types
+from collections import defaultdict, deque
+from functools import partial
+
+log = logging.getLogger(__name__)
+
+# stalls kept for get_stats()
+MAX_STALLS = 20
+
+
+def callback_site(callback):
+    """A readable name for the code a callback runs, such as
+    'lbryum.synchronizer.Synchronizer.tx_response'"""
+    func = callback
+    while isinstance(func, partial):
+        func = func.func
+    name = getattr(func, '__name__', None) or type(func).__name__
+    owner = getattr(func, 'im_self', None)
+    if owner is not None:
+        cls = owner if isinstance(owner, (type, types.ClassType)) else type(owner)
+        name = '%s.%s' % (cls.__name__, name)
+    module = getattr(func, '__module__', None)
+    return '%s.%s' % (module, name) if module else name
+
+
+class SiteStats(object):
+    """Number of runs and cumulative and longest time of a loop phase or callback site"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def as_dict(self):
+        return {'count': self.count, 'total': self.total, 'max': self.max}
+
+
+class LoopMonitor(object):
+    """Times the phases of an event loop and the callbacks it runs.
+
+    Callbacks slower than slow_threshold seconds are logged.  Once started,
+    a watchdog thread samples the stack of the loop thread whenever a phase
+    has been running for stall_threshold seconds, so that the code holding
+    up the loop can be found; a stall_threshold of 0 disables it.
+    """
+
+    def __init__(self, stall_threshold, slow_threshold):
+        self.stall_threshold = stall_threshold
+        self.slow_threshold = slow_threshold
+        self.lock = threading.Lock()
+        self.phases = defaultdict(SiteStats)
+        self.callbacks = defaultdict(SiteStats)
+        self.stalls = deque(maxlen=MAX_STALLS)
+        # (site, start time) of what the loop thread is running, outermost first
+        self.running = []
+        self.thread_id = None
+        self.watchdog = None
+        # start time of the last phase reported as stalled
+        self.reported = None
+
+    def start(self):
+        """Watch the calling thread"""
+        self.thread_id = threading.current_thread().ident
+        if self.stall_threshold > 0 and self.watchdog is None:
+            self.watchdog = threading.Thread(target=self._watch, name='loop watchdog')
+            self.watchdog.daemon = True
+            self.watchdog.start()
+
+    def stop(self):
+        self.watchdog = None
+
+    def _watch(self):
+        thread = self.watchdog
+        while self.watchdog is thread:
+            time.sleep(self.stall_threshold / 2.0)
+            self.check()
+
+    def check(self):
+        """Report the phase running on the loop thread if it is stalled"""
+        running = list(self.running)
+        if not running:
+            return
+        phase, start = running[0]
+        stalled = time.time() - start
+        if stalled < self.stall_threshold or start == self.reported:
+            return
+        self.reported = start
+        frame = sys._current_frames().get(self.thread_id)
+        stack = traceback.format_stack(frame) if frame is not None else []
+        site = running[-1][0]
+        log.warning("network loop stalled for %.1f s in %s:\n%s", stalled, site, ''.join(stack))
+        with self.lock:
+            self.stalls.append({'time': time.time(), 'phase': phase, 'site': site,
+                                'seconds': stalled, 'stack': stack})
+
+    def _run(self, sites, site, func, args):
+        # callbacks may also be timed on other threads, only the loop thread
+        # is watched for stalls
+        on_loop = self.thread_id in (None, threading.current_thread().ident)
+        start = time.time()
+        if on_loop:
+            self.running.append((site, start))
+        try:
+            return func(*args)
+        finally:
+            if on_loop:
+                self.running.pop()
+            elapsed = time.time() - start
+            with self.lock:
+                sites[site].add(elapsed)
+            if sites is self.callbacks and elapsed > self.slow_threshold:
+                log.warning("slow callback %s took %.3f s", site, elapsed)
+
+    def run_phase(self, name, func, *args):
+        return self._run(self.phases, name, func, args)
+
+    def call(self, callback, *args):
+        return self._run(self.callbacks, callback_site(callback), callback, args)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'phases': dict((k, v.as_dict()) for k, v in self.phases.iteritems()),
+                'callbacks': dict((k, v.as_dict()) for k, v in self.callbacks.iteritems()),
+                'stalls': list(self.stalls),
+            }
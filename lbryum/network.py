@@ -1,29 +1,54 @@
 import Queue
-import errno
+import copy
+import json
 import logging
 import os
 import random
 import re
-import select
 import socket
 import time
-from collections import defaultdict, deque
-from threading import Lock
+from collections import defaultdict, deque, namedtuple
+from functools import partial
+from threading import Condition, Lock, Thread, current_thread
 
 from lbryum import __version__ as LBRYUM_VERSION
 from lbryum.constants import COIN, BLOCKS_PER_CHUNK, DEFAULT_PORTS, proxy_modes
-from lbryum.constants import SERVER_RETRY_INTERVAL, NODES_RETRY_INTERVAL
+from lbryum.constants import SERVER_RETRY_INTERVAL, NODES_RETRY_INTERVAL, CONNECT_TIMEOUT
+from lbryum.constants import CHUNK_REQUEST_TIMEOUT, MAX_CHUNK_REWINDS, IDEMPOTENT_METHODS
+from lbryum.constants import SERVER_EXPLORATION_RATE, SERVER_SWITCH_RATIO, SERVER_SWITCH_INTERVAL
+from lbryum.constants import MIN_RTT_SAMPLES, SERVER_PROBE_WORKERS, SERVER_PROBE_CACHE_AGE
+from lbryum.constants import IDEMPOTENT_REQUEST_TIMEOUT, REQUEST_TIMEOUT, HEDGE_DELAY
+from lbryum.constants import HEDGE_MIN_DELAY, HEDGE_MIN_SAMPLES, HEDGE_SAMPLES
+from lbryum.constants import MAX_INFLIGHT_REQUESTS, MAX_PENDING_REQUESTS, SEND_TIMEOUT
+from lbryum.constants import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from lbryum.constants import LOOP_STALL_THRESHOLD, SLOW_CALLBACK_THRESHOLD, CALLBACK_QUEUE_SIZE
+from lbryum.dispatcher import CallbackDispatcher, subscriber
+from lbryum.errors import RequestQueueFull
+from lbryum.network_stats import NetworkStats
 from lbryum.util import DaemonThread, normalize_version
 from lbryum.blockchain import get_blockchain
-from lbryum.interface import Connection, Interface
+from lbryum.hashing import hash_decode
+from lbryum.interface import Connection, Interface, PendingConnection, Resolver, ServerStats
+from lbryum.loop_monitor import LoopMonitor
+from lbryum.poller import make_poller, Waker, EVENT_READ, EVENT_WRITE
+from lbryum.request_lanes import RequestLanes
+from lbryum.response_cache import ResponseCache, CACHE_POLICIES, DEFAULT_CACHE_SIZE
 from lbryum.simple_config import SimpleConfig
+from lbryum.socket_pipe import DEFAULT_READ_SIZE
 from lbryum.version import PROTOCOL_VERSION
 
 log = logging.getLogger(__name__)
 
+# a request from a client, waiting to be sent and then to be answered
+ClientRequest = namedtuple('ClientRequest', ['method', 'params', 'callback', 'timeout', 'priority'])
+
 
 def is_online(host, ports):
-    ip = socket.gethostbyname(host)
+    try:
+        ip = socket.gethostbyname(host)
+    except socket.error:
+        log.warning("cannot resolve %s", host)
+        return False
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.settimeout(2)
     result = sock.connect_ex((ip, int(ports['t'])))
@@ -34,6 +59,53 @@ def is_online(host, ports):
     return False
 
 
+def probe_servers(servers, workers=SERVER_PROBE_WORKERS):
+    """Runs is_online() for each of the {host: ports} servers on up to workers
+    threads at once, and returns those that are online"""
+    hosts = Queue.Queue()
+    for host in servers:
+        hosts.put(host)
+    online = {}
+
+    def probe():
+        while True:
+            try:
+                host = hosts.get_nowait()
+            except Queue.Empty:
+                return
+            if is_online(host, servers[host]):
+                online[host] = servers[host]
+
+    threads = [Thread(target=probe) for _ in range(min(workers, len(servers)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return online
+
+
+def read_probed_servers(path, servers):
+    """The servers found online by the last probe saved at path, restricted to
+    servers, and when they were probed.  Returns ({}, None) without a usable file"""
+    try:
+        with open(path, 'r') as f:
+            probe = json.load(f)
+        probed = float(probe['time'])
+        online = dict((str(host), servers[host]) for host in probe['online'] if host in servers)
+    except (IOError, ValueError, KeyError, TypeError):
+        return {}, None
+    return online, probed
+
+
+def save_probed_servers(path, online, probed):
+    try:
+        with open(path, 'w') as f:
+            json.dump({'time': probed, 'online': sorted(online)}, f)
+    except IOError as e:
+        log.warning("could not save probed servers: %s", e)
+
+
 def parse_servers(result):
     """ parse servers list into dict format"""
     servers = {}
@@ -85,6 +157,19 @@ def pick_random_server(hostmap, protocol='t', exclude_set=set()):
     return random.choice(eligible) if eligible else None
 
 
+def pick_fastest_server(servers, server_stats, exploration_rate=SERVER_EXPLORATION_RATE):
+    """Picks the server with the best ServerStats score, or a random one if
+    none has been timed yet and for a share of picks to try other servers"""
+    servers = list(servers)
+    if not servers:
+        return None
+    scored = [(server_stats[server].score(), server) for server in servers
+              if server in server_stats and server_stats[server].score() is not None]
+    if not scored or random.random() < exploration_rate:
+        return random.choice(servers)
+    return min(scored)[1]
+
+
 def serialize_proxy(p):
     if type(p) != dict:
         return None
@@ -127,7 +212,9 @@ class Network(DaemonThread):
     """The Network class manages a set of connections to remote lbryum
     servers, each connected socket is handled by an Interface() object.
     Connections are initiated by a Connection() thread which stops once
-    the connection succeeds or fails.
+    the connection succeeds or fails.  With the 'network_engine' setting
+    set to 'loop' they are instead made without blocking from the run loop,
+    using a single Resolver() thread for host name lookups.
 
     Our external API:
 
@@ -145,6 +232,16 @@ class Network(DaemonThread):
         self.blockchain = get_blockchain(self.config, self)
         # A deque of interface header requests, processed left-to-right
         self.bc_requests = deque()
+        # Chunk catch-up: the next chunk to connect, the last one wanted, the
+        # outstanding requests (idx -> (interface, time)), chunks received out
+        # of order (idx -> (interface, hex)) and interfaces that failed a chunk
+        self.chunk_next = None
+        self.chunk_target = -1
+        self.chunk_requests = {}
+        self.chunk_buffer = {}
+        self.chunk_failures = defaultdict(set)
+        self.chunk_rewinds = 0
+        self.chunk_window = int(self.config.get('chunk_request_window', 16))
         # Server for addresses and transactions
         self.default_server = self.config.get('server')
         # Sanitize default server
@@ -159,7 +256,14 @@ class Network(DaemonThread):
             self.default_server = pick_random_server(default_servers)
 
         self.lock = Lock()
-        self.pending_sends = []
+        # (method, params, callback, priority, timeout) of client requests not
+        # yet queued on an interface, by priority; send() blocks while it holds
+        # max_pending messages
+        self.pending_sends = RequestLanes()
+        self.pending_cv = Condition(self.lock)
+        self.max_pending = int(self.config.get('max_pending_requests', MAX_PENDING_REQUESTS))
+        self.max_inflight = int(self.config.get('max_inflight_requests', MAX_INFLIGHT_REQUESTS))
+        self.send_timeout = float(self.config.get('send_timeout', SEND_TIMEOUT))
         self.message_id = 0
         self.debug = False
         self.irc_servers = {}  # returned by interface (list from irc)
@@ -185,11 +289,43 @@ class Network(DaemonThread):
 
         # subscriptions and requests
         self.subscribed_addresses = set()
-        # Requests from client we've not seen a response to
+        # Requests from client we've not seen a response to, as ClientRequest by id
         self.unanswered_requests = {}
+        # (callback, timeout, time joined) of the callers waiting on an idempotent
+        # request in flight, by request key
+        self.inflight_requests = {}
+        # Idempotent client requests can be answered by any interface that is
+        # up to date; those sent to another interface than the main one, by id
+        self.balance_requests = self.config.get('balance_requests', True)
+        self.request_interfaces = {}
+        # The ids of the two copies of hedged requests, mapped to each other,
+        # and recent response times by method
+        self.hedged_requests = {}
+        self.response_times = defaultdict(lambda: deque(maxlen=HEDGE_SAMPLES))
+        self.request_timeouts = self.config.get('request_timeouts') or {}
+        self.response_cache = ResponseCache(
+            int(self.config.get('response_cache_size', DEFAULT_CACHE_SIZE)))
         # retry times
         self.server_retry_time = time.time()
         self.nodes_retry_time = time.time()
+        self.server_switch_time = time.time()
+        # server -> ServerStats, kept across connections
+        self.server_stats = {}
+        # request counters and response times by method and by server
+        self.network_stats = NetworkStats()
+        # time spent in each phase of the run loop and in each callback
+        self.loop_monitor = LoopMonitor(
+            float(self.config.get('loop_stall_threshold', LOOP_STALL_THRESHOLD)),
+            float(self.config.get('slow_callback_threshold', SLOW_CALLBACK_THRESHOLD)))
+        # With callback_workers set, client callbacks and jobs run on that many
+        # worker threads rather than on the network thread; jobs still queued
+        # there from an earlier pass of the loop are not queued again
+        self.dispatcher = None
+        self.dispatched_jobs = set()
+        workers = int(self.config.get('callback_workers', 0))
+        if workers > 0:
+            self.dispatcher = CallbackDispatcher(
+                workers, int(self.config.get('callback_queue_size', CALLBACK_QUEUE_SIZE)))
         # kick off the network.  interface is the main server we are currently
         # communicating with.  interfaces is the set of servers we are connecting
         # to or have an ongoing connection with
@@ -198,6 +334,24 @@ class Network(DaemonThread):
         self.auto_connect = self.config.get('auto_connect', False)
         self.connecting = set()
         self.socket_queue = Queue.Queue()
+        # interfaces stay registered with the poller while they are open, and
+        # send() wakes it up through the waker
+        self.poller = make_poller()
+        self.polled_interfaces = set()
+        self.waker = Waker()
+        self.poller.register(self.waker, EVENT_READ, self.waker)
+        # 'threads' connects to each server on its own thread, 'loop' connects
+        # from the run loop
+        self.network_engine = self.config.get('network_engine', 'threads')
+        if self.network_engine not in ('threads', 'loop'):
+            raise ValueError('Unknown network engine: %s' % self.network_engine)
+        # server -> PendingConnection, for the 'loop' engine
+        self.pending_connections = {}
+        self.resolved_queue = Queue.Queue()
+        self.resolver = None
+        if self.network_engine == 'loop':
+            self.resolver = Resolver(self.resolved_queue, self.waker.wake)
+            self.resolver.start()
         self.online_servers = {}
         self._set_online_servers()
         self.start_network(deserialize_server(self.default_server)[2],
@@ -218,7 +372,7 @@ class Network(DaemonThread):
         with self.lock:
             callbacks = self.callbacks[event][:]
         for callback in callbacks:
-            callback(event, *args)
+            self.run_callback(callback, event, *args)
 
     def get_server_height(self):
         return self.heights.get(self.default_server, 0)
@@ -247,7 +401,7 @@ class Network(DaemonThread):
     def is_up_to_date(self):
         return self.unanswered_requests == {}
 
-    def queue_request(self, method, params, interface=None):
+    def queue_request(self, method, params, interface=None, priority=PRIORITY_NORMAL):
         # If you want to queue a request on any interface it must go
         # through this function so message ids are properly tracked
         if interface is None:
@@ -256,7 +410,7 @@ class Network(DaemonThread):
         self.message_id += 1
         if self.debug:
             log.debug('%s --> %s, %s, %s', interface.host, method, params, message_id)
-        interface.queue_request(method, params, message_id)
+        interface.queue_request(method, params, message_id, priority)
         return message_id
 
     def send_subscriptions(self):
@@ -265,13 +419,21 @@ class Network(DaemonThread):
             self.interface.server, len(self.unanswered_requests), len(self.subscribed_addresses))
         self.sub_cache.clear()
         # Resend unanswered requests
-        requests = self.unanswered_requests.values()
+        requests = self.unanswered_requests.items()
+        hedged_requests = self.hedged_requests
         self.unanswered_requests = {}
-        for request in requests:
-            message_id = self.queue_request(request[0], request[1])
+        self.request_interfaces = {}
+        self.hedged_requests = {}
+        resent = set()
+        for old_id, request in requests:
+            if hedged_requests.get(old_id) in resent:
+                continue  # the other copy of a hedged request
+            resent.add(old_id)
+            message_id = self.queue_request(request.method, request.params,
+                                            priority=request.priority)
             self.unanswered_requests[message_id] = request
         for addr in self.subscribed_addresses:
-            self.queue_request('blockchain.address.subscribe', [addr])
+            self.queue_request('blockchain.address.subscribe', [addr], priority=PRIORITY_LOW)
         self.queue_request('server.banner', [])
         self.queue_request('server.peers.subscribe', [])
         self.queue_request('blockchain.estimatefee', [2])
@@ -306,13 +468,50 @@ class Network(DaemonThread):
         """The interfaces that are in connected state"""
         return self.interfaces.keys()
 
+    def get_network_stats(self):
+        """Request counters and response times by method and by server, time
+        spent in the run loop and its callbacks, and the current lengths of
+        the request queues"""
+        stats = self.network_stats.as_dict()
+        stats['loop'] = self.loop_monitor.get_stats()
+        stats['queues'] = {
+            'pending_sends': len(self.pending_sends),
+            'unanswered_requests': len(self.unanswered_requests),
+            'inflight_requests': len(self.inflight_requests),
+            'bc_requests': len(self.bc_requests),
+            'sub_cache': len(self.sub_cache),
+            'queued_callbacks': self.dispatcher.queued() if self.dispatcher else 0,
+            'response_cache': len(self.response_cache),
+            'response_cache_bytes': self.response_cache.size,
+            'interfaces': dict((interface.server, {
+                'unsent_requests': len(interface.unsent_requests),
+                'unanswered_requests': len(interface.unanswered_requests),
+            }) for interface in self.interfaces.values()),
+        }
+        return stats
+
     # Do an initial pruning of lbryum servers that don't have the specified port open
     def _set_online_servers(self):
-        servers = self.config.get('default_servers', {}).iteritems()
-        self.online_servers = {
-            host: ports for host, ports in servers
-            if is_online(host, ports)
-        }
+        '''Start from the servers last found online if probed recently, then
+        probe them all again in the background.  Without recent results wait
+        for the probe.'''
+        servers = self.config.get('default_servers', {})
+        path = os.path.join(self.config.path, 'online_servers.json')
+        online, probed = read_probed_servers(path, servers)
+        if online and time.time() - probed < SERVER_PROBE_CACHE_AGE:
+            log.info("using %i servers found online %i seconds ago",
+                     len(online), time.time() - probed)
+            self.online_servers = online
+            thread = Thread(target=self._probe_servers, args=(servers, path))
+            thread.daemon = True
+            thread.start()
+        else:
+            self._probe_servers(servers, path)
+
+    def _probe_servers(self, servers, path):
+        probed = time.time()
+        self.online_servers = probe_servers(servers)
+        save_probed_servers(path, self.online_servers, probed)
 
     def get_servers(self):
         if self.irc_servers:
@@ -327,11 +526,20 @@ class Network(DaemonThread):
                 log.info("connecting to %s as new interface", server)
                 self.set_status('connecting')
             self.connecting.add(server)
-            c = Connection(server, self.socket_queue, self.config.path)
+            if self.resolver:
+                self.resolver.resolve(server)
+            else:
+                Connection(server, self.socket_queue, self.config.path)
+
+    def get_server_stats(self, server):
+        if server not in self.server_stats:
+            self.server_stats[server] = ServerStats()
+        return self.server_stats[server]
 
     def start_random_interface(self):
         exclude_set = self.disconnected_servers.union(set(self.interfaces))
-        server = pick_random_server(self.get_servers(), self.protocol, exclude_set)
+        eligible = set(filter_protocol(self.get_servers(), self.protocol)) - exclude_set
+        server = pick_fastest_server(eligible, self.server_stats)
         if server:
             self.start_interface(server)
 
@@ -355,6 +563,11 @@ class Network(DaemonThread):
         assert self.interface is None
         assert not self.interfaces
         self.connecting = set()
+        for pending in self.pending_connections.values():
+            self.poller.unregister(pending)
+            pending.close()
+        self.pending_connections = {}
+        self.stop_chunk_catch_up()
         # Get a new queue - no old pending connections thanks!
         self.socket_queue = Queue.Queue()
 
@@ -375,12 +588,37 @@ class Network(DaemonThread):
             self.switch_lagging_interface()
 
     def switch_to_random_interface(self):
-        '''Switch to a random connected server other than the current one'''
+        '''Switch to the fastest connected server other than the current one,
+        or a random one some of the time'''
         servers = self.get_interfaces()  # Those in connected state
         if self.default_server in servers:
             servers.remove(self.default_server)
         if servers:
-            self.switch_to_interface(random.choice(servers))
+            self.switch_to_interface(pick_fastest_server(servers, self.server_stats))
+
+    def switch_to_faster_interface(self):
+        '''If auto_connect, switch to a connected server that is up to date and
+        much faster than the current one'''
+        now = time.time()
+        if not self.auto_connect or self.interface is None or \
+                now - self.server_switch_time < SERVER_SWITCH_INTERVAL:
+            return
+        self.server_switch_time = now
+        stats = self.server_stats.get(self.default_server)
+        if stats is None or stats.responses < MIN_RTT_SAMPLES:
+            return
+        best_score, best_server = stats.score() * SERVER_SWITCH_RATIO, None
+        for server in self.get_interfaces():
+            stats = self.server_stats.get(server)
+            if server == self.default_server or stats is None or \
+                    stats.responses < MIN_RTT_SAMPLES or \
+                    self.heights.get(server, 0) < self.get_server_height():
+                continue
+            if stats.score() < best_score:
+                best_score, best_server = stats.score(), server
+        if best_server:
+            log.info("switching to faster server %s", best_server)
+            self.switch_to_interface(best_server)
 
     def switch_lagging_interface(self, suggestion=None):
         '''If auto_connect and lagging, switch interface'''
@@ -415,7 +653,145 @@ class Network(DaemonThread):
             self.interfaces.pop(interface.server)
             if interface.server == self.default_server:
                 self.interface = None
+            if interface in self.polled_interfaces:
+                self.polled_interfaces.remove(interface)
+                self.poller.unregister(interface)
             interface.close()
+            self.resend_requests(interface)
+
+    def read_interface(self, exclude=None):
+        '''The interface to send an idempotent client request to: the up to
+        date one with the fewest requests outstanding, preferring the main
+        interface.'''
+        if not self.balance_requests or self.interface is None:
+            return self.interface if exclude is None else None
+        height = self.heights.get(self.interface.server, 0)
+        candidates = [i for i in self.interfaces.values()
+                      if i != exclude and
+                      (i == self.interface or self.heights.get(i.server, -1) >= height)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda i: (len(i.unanswered_requests) + len(i.unsent_requests),
+                                              i != self.interface, i.server))
+
+    def resend_requests(self, interface):
+        '''Send the client requests outstanding on a closed interface to
+        another one.  Without a main interface they stay unanswered until
+        send_subscriptions() resends them.'''
+        for message_id, i in self.request_interfaces.items():
+            if i != interface:
+                continue
+            del self.request_interfaces[message_id]
+            request = self.unanswered_requests.pop(message_id, None)
+            if request is None:
+                continue
+            if message_id in self.hedged_requests:
+                # the other copy is still outstanding
+                self.forget_request(message_id)
+                continue
+            target = self.read_interface()
+            if target is None:
+                self.unanswered_requests[message_id] = request
+                continue
+            message_id = self.queue_request(request.method, request.params, target,
+                                            request.priority)
+            self.unanswered_requests[message_id] = request
+            if target != self.interface:
+                self.request_interfaces[message_id] = target
+
+    def forget_request(self, message_id):
+        '''Stop tracking a client request and its hedge partner.  Returns the
+        id of the partner if it was still unanswered.'''
+        self.unanswered_requests.pop(message_id, None)
+        self.request_interfaces.pop(message_id, None)
+        partner = self.hedged_requests.pop(message_id, None)
+        if partner is not None:
+            self.hedged_requests.pop(partner, None)
+            if partner in self.unanswered_requests:
+                return partner
+
+    def get_request_timeout(self, method):
+        if method in self.request_timeouts:
+            return float(self.request_timeouts[method])
+        return IDEMPOTENT_REQUEST_TIMEOUT if method in IDEMPOTENT_METHODS else REQUEST_TIMEOUT
+
+    def get_hedge_delay(self, method):
+        '''How long to wait for an answer to a query before sending it to
+        another server too: the 95th percentile of its recent response times.'''
+        times = self.response_times[method]
+        if len(times) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DELAY
+        return max(HEDGE_MIN_DELAY, sorted(times)[int(0.95 * (len(times) - 1))])
+
+    def get_sent_time(self, message_id):
+        '''When a client request was written to its interface, None while it
+        waits its turn to be sent'''
+        interface = self.request_interfaces.get(message_id, self.interface)
+        return interface.sent_times.get(message_id) if interface else None
+
+    def fail_late_callers(self, message_id, sent_time, now):
+        '''Answer the callers that gave a timeout to send() and have waited
+        longer than that with an error.  A caller waits from when the request
+        was written, or from when it joined it if that was later.
+        Returns True if no caller waits on the request anymore.'''
+        method, params, callback, timeout, _ = self.unanswered_requests[message_id]
+        if isinstance(callback, partial) and callback.func == self.on_coalesced_response:
+            key = callback.args[0]
+            waiters = self.inflight_requests.get(key, [])
+            late = [w for w in waiters
+                    if w[1] is not None and now - max(sent_time, w[2]) > w[1]]
+            if late:
+                waiters = [w for w in waiters if w not in late]
+                if waiters:
+                    self.inflight_requests[key] = waiters
+                else:
+                    self.inflight_requests.pop(key, None)
+            done = not waiters
+            late = [w[0] for w in late]
+        else:
+            late = [callback] if timeout is not None and now - sent_time > timeout else []
+            done = bool(late)
+        if late:
+            log.warning("%s request timed out", method)
+            interface = self.request_interfaces.get(message_id, self.interface)
+            if interface is not None:
+                self.network_stats.add_timeout(interface.server, method)
+        if done:
+            partner = self.forget_request(message_id)
+            if partner is not None:
+                self.forget_request(partner)
+        for late_callback in late:
+            self.run_callback(
+                late_callback, {'method': method, 'params': params, 'error': 'request timed out'})
+        return done
+
+    def maintain_requests(self):
+        '''Fail client requests past the deadline of their callers, and hedge
+        idempotent ones that are slow to be answered.  Deadlines start when a
+        request is written, and requests sent without a timeout, such as the
+        synchronizer's, are never failed.'''
+        now = time.time()
+        for message_id in self.unanswered_requests.keys():
+            if message_id not in self.unanswered_requests:
+                continue  # forgotten as the partner of a hedged request
+            sent_time = self.get_sent_time(message_id)
+            if sent_time is None or self.fail_late_callers(message_id, sent_time, now):
+                continue
+            request = self.unanswered_requests[message_id]
+            method = request.method
+            if method in IDEMPOTENT_METHODS and message_id not in self.hedged_requests and \
+                    now - sent_time > self.get_hedge_delay(method):
+                target = self.read_interface(
+                    exclude=self.request_interfaces.get(message_id, self.interface))
+                if target is None:
+                    continue
+                log.debug("hedging %s request on %s", method, target.server)
+                hedge_id = self.queue_request(method, request.params, target, request.priority)
+                self.unanswered_requests[hedge_id] = request
+                if target != self.interface:
+                    self.request_interfaces[hedge_id] = target
+                self.hedged_requests[message_id] = hedge_id
+                self.hedged_requests[hedge_id] = message_id
 
     def process_response(self, interface, response, callbacks):
         if self.debug:
@@ -454,12 +830,22 @@ class Network(DaemonThread):
             self.on_get_header(interface, response)
 
         for callback in callbacks:
-            callback(response)
+            self.run_callback(callback, response)
 
     def get_index(self, method, params):
         """ hashable index for subscriptions and cache"""
         return str(method) + (':' + str(params[0]) if params else '')
 
+    def get_request_key(self, method, params):
+        """ hashable index of a request including all of its params"""
+        return str(method) + ':' + json.dumps(params, sort_keys=True)
+
+    def on_coalesced_response(self, key, response):
+        self.response_cache.put(key, response)
+        for callback, _, _ in self.inflight_requests.pop(key, []):
+            # callers format their results in place, possibly on different threads
+            self.run_callback(callback, copy.deepcopy(response))
+
     def process_responses(self, interface):
         responses = interface.get_responses()
         for request, response in responses:
@@ -467,12 +853,26 @@ class Network(DaemonThread):
                 method, params, message_id = request
                 k = self.get_index(method, params)
                 # client requests go through self.send() with a
-                # callback, are only sent to the current interface,
-                # and are placed in the unanswered_requests dictionary
-                client_req = self.unanswered_requests.pop(message_id, None)
+                # callback, are sent to the current interface unless
+                # they can be balanced over all of them, and are placed
+                # in the unanswered_requests dictionary
+                client_req = self.unanswered_requests.get(message_id)
                 if client_req:
-                    assert interface == self.interface
-                    callbacks = [client_req[2]]
+                    assert interface == self.request_interfaces.get(message_id, self.interface)
+                    callbacks = [client_req.callback]
+                    rtt = interface.response_rtts.get(message_id)
+                    if response.get('error') and message_id in self.hedged_requests:
+                        # wait for the other copy to be answered
+                        self.unanswered_requests.pop(message_id)
+                        self.request_interfaces.pop(message_id, None)
+                        self.hedged_requests.pop(self.hedged_requests.pop(message_id))
+                        callbacks = []
+                    else:
+                        partner = self.forget_request(message_id)
+                        if partner is not None:
+                            self.forget_request(partner)
+                        if rtt is not None and not response.get('error'):
+                            self.response_times[method].append(rtt)
                 else:
                     callbacks = []
                 # Copy the request method and params to the response
@@ -504,10 +904,32 @@ class Network(DaemonThread):
             # Response is now in canonical form
             self.process_response(interface, response, callbacks)
 
-    def send(self, messages, callback):
-        '''Messages is a list of (method, params) tuples'''
-        with self.lock:
-            self.pending_sends.append((messages, callback))
+    def send(self, messages, callback, priority=PRIORITY_NORMAL, timeout=None):
+        '''Messages is a list of (method, params) tuples.  Requests of a more
+        urgent priority, PRIORITY_HIGH for interactive ones and PRIORITY_LOW
+        for background traffic, are sent to the servers first.  With a
+        timeout, the callback is called with an error if there is no answer
+        that many seconds after a request was written; without one, requests
+        are sent again until they are answered.  While
+        max_pending_requests messages are waiting to be sent this blocks,
+        raising RequestQueueFull after send_timeout seconds, unless it is
+        called from the network thread or a callback worker.'''
+        messages = list(messages)
+        with self.pending_cv:
+            if not self.on_network_thread() and \
+                    not (self.dispatcher and self.dispatcher.is_worker()):
+                deadline = time.time() + self.send_timeout
+                while self.pending_sends and \
+                        len(self.pending_sends) + len(messages) > self.max_pending:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise RequestQueueFull('%i requests waiting to be sent'
+                                               % len(self.pending_sends))
+                    self.pending_cv.wait(remaining)
+            self.pending_sends.extend(
+                priority, [ClientRequest(method, params, callback, timeout, priority)
+                           for method, params in messages])
+        self.waker.wake()
 
     def process_pending_sends(self):
         # Requests needs connectivity.  If we don't have an interface,
@@ -515,28 +937,49 @@ class Network(DaemonThread):
         if not self.interface:
             return
 
-        with self.lock:
-            sends = self.pending_sends
-            self.pending_sends = []
-
-        for messages, callback in sends:
-            for method, params in messages:
-                r = None
-                if method.endswith('.subscribe'):
-                    k = self.get_index(method, params)
-                    # add callback to list
-                    l = self.subscriptions.get(k, [])
-                    if callback not in l:
-                        l.append(callback)
-                    self.subscriptions[k] = l
-                    # check cached response for subscriptions
-                    r = self.sub_cache.get(k)
-                if r is not None:
-                    log.warning("cache hit: %s", k)
-                    callback(r)
-                else:
-                    message_id = self.queue_request(method, params)
-                    self.unanswered_requests[message_id] = method, params, callback
+        # Only queue as many requests as can be in flight, so that a burst
+        # is sent to the servers at the pace they answer
+        queued = sum(len(i.unsent_requests) for i in self.interfaces.values())
+        with self.pending_cv:
+            sends = self.pending_sends.take(self.max_inflight - queued)
+            if sends:
+                self.pending_cv.notify_all()
+
+        for request in sends:
+            method, params, callback, timeout, priority = request
+            r = None
+            if method.endswith('.subscribe'):
+                k = self.get_index(method, params)
+                # add callback to list
+                l = self.subscriptions.get(k, [])
+                if callback not in l:
+                    l.append(callback)
+                self.subscriptions[k] = l
+                # check cached response for subscriptions
+                r = self.sub_cache.get(k)
+            elif method in IDEMPOTENT_METHODS:
+                k = self.get_request_key(method, params)
+                cached = self.response_cache.get(k) if method in CACHE_POLICIES else None
+                if cached is not None:
+                    self.run_callback(callback, cached)
+                    continue
+                if k in self.inflight_requests:
+                    log.debug("coalescing request: %s", k)
+                    self.inflight_requests[k].append((callback, timeout, time.time()))
+                    continue
+                self.inflight_requests[k] = [(callback, timeout, time.time())]
+                # the waiters have their own timeouts
+                request = request._replace(callback=partial(self.on_coalesced_response, k),
+                                           timeout=None)
+            if r is not None:
+                log.warning("cache hit: %s", k)
+                self.run_callback(callback, r)
+            else:
+                interface = self.read_interface() if method in IDEMPOTENT_METHODS else None
+                message_id = self.queue_request(method, params, interface, priority)
+                self.unanswered_requests[message_id] = request
+                if interface is not None and interface != self.interface:
+                    self.request_interfaces[message_id] = interface
 
     def unsubscribe(self, callback):
         '''Unsubscribe a callback to free object references to enable GC.'''
@@ -560,22 +1003,68 @@ class Network(DaemonThread):
             self.notify('interfaces')
 
     def new_interface(self, server, socket):
-        self.interfaces[server] = interface = Interface(server, socket)
+        read_size = int(self.config.get('socket_read_size', DEFAULT_READ_SIZE))
+        self.interfaces[server] = interface = Interface(
+            server, socket, read_size, bool(self.config.get('batch_requests', False)),
+            self.get_server_stats(server), self.max_inflight, self.network_stats)
+        self.poller.register(interface, EVENT_READ, interface)
+        self.polled_interfaces.add(interface)
         self.queue_request('blockchain.headers.subscribe', [], interface)
         if server == self.default_server:
             self.switch_to_interface(server)
         self.notify('interfaces')
 
+    def connection_result(self, server, socket):
+        '''A connection attempt finished, socket is None if it failed.'''
+        self.connecting.remove(server)
+        self.get_server_stats(server).add_connection(socket is None)
+        if socket:
+            self.new_interface(server, socket)
+        else:
+            self.connection_down(server)
+
+    def try_next_address(self, pending):
+        '''Connect to the next address of a pending connection that isn't
+        registered with the poller, or give up on the server.'''
+        if pending.connect_next():
+            self.pending_connections[pending.server] = pending
+            self.poller.register(pending, EVENT_WRITE, pending)
+        else:
+            pending.close()
+            self.connection_result(pending.server, None)
+
+    def on_pending_connection(self, pending):
+        '''A pending connection's socket became writable'''
+        self.poller.unregister(pending)
+        del self.pending_connections[pending.server]
+        socket = pending.finish()
+        if socket:
+            self.connection_result(pending.server, socket)
+        else:
+            self.try_next_address(pending)
+
+    def maintain_pending_connections(self):
+        '''Start connecting to resolved servers and move timed out attempts
+        on to the next address.'''
+        while not self.resolved_queue.empty():
+            server, addresses = self.resolved_queue.get()
+            # skip lookups made before the network was restarted
+            if server not in self.connecting or server in self.pending_connections:
+                continue
+            self.try_next_address(PendingConnection(server, addresses or [], CONNECT_TIMEOUT))
+        for pending in self.pending_connections.values():
+            if pending.has_timed_out():
+                log.warning("timed out connecting to %s", pending.server)
+                self.poller.unregister(pending)
+                del self.pending_connections[pending.server]
+                self.try_next_address(pending)
+
     def maintain_sockets(self):
         '''Socket maintenance.'''
         # Responses to connection attempts?
         while not self.socket_queue.empty():
-            server, socket = self.socket_queue.get()
-            self.connecting.remove(server)
-            if socket:
-                self.new_interface(server, socket)
-            else:
-                self.connection_down(server)
+            self.connection_result(*self.socket_queue.get())
+        self.maintain_pending_connections()
 
         # Send pings and shut down stale interfaces
         for interface in self.interfaces.values():
@@ -606,12 +1095,13 @@ class Network(DaemonThread):
                         self.server_retry_time = now
                 else:
                     self.switch_to_interface(self.default_server)
+        else:
+            self.switch_to_faster_interface()
 
-    def request_chunk(self, interface, data, idx):
-        log.debug("requesting chunk %d" % idx)
+    def request_chunk(self, interface, idx):
+        log.debug("requesting chunk %d from %s" % (idx, interface.server))
         self.queue_request('blockchain.block.get_chunk', [idx], interface)
-        data['chunk_idx'] = idx
-        data['req_time'] = time.time()
+        self.chunk_requests[idx] = interface, time.time()
 
     def _caught_up_to_interface(self, data):
         return self.get_local_height() >= data['if_height']
@@ -619,29 +1109,147 @@ class Network(DaemonThread):
     def _need_chunk_from_interface(self, data):
         return self.get_local_height() + BLOCKS_PER_CHUNK <= data['if_height']
 
+    def _catching_up_chunks(self):
+        return self.chunk_next is not None
+
+    def catch_up_chunks(self, if_height):
+        """Start, or extend, downloading the complete chunks up to if_height"""
+        if not self._catching_up_chunks():
+            self.chunk_next = (self.get_local_height() + 1) / BLOCKS_PER_CHUNK
+            self.chunk_rewinds = 0
+        self.chunk_target = max(self.chunk_target, (if_height + 1) / BLOCKS_PER_CHUNK - 1)
+        self.request_chunks()
+
+    def _chunk_interface(self, idx, exclude):
+        """The connected interface with the fewest outstanding chunk requests that
+        has the whole chunk"""
+        last_height = (idx + 1) * BLOCKS_PER_CHUNK - 1
+        outstanding = defaultdict(int)
+        for interface, _ in self.chunk_requests.values():
+            outstanding[interface] += 1
+        candidates = [i for i in self.interfaces.values()
+                      if self.heights.get(i.server, 0) >= last_height and i not in exclude]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda i: (outstanding[i], i.server))
+
+    def request_chunks(self):
+        """Keep a window of chunk requests outstanding over the interfaces,
+        re-requesting from another interface those that have timed out"""
+        if not self._catching_up_chunks():
+            return
+        now = time.time()
+        connected = self.interfaces.values()
+        for idx, (interface, req_time) in self.chunk_requests.items():
+            if interface not in connected or now - req_time > CHUNK_REQUEST_TIMEOUT:
+                log.warning("chunk %d request to %s timed out", idx, interface.server)
+                del self.chunk_requests[idx]
+                self.chunk_failures[idx].add(interface)
+        last_idx = min(self.chunk_target, self.chunk_next + self.chunk_window - 1)
+        for idx in range(self.chunk_next, last_idx + 1):
+            if idx in self.chunk_requests or idx in self.chunk_buffer:
+                continue
+            interface = self._chunk_interface(idx, self.chunk_failures[idx])
+            if interface is None and self.chunk_failures[idx]:
+                # every server failed us once, give them another go
+                self.chunk_failures[idx].clear()
+                interface = self._chunk_interface(idx, set())
+            if interface is None:
+                break
+            self.request_chunk(interface, idx)
+
+    def stop_chunk_catch_up(self):
+        self.blockchain.flush()
+        self.chunk_next = None
+        self.chunk_target = -1
+        self.chunk_requests.clear()
+        self.chunk_buffer.clear()
+        self.chunk_failures.clear()
+
+    def connect_buffered_chunks(self):
+        """Connect received chunks to the blockchain in order"""
+        while self.chunk_next in self.chunk_buffer:
+            idx = self.chunk_next
+            interface, hexdata = self.chunk_buffer.pop(idx)
+            next_idx = self.blockchain.connect_chunk(idx, hexdata)
+            self.chunk_failures.pop(idx, None)
+            if next_idx == idx + 1:
+                self.chunk_next = next_idx
+                continue
+            # The chunk didn't connect; re-fetch the previous one (from another
+            # server if we can) in case our tip was reorganized away
+            self.chunk_failures[idx].add(interface)
+            self.chunk_rewinds += 1
+            if next_idx < 0 or self.chunk_rewinds > MAX_CHUNK_REWINDS:
+                self.stop_chunk_catch_up()
+                return False
+            self.chunk_requests.clear()
+            self.chunk_buffer.clear()
+            self.chunk_next = next_idx
+        return True
+
     def on_get_chunk(self, interface, response):
         """Handle receiving a chunk of block headers"""
+        idx = response['params'][0]
+        req_if, _ = self.chunk_requests.get(idx, (None, None))
+        if req_if != interface:
+            self.on_get_ancestors(interface, response)
+            return
+        del self.chunk_requests[idx]
+        if response.get('error'):
+            log.warning("chunk %d request to %s failed: %s", idx, interface.server,
+                        response['error'])
+            self.chunk_failures[idx].add(interface)
+        else:
+            self.chunk_buffer[idx] = interface, response['result']
+        connected = self.connect_buffered_chunks()
+        if connected and self._catching_up_chunks() and self.chunk_next <= self.chunk_target:
+            self.request_chunks()
+            return
+        if self._catching_up_chunks():
+            self.stop_chunk_catch_up()
+        self.notify('updated')
+        # hand over to the interface request waiting on the chunks
         if self.bc_requests:
             req_if, data = self.bc_requests[0]
-            req_idx = data.get('chunk_idx')
-            # Ignore unsolicited chunks
-            if req_if == interface and req_idx == response['params'][0]:
-                idx = self.blockchain.connect_chunk(req_idx, response['result'])
-                if idx < 0 or self._caught_up_to_interface(data):
+            if data.pop('catching_up', False):
+                if not connected or self._caught_up_to_interface(data):
                     self.bc_requests.popleft()
-                    self.notify('updated')
                 elif self._need_chunk_from_interface(data):
-                    self.request_chunk(interface, data, idx)
+                    self.catch_up_chunks(data['if_height'])
+                    data['catching_up'] = True
                 else:
-                    self.request_header(interface, data, data['if_height'])
+                    self.request_header(req_if, data, data['if_height'])
 
     def request_header(self, interface, data, height):
         log.debug("requesting header %d" % height)
         self.queue_request('blockchain.block.get_header', [height], interface)
         data['header_height'] = height
         data['req_time'] = time.time()
-        if 'chain' not in data:
-            data['chain'] = []
+
+    def request_ancestors(self, interface, data, height):
+        """Request the chunk containing height, to find where a branch forks from our chain"""
+        idx = height / BLOCKS_PER_CHUNK
+        log.debug("requesting chunk %d for ancestors" % idx)
+        self.queue_request('blockchain.block.get_chunk', [idx], interface)
+        data['ancestors_chunk'] = idx
+        data['req_time'] = time.time()
+
+    def on_connect_header_result(self, interface, data, result):
+        """Handle the result of connecting a branch to our chain"""
+        self.catchup_progress += 1
+        # If not finished, get the headers below
+        if result is True or result is False:
+            self.catchup_progress = 0
+            self.bc_requests.popleft()
+            if result:
+                self.switch_lagging_interface(interface.server)
+                self.notify('updated')
+            else:
+                log.warning("header didn't connect, dismissing interface")
+                interface.close()
+        else:
+            self.request_ancestors(interface, data, result)
 
     def on_get_header(self, interface, response):
         """Handle receiving a single block header"""
@@ -650,30 +1258,34 @@ class Network(DaemonThread):
             req_height = data.get('header_height', -1)
             # Ignore unsolicited headers
             if req_if == interface and req_height == response['params'][0]:
-                next_height = self.blockchain.connect_header(data['chain'], response['result'])
-                self.catchup_progress += 1
-                # If not finished, get the next header
-                if next_height is True or next_height is False:
-                    self.catchup_progress = 0
-                    self.bc_requests.popleft()
-                    if next_height:
-                        self.switch_lagging_interface(interface.server)
-                        self.notify('updated')
-                    else:
-                        log.warning("header didn't connect, dismissing interface")
-                        interface.close()
-                else:
-                    self.request_header(interface, data, next_height)
+                header = response['result']
+                data['tip_hash'] = hash_decode(self.blockchain.hash_header(header))
+                result = self.blockchain.connect_header(header)
+                self.on_connect_header_result(interface, data, result)
+
+    def on_get_ancestors(self, interface, response):
+        """Handle receiving a chunk of headers below a branch that didn't connect"""
+        if self.bc_requests:
+            req_if, data = self.bc_requests[0]
+            req_idx = data.get('ancestors_chunk', -1)
+            # Ignore unsolicited chunks
+            if req_if == interface and req_idx == response['params'][0]:
+                del data['ancestors_chunk']
+                result = self.blockchain.connect_ancestors(req_idx, response.get('result'),
+                                                           data['tip_hash'])
+                self.on_connect_header_result(interface, data, result)
 
     def bc_request_headers(self, interface, data):
-        """Send a request for the next header, or a chunk of them,
-        if necessary.
+        """Send a request for the next header, or start downloading
+        chunks of them from all interfaces, if necessary.
         """
         local_height, if_height = self.get_local_height(), data['if_height']
+        data['req_time'] = time.time()
         if if_height < local_height:
             return False
         elif if_height > local_height + BLOCKS_PER_CHUNK:
-            self.request_chunk(interface, data, (local_height + 1) / BLOCKS_PER_CHUNK)
+            data['catching_up'] = True
+            self.catch_up_chunks(if_height)
         else:
             self.request_header(interface, data, if_height)
         return True
@@ -694,6 +1306,9 @@ class Network(DaemonThread):
                 # Request headers if it is ahead of our blockchain
                 if not self.bc_request_headers(interface, data):
                     continue
+            elif data.get('catching_up'):
+                # Chunks time out individually
+                self.request_chunks()
             elif time.time() - req_time > 30:
                 log.error("blockchain request timed out")
                 self.connection_down(interface.server)
@@ -703,38 +1318,81 @@ class Network(DaemonThread):
             break
 
     def wait_on_sockets(self):
-        # Python docs say Windows doesn't like empty selects.
-        # Sleep to prevent busy looping
-        if not self.interfaces:
-            time.sleep(0.1)
-            return
-        rin = [i for i in self.interfaces.values()]
-        win = [i for i in self.interfaces.values() if i.unsent_requests]
+        """Wait until an interface is ready or send() is called, for at most 0.2 s
+        so that the rest of the loop still runs periodically"""
+        for interface in self.polled_interfaces:
+            events = EVENT_READ | EVENT_WRITE if interface.can_send() else EVENT_READ
+            if self.poller.get_events(interface) != events:
+                self.poller.modify(interface, events, interface)
+        for data, events in self.poller.select(0.2 if self.interfaces else 0.1):
+            if data is self.waker:
+                self.waker.clear()
+                continue
+            if isinstance(data, PendingConnection):
+                self.on_pending_connection(data)
+                continue
+            # an earlier event may have closed the interface
+            if data not in self.polled_interfaces:
+                continue
+            if events & EVENT_WRITE:
+                data.send_requests()
+            if events & EVENT_READ:
+                self.process_responses(data)
+
+    def stop(self):
+        DaemonThread.stop(self)
+        self.waker.wake()
+
+    def on_network_thread(self):
+        return current_thread() is self
+
+    def run_callback(self, callback, *args):
+        '''Run a client callback, on a callback worker if there are any.  The
+        network's own callbacks, and callbacks made off the network thread,
+        are run right away.'''
+        if self.dispatcher is None or not self.on_network_thread() or \
+                subscriber(callback) is self:
+            self.loop_monitor.call(callback, *args)
+        else:
+            self.dispatcher.dispatch(subscriber(callback), self.loop_monitor.call,
+                                     callback, *args)
+
+    def run_job(self, job):
+        if self.dispatcher is None:
+            self.loop_monitor.call(job.run)
+        elif job not in self.dispatched_jobs:
+            # a job runs on the same worker as its callbacks
+            self.dispatched_jobs.add(job)
+            self.dispatcher.dispatch(job, self.run_dispatched_job, job)
+
+    def run_dispatched_job(self, job):
         try:
-            rout, wout, xout = select.select(rin, win, [], 0.2)
-        except socket.error as (code, msg):
-            if code == errno.EINTR:
-                return
-            raise
-        assert not xout
-        for interface in wout:
-            interface.send_requests()
-        for interface in rout:
-            self.process_responses(interface)
+            self.loop_monitor.call(job.run)
+        finally:
+            self.dispatched_jobs.discard(job)
 
     def run(self):
         log.info('Initializing the blockchain')
         self.blockchain.init()
         log.info('Blockchain initialized, starting run loop')
+        monitor = self.loop_monitor
+        monitor.start()
         while self.is_running():
-            self.maintain_sockets()
-            self.wait_on_sockets()
-            self.handle_bc_requests()
-            self.run_jobs()  # Synchronizer and Verifier
-            self.process_pending_sends()
-
+            monitor.run_phase('maintain_sockets', self.maintain_sockets)
+            monitor.run_phase('wait_on_sockets', self.wait_on_sockets)
+            monitor.run_phase('handle_bc_requests', self.handle_bc_requests)
+            monitor.run_phase('maintain_requests', self.maintain_requests)
+            monitor.run_phase('run_jobs', self.run_jobs)  # Synchronizer and Verifier
+            monitor.run_phase('process_pending_sends', self.process_pending_sends)
+
+        monitor.stop()
         log.info('Stopping network')
         self.stop_network()
+        if self.dispatcher:
+            self.dispatcher.stop()
+        self.blockchain.close()
+        self.poller.close()
+        self.waker.close()
         log.info("stopped")
 
     def on_header(self, i, header):
@@ -749,6 +1407,7 @@ class Network(DaemonThread):
         self.bc_requests.append((i, {'if_height': height}))
 
         if i == self.interface:
+            self.response_cache.new_tip()
             self.switch_lagging_interface()
             self.notify('updated')
 
@@ -770,11 +1429,17 @@ class Network(DaemonThread):
         else:
             return 0
 
-    def synchronous_get(self, request, timeout=30):
+    def synchronous_get(self, request, timeout=None):
+        '''Send a request and wait for its result.  The request fails after
+        timeout seconds without an answer, counted from when it is written.'''
+        if timeout is None:
+            timeout = self.get_request_timeout(request[0])
         queue = Queue.Queue()
-        self.send([request], queue.put)
+        self.send([request], queue.put, PRIORITY_HIGH, timeout)
         try:
-            r = queue.get(True, timeout)
+            # leave time for the request to wait its turn to be written and
+            # fail with its own deadline
+            r = queue.get(True, 2 * timeout + 1)
         except Queue.Empty:
             msg = 'Failed to get response from server within timeout of {}'.format(timeout)
             raise BaseException(msg)
@@ -0,0 +1,130 @@
+import bisect
+import threading
+from collections import defaultdict
+
+# upper bounds in seconds of the response time histogram buckets; slower
+# responses are counted in a last, unbounded bucket
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram(object):
+    """Counts of samples by bucket, with fixed bucket bounds so that
+    recording a sample is cheap and the memory used doesn't grow."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, fraction):
+        """The upper bound of the bucket holding the given fraction of the
+        samples, or the largest sample if that is the last bucket"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        buckets = ['<=%g' % bound for bound in self.bounds] + ['>%g' % self.bounds[-1]]
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+            'buckets': dict((name, count) for name, count in zip(buckets, self.counts) if count),
+        }
+
+
+class RequestStats(object):
+    """Counters of the requests to a server or of a method"""
+
+    def __init__(self):
+        self.requests = 0
+        self.responses = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.notifications = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.response_times = Histogram()
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'responses': self.responses,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'notifications': self.notifications,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'response_times': self.response_times.as_dict(),
+        }
+
+
+class NetworkStats(object):
+    """Request counters and response time histograms by JSON-RPC method and by
+    server.  Updated from the network thread and read from any other."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_method = defaultdict(RequestStats)
+        self.by_server = defaultdict(RequestStats)
+
+    def _both(self, server, method):
+        return self.by_method[method], self.by_server[server]
+
+    def add_request(self, server, method, size):
+        with self.lock:
+            for stats in self._both(server, method):
+                stats.requests += 1
+                stats.bytes_sent += size
+
+    def add_response(self, server, method, response_time, size, error):
+        with self.lock:
+            for stats in self._both(server, method):
+                stats.responses += 1
+                stats.errors += bool(error)
+                stats.bytes_received += size
+                if response_time is not None:
+                    stats.response_times.add(response_time)
+
+    def add_notification(self, server, method, size):
+        with self.lock:
+            for stats in self._both(server, method):
+                stats.notifications += 1
+                stats.bytes_received += size
+
+    def add_timeout(self, server, method):
+        with self.lock:
+            for stats in self._both(server, method):
+                stats.timeouts += 1
+
+    def clear(self):
+        with self.lock:
+            self.by_method.clear()
+            self.by_server.clear()
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'methods': dict((k, v.as_dict()) for k, v in self.by_method.iteritems()),
+                'servers': dict((k, v.as_dict()) for k, v in self.by_server.iteritems()),
+            }
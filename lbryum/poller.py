@@ -0,0 +1,211 @@
+import errno
+import select
+import socket
+import time
+
+EVENT_READ = 1
+EVENT_WRITE = 2
+
+
+def _is_eintr(err):
+    return err.args and err.args[0] == errno.EINTR
+
+
+class SelectPoller(object):
+    """Keeps track of registered file objects and waits for them to become ready.
+
+    A stand in for the python 3 selectors module: file objects (anything with a
+    fileno()) stay registered with the events they are interested in between
+    calls to select(), which returns (data, events) for those that are ready.
+    This implementation uses select.select and works everywhere.
+    """
+
+    def __init__(self):
+        # fd -> (fileobj, events, data)
+        self.registered = {}
+
+    def register(self, fileobj, events, data=None):
+        fd = fileobj.fileno()
+        if fd in self.registered:
+            raise KeyError("%r is already registered" % fileobj)
+        self.registered[fd] = fileobj, events, data
+        self._register(fd, events)
+
+    def modify(self, fileobj, events, data=None):
+        fd = fileobj.fileno()
+        _, old_events, _ = self.registered[fd]
+        self.registered[fd] = fileobj, events, data
+        if events != old_events:
+            self._modify(fd, events)
+
+    def unregister(self, fileobj):
+        fd = fileobj.fileno()
+        del self.registered[fd]
+        self._unregister(fd)
+
+    def get_events(self, fileobj):
+        return self.registered[fileobj.fileno()][1]
+
+    def close(self):
+        self.registered.clear()
+
+    def _register(self, fd, events):
+        pass
+
+    def _modify(self, fd, events):
+        pass
+
+    def _unregister(self, fd):
+        pass
+
+    def _poll(self, timeout):
+        """Returns a list of (fd, events)"""
+        rin = [fd for fd, (_, events, _) in self.registered.iteritems() if events & EVENT_READ]
+        win = [fd for fd, (_, events, _) in self.registered.iteritems() if events & EVENT_WRITE]
+        if not rin and not win:
+            # windows doesn't like empty selects
+            time.sleep(timeout or 0)
+            return []
+        rout, wout, _ = select.select(rin, win, [], timeout)
+        ready = dict((fd, EVENT_READ) for fd in rout)
+        for fd in wout:
+            ready[fd] = ready.get(fd, 0) | EVENT_WRITE
+        return ready.items()
+
+    def select(self, timeout=None):
+        try:
+            ready = self._poll(timeout)
+        except (select.error, EnvironmentError) as err:
+            if _is_eintr(err):
+                return []
+            raise
+        result = []
+        for fd, events in ready:
+            if fd in self.registered:
+                _, registered_events, data = self.registered[fd]
+                result.append((data, events & registered_events))
+        return result
+
+
+class PollPoller(SelectPoller):
+    """A SelectPoller using select.poll, so a wait costs nothing per registered socket"""
+
+    def __init__(self):
+        SelectPoller.__init__(self)
+        self._poller = self._make_poller()
+
+    def _make_poller(self):
+        self._read_mask = select.POLLIN | select.POLLPRI
+        self._write_mask = select.POLLOUT
+        self._error_mask = select.POLLERR | select.POLLHUP
+        return select.poll()
+
+    def _mask(self, events):
+        mask = 0
+        if events & EVENT_READ:
+            mask |= self._read_mask
+        if events & EVENT_WRITE:
+            mask |= self._write_mask
+        return mask
+
+    def _register(self, fd, events):
+        self._poller.register(fd, self._mask(events))
+
+    def _modify(self, fd, events):
+        self._poller.modify(fd, self._mask(events))
+
+    def _unregister(self, fd):
+        self._poller.unregister(fd)
+
+    def _timeout(self, timeout):
+        # poll() takes milliseconds
+        return None if timeout is None else int(timeout * 1000)
+
+    def _poll(self, timeout):
+        ready = []
+        for fd, mask in self._poller.poll(self._timeout(timeout)):
+            events = 0
+            # errors and hang ups are reported as readable so that they get noticed
+            if mask & (self._read_mask | self._error_mask):
+                events |= EVENT_READ
+            if mask & (self._write_mask | self._error_mask):
+                events |= EVENT_WRITE
+            ready.append((fd, events))
+        return ready
+
+
+class EpollPoller(PollPoller):
+    """A SelectPoller using select.epoll on linux"""
+
+    def _make_poller(self):
+        self._read_mask = select.EPOLLIN | select.EPOLLPRI
+        self._write_mask = select.EPOLLOUT
+        self._error_mask = select.EPOLLERR | select.EPOLLHUP
+        return select.epoll()
+
+    def _timeout(self, timeout):
+        return -1 if timeout is None else timeout
+
+    def close(self):
+        PollPoller.close(self)
+        self._poller.close()
+
+
+def make_poller():
+    """The most efficient poller available on this platform"""
+    if hasattr(select, 'epoll'):
+        return EpollPoller()
+    if hasattr(select, 'poll'):
+        return PollPoller()
+    return SelectPoller()
+
+
+def _socketpair():
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+    # windows: connect a pair of sockets over the loopback interface
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        writer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        writer.connect(listener.getsockname())
+        reader, _ = listener.accept()
+    finally:
+        listener.close()
+    return reader, writer
+
+
+class Waker(object):
+    """The self-pipe trick: register a Waker with a poller to be able to
+    interrupt a wait on it from any thread by calling wake()
+    """
+
+    def __init__(self):
+        self._reader, self._writer = _socketpair()
+        self._reader.setblocking(False)
+        self._writer.setblocking(False)
+
+    def fileno(self):
+        return self._reader.fileno()
+
+    def wake(self):
+        try:
+            self._writer.send('\0')
+        except socket.error as err:
+            # the pipe is full, so a wake up is already pending
+            if err.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def clear(self):
+        """Consume pending wake ups, call when the poller reports the Waker readable"""
+        try:
+            while self._reader.recv(4096):
+                pass
+        except socket.error as err:
+            if err.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
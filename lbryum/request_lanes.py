@@ -0,0 +1,39 @@
+from collections import deque
+
+from lbryum.constants import PRIORITY_WEIGHTS
+
+
+class RequestLanes(object):
+    """A queue of requests with a FIFO lane per priority.
+
+    take() serves the lanes in weighted round robin: each lane in turn, most
+    urgent first, gives up to its weight of requests.  The turn carries over
+    between calls, so urgent requests jump ahead while the others keep a
+    share and never starve.
+    """
+
+    def __init__(self, weights=PRIORITY_WEIGHTS):
+        self.weights = weights
+        self.lanes = [deque() for _ in weights]
+        # the lane whose turn it is, and how many more requests it may give
+        self.turn = 0
+        self.credit = weights[0]
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes)
+
+    def extend(self, priority, requests):
+        self.lanes[priority].extend(requests)
+
+    def take(self, count):
+        """Remove and return up to count requests"""
+        taken = []
+        while len(taken) < count and any(self.lanes):
+            lane = self.lanes[self.turn]
+            if lane and self.credit:
+                taken.append(lane.popleft())
+                self.credit -= 1
+            else:
+                self.turn = (self.turn + 1) % len(self.lanes)
+                self.credit = self.weights[self.turn]
+        return taken
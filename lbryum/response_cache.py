@@ -0,0 +1,106 @@
+import json
+import logging
+from collections import OrderedDict
+
+from lbryum.hashing import Hash, hash_encode
+
+log = logging.getLogger(__name__)
+
+# responses that can't change: transactions are checked against their hash
+CACHE_PERMANENT = 'permanent'
+# responses that are valid until the chain tip changes.  Claimtrie queries
+# naming a block hash are too: callers ask at a height relative to the tip, so
+# a new block makes new keys, and answers carry current supports and channels
+CACHE_UNTIL_NEW_TIP = 'tip'
+
+CACHE_POLICIES = {
+    'blockchain.transaction.get': CACHE_PERMANENT,
+    'blockchain.block.get_header': CACHE_UNTIL_NEW_TIP,
+    'blockchain.claimtrie.get': CACHE_UNTIL_NEW_TIP,
+    'blockchain.claimtrie.getclaimbyid': CACHE_UNTIL_NEW_TIP,
+    'blockchain.claimtrie.getclaimsbyids': CACHE_UNTIL_NEW_TIP,
+    'blockchain.claimtrie.getclaimsforname': CACHE_UNTIL_NEW_TIP,
+    'blockchain.claimtrie.getclaimsintx': CACHE_UNTIL_NEW_TIP,
+    'blockchain.claimtrie.getclaimssignedby': CACHE_UNTIL_NEW_TIP,
+    'blockchain.claimtrie.getclaimssignedbyid': CACHE_UNTIL_NEW_TIP,
+    'blockchain.claimtrie.getnthclaimforname': CACHE_UNTIL_NEW_TIP,
+    'blockchain.claimtrie.getvalue': CACHE_UNTIL_NEW_TIP,
+    'blockchain.claimtrie.getvaluesforuris': CACHE_UNTIL_NEW_TIP,
+}
+
+DEFAULT_CACHE_SIZE = 16 * 1024 * 1024
+
+
+def is_valid_transaction(txid, raw_tx):
+    try:
+        return hash_encode(Hash(raw_tx.decode('hex'))) == txid
+    except (AttributeError, TypeError):
+        return False
+
+
+class ResponseCache(object):
+    """A least recently used cache of server responses, by request key.
+
+    Which responses are kept and for how long is decided per method by
+    CACHE_POLICIES.  Results are kept serialized as JSON, since callers
+    change the results they are given, and the size of the cache is their
+    total length, kept under max_size bytes.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        # key -> (response without its result, result as JSON, policy)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Returns a copy of the cached response for the request key, or None"""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries[key] = entry
+        self.hits += 1
+        response, result, _ = entry
+        return dict(response, params=list(response['params']), result=json.loads(result))
+
+    def put(self, key, response):
+        """Cache a response to a request if its method's policy allows it"""
+        method = response.get('method')
+        policy = CACHE_POLICIES.get(method)
+        if policy is None or response.get('error') or response.get('result') is None:
+            return
+        params = response.get('params') or []
+        if method == 'blockchain.transaction.get' and \
+                not (params and is_valid_transaction(params[0], response['result'])):
+            log.warning("not caching transaction that doesn't match its hash")
+            return
+        result = json.dumps(response['result'])
+        if len(result) > self.max_size:
+            return
+        self.remove(key)
+        response = dict(response, params=list(params))
+        del response['result']
+        self.entries[key] = response, result, policy
+        self.size += len(result)
+        while self.size > self.max_size:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def new_tip(self):
+        """Drop the responses that may have changed with a new block"""
+        for key in [k for k, entry in self.entries.iteritems() if entry[2] == CACHE_UNTIL_NEW_TIP]:
+            self.remove(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
@@ -6,27 +6,35 @@ import ssl
 import sys
 import time
 import traceback
+from collections import deque
 
 from lbryum.errors import Timeout
 
 log = logging.getLogger(__name__)
 
-
-def parse_json(message):
-    n = message.find('\n')
-    if n == -1:
-        return None, message
-    try:
-        j = json.loads(message[0:n])
-    except:
-        j = None
-    return j, message[n + 1:]
+# bytes asked for by each recv()
+DEFAULT_READ_SIZE = 64 * 1024
 
 
 class SocketPipe(object):
-    def __init__(self, socket):
+    """Newline delimited JSON messages over a socket.
+
+    Received data is appended to a bytearray which is only scanned for
+    newlines past the point already searched.  Every complete message is
+    parsed as soon as it arrives and the consumed bytes are dropped in one go,
+    so large responses split over many reads cost linear time.
+    """
+
+    def __init__(self, socket, read_size=DEFAULT_READ_SIZE):
         self.socket = socket
-        self.message = ''
+        self.read_size = read_size
+        self.buffer = bytearray()
+        # offset in buffer up to which there is no newline
+        self.scan_offset = 0
+        # parsed messages not yet returned by get(), with their sizes
+        self.messages = deque()
+        # bytes on the wire of the last message returned by get()
+        self.message_size = 0
         self.set_timeout(0.1)
         self.recv_time = time.time()
 
@@ -36,13 +44,28 @@ class SocketPipe(object):
     def idle_time(self):
         return time.time() - self.recv_time
 
+    def _extract_messages(self):
+        start = 0
+        while True:
+            end = self.buffer.find('\n', max(start, self.scan_offset))
+            if end == -1:
+                break
+            try:
+                self.messages.append((json.loads(str(self.buffer[start:end])), end + 1 - start))
+            except ValueError:
+                log.warning("dropping invalid message")
+            start = end + 1
+        if start:
+            del self.buffer[:start]
+        self.scan_offset = len(self.buffer)
+
     def get(self):
         while True:
-            response, self.message = parse_json(self.message)
-            if response is not None:
-                return response
+            if self.messages:
+                message, self.message_size = self.messages.popleft()
+                return message
             try:
-                data = self.socket.recv(1024)
+                data = self.socket.recv(self.read_size)
             except socket.timeout:
                 raise Timeout
             except ssl.SSLError:
@@ -51,8 +74,7 @@ class SocketPipe(object):
                 if err.errno == 60:
                     raise Timeout
                 elif err.errno in [11, 35, 10035]:
-                    # print_error("socket errno %d (resource temporarily unavailable)"% err.errno)
-                    time.sleep(0.05)
+                    # resource temporarily unavailable, nothing to read yet
                     raise Timeout
                 else:
                     log.error("pipe (socket error): %s", err)
@@ -63,16 +85,19 @@ class SocketPipe(object):
 
             if not data:  # Connection closed remotely
                 return None
-            self.message += data
+            self.buffer.extend(data)
             self.recv_time = time.time()
+            self._extract_messages()
 
     def send(self, request):
         out = json.dumps(request) + '\n'
         self._send(out)
 
     def send_all(self, requests):
-        out = ''.join(map(lambda x: json.dumps(x) + '\n', requests))
-        self._send(out)
+        '''Send each request on its own line.  Returns the sizes of the lines.'''
+        lines = [json.dumps(x) + '\n' for x in requests]
+        self._send(''.join(lines))
+        return map(len, lines)
 
     def _send(self, out):
         while out:
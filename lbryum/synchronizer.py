@@ -1,6 +1,7 @@
 import logging
 from threading import Lock
 
+from lbryum.constants import PRIORITY_LOW
 from lbryum.hashing import Hash, hash_encode
 from lbryum.transaction import Transaction
 from lbryum.util import ThreadJob
@@ -53,7 +54,7 @@ class Synchronizer(ThreadJob):
             self.requested_addrs |= addresses
             msgs = map(lambda addr: ('blockchain.address.subscribe', [addr]),
                        addresses)
-            self.network.send(msgs, self.addr_subscription_response)
+            self.network.send(msgs, self.addr_subscription_response, PRIORITY_LOW)
 
     def addr_subscription_response(self, response):
 
@@ -66,7 +67,7 @@ class Synchronizer(ThreadJob):
             if self.requested_histories.get(addr) is None:
                 self.requested_histories[addr] = result
                 self.network.send([('blockchain.address.get_history', [addr])],
-                                  self.addr_history_response)
+                                  self.addr_history_response, PRIORITY_LOW)
 
         # remove addr from list only after it is added to requested_histories
         if addr in self.requested_addrs:  # Notifications won't be in
@@ -127,7 +128,7 @@ class Synchronizer(ThreadJob):
         missing -= self.requested_tx
         if missing:
             requests = [('blockchain.transaction.get', tx) for tx in missing]
-            self.network.send(requests, self.tx_response)
+            self.network.send(requests, self.tx_response, PRIORITY_LOW)
             self.requested_tx |= missing
 
     def initialize(self):
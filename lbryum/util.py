@@ -87,10 +87,13 @@ class DaemonThread(threading.Thread, PrintError):
         with self.job_lock:
             for job in self.jobs:
                 try:
-                    job.run()
+                    self.run_job(job)
                 except:
                     traceback.print_exc(file=sys.stderr)
 
+    def run_job(self, job):
+        job.run()
+
     def remove_jobs(self, jobs):
         with self.job_lock:
             for job in jobs:
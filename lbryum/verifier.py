@@ -17,6 +17,7 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from lbryum.constants import PRIORITY_LOW
 from lbryum.hashing import Hash, hash_decode, hash_encode
 from lbryum.util import ThreadJob
 
@@ -41,7 +42,7 @@ class SPV(ThreadJob):
             if tx_hash not in self.merkle_roots and tx_height <= lh:
                 request = ('blockchain.transaction.get_merkle',
                            [tx_hash, tx_height])
-                self.network.send([request], self.verify_merkle)
+                self.network.send([request], self.verify_merkle, PRIORITY_LOW)
                 log.info('requested merkle: %s', tx_hash)
                 self.merkle_roots[tx_hash] = None
 
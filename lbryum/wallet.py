@@ -19,6 +19,7 @@ from lbryum import __version__ as LBRYUM_VERSION
 from lbryum.account import ImportedAccount, Multisig_Account, BIP32_Account
 from lbryum.constants import TYPE_ADDRESS, TYPE_CLAIM, TYPE_SUPPORT, TYPE_UPDATE, TYPE_PUBKEY
 from lbryum.constants import EXPIRATION_BLOCKS, COINBASE_MATURITY, RECOMMENDED_FEE
+from lbryum.constants import PRIORITY_HIGH
 from lbryum.coinchooser import COIN_CHOOSERS
 from lbryum.mnemonic import Mnemonic
 from lbryum.synchronizer import Synchronizer
@@ -1216,7 +1217,8 @@ class Abstract_Wallet(PrintError):
         self.tx_event.clear()
         # fixme: this does not handle the case where server does not answer
         assert self.network.interface, "Not connected."
-        self.network.send([('blockchain.transaction.broadcast', [str(tx)])], self.on_broadcast)
+        self.network.send([('blockchain.transaction.broadcast', [str(tx)])], self.on_broadcast,
+                          PRIORITY_HIGH)
         return tx.hash()
 
     def on_broadcast(self, r):
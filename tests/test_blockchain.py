@@ -0,0 +1,300 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lbryum.blockchain import LbryCrdReg, HEADER_STRUCT, BOOTSTRAP_BATCH_CHUNKS, check_pow
+from lbryum.constants import BLOCKS_PER_CHUNK, HEADER_SIZE, MAX_CHUNK_REWINDS
+from lbryum.hashing import Hash, PoWHash, hash_encode
+from lbryum.util import int_to_hex, rev_hex
+
+REGTEST_BITS = 0x207fffff
+REGTEST_TARGET = 0x7fffff << 232
+
+
+class FakeConfig(object):
+    def __init__(self, path, options=None):
+        self.path = path
+        self.options = options or {}
+
+    def get(self, key, default=None):
+        return self.options.get(key, default)
+
+
+def make_raw_chain(count, prev_raw=None, timestamp=1446058291, merkle_byte='\x01', pow=True):
+    """Build count linked regtest headers, which pass proof of work if pow is set"""
+    headers = []
+    for i in range(count):
+        prev_hash = Hash(prev_raw) if prev_raw else '\x00' * 32
+        nonce = 0
+        while True:
+            raw = HEADER_STRUCT.pack(1, prev_hash, merkle_byte * 32, '\x02' * 32,
+                                     timestamp + i, REGTEST_BITS, nonce)
+            if not pow or int(hash_encode(PoWHash(raw)), 16) <= REGTEST_TARGET:
+                break
+            nonce += 1
+        headers.append(raw)
+        prev_raw = raw
+    return headers
+
+
+class BlockchainTestCase(unittest.TestCase):
+    def setUp(self):
+        super(BlockchainTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.config = FakeConfig(self.tmp_dir)
+        self.blockchain = LbryCrdReg(self.config, None)
+
+    def tearDown(self):
+        super(BlockchainTestCase, self).tearDown()
+        self.blockchain.close()
+        shutil.rmtree(self.tmp_dir)
+
+
+class TestHeaderCodec(BlockchainTestCase):
+    header = {
+        'version': 536870912,
+        'prev_block_hash': '7fe4e3b3fa4ac5ab8b5b2b6ff1a0e3d8a0a8b2cf0bf17f4f8cc9ed1f6d5d9b1a',
+        'merkle_root': 'b1a2bb33d0dd4a9d2f1e3ae1c6f1bd44c3a4b34fd2ab5c3de3a6e7f1a2b3c4d5',
+        'claim_trie_root': '0fd7e8f6f1ab56c21e8b2a3f4c5d6e7f8091a2b3c4d5e6f708192a3b4c5d6e7f',
+        'timestamp': 1500000000,
+        'bits': 0x1a0fffff,
+        'nonce': 123456789,
+    }
+
+    def legacy_serialize(self, res):
+        return int_to_hex(res['version'], 4) + rev_hex(res['prev_block_hash']) \
+            + rev_hex(res['merkle_root']) + rev_hex(res['claim_trie_root']) \
+            + int_to_hex(res['timestamp'], 4) + int_to_hex(res['bits'], 4) \
+            + int_to_hex(res['nonce'], 4)
+
+    def test_pack_matches_hex_serialization(self):
+        raw = self.blockchain.pack_header(self.header)
+        self.assertEqual(HEADER_SIZE, len(raw))
+        self.assertEqual(self.legacy_serialize(self.header), raw.encode('hex'))
+        self.assertEqual(raw.encode('hex'), self.blockchain.serialize_header(self.header))
+
+    def test_round_trip(self):
+        raw = self.blockchain.pack_header(self.header)
+        self.assertEqual(self.header, self.blockchain.deserialize_header(raw))
+
+    def test_hash_header(self):
+        raw = self.blockchain.pack_header(self.header)
+        self.assertEqual(hash_encode(Hash(raw)), self.blockchain.hash_header(self.header))
+        self.assertEqual('0' * 64, self.blockchain.hash_header(None))
+
+
+class TestVerifyChunk(BlockchainTestCase):
+    def test_connect_chunks(self):
+        chain = make_raw_chain(2 * BLOCKS_PER_CHUNK)
+        first, second = ''.join(chain[:BLOCKS_PER_CHUNK]), ''.join(chain[BLOCKS_PER_CHUNK:])
+        self.assertEqual(1, self.blockchain.connect_chunk(0, first.encode('hex')))
+        self.assertEqual(2, self.blockchain.connect_chunk(1, second.encode('hex')))
+        self.assertEqual(2 * BLOCKS_PER_CHUNK - 1, self.blockchain.height())
+        self.assertEqual(chain[100], self.blockchain.read_raw_header(100))
+
+    def test_reject_unlinked_chunk(self):
+        chain = make_raw_chain(BLOCKS_PER_CHUNK)
+        self.assertEqual(1, self.blockchain.connect_chunk(0, ''.join(chain).encode('hex')))
+        other = make_raw_chain(BLOCKS_PER_CHUNK, prev_raw=chain[0])
+        self.assertEqual(0, self.blockchain.connect_chunk(1, ''.join(other).encode('hex')))
+        self.assertEqual(BLOCKS_PER_CHUNK - 1, self.blockchain.height())
+
+    def test_reject_short_chunk(self):
+        chain = make_raw_chain(BLOCKS_PER_CHUNK - 1)
+        self.assertEqual(-1, self.blockchain.connect_chunk(0, ''.join(chain).encode('hex')))
+        self.assertFalse(os.path.exists(self.blockchain.path()))
+
+    def test_connect_chunk_on_process_pool(self):
+        self.blockchain.close()
+        self.config.options['pow_verification_processes'] = 2
+        self.blockchain = LbryCrdReg(self.config, None)
+        chain = make_raw_chain(BLOCKS_PER_CHUNK)
+        self.assertEqual(1, self.blockchain.connect_chunk(0, ''.join(chain).encode('hex')))
+        self.assertIsNotNone(self.blockchain._pow_pool)
+
+    def test_reject_insufficient_pow(self):
+        chain = make_raw_chain(BLOCKS_PER_CHUNK)
+        # make the raw header at height 5 fail proof of work, keeping linkage valid
+        nonce = 0
+        while True:
+            raw = chain[5][:108] + HEADER_STRUCT.pack(0, '', '', '', 0, 0, nonce)[108:]
+            if int(hash_encode(PoWHash(raw)), 16) > REGTEST_TARGET:
+                break
+            nonce += 1
+        chain = chain[:5] + [raw] + make_raw_chain(BLOCKS_PER_CHUNK - 6, prev_raw=raw)
+        self.assertEqual(-1, self.blockchain.connect_chunk(0, ''.join(chain).encode('hex')))
+
+
+class TestCheckpoints(BlockchainTestCase):
+    def setUp(self):
+        super(TestCheckpoints, self).setUp()
+        self.chain = make_raw_chain(2 * BLOCKS_PER_CHUNK, pow=False)
+        self.chain += make_raw_chain(BLOCKS_PER_CHUNK, prev_raw=self.chain[-1])
+        self.chunks = [''.join(self.chain[i * BLOCKS_PER_CHUNK:(i + 1) * BLOCKS_PER_CHUNK])
+                       for i in range(3)]
+
+    def set_checkpoints(self, checkpoints):
+        self.blockchain.close()
+        self.config.options['checkpoints'] = checkpoints
+        self.blockchain = LbryCrdReg(self.config, None)
+
+    def test_config_checkpoints(self):
+        self.set_checkpoints({'191': hash_encode(Hash(self.chain[191]))})
+        self.assertEqual({191: hash_encode(Hash(self.chain[191]))}, self.blockchain.checkpoints)
+        self.assertEqual(191, self.blockchain.last_checkpoint)
+
+    def test_below_checkpoint_only_checks_linkage(self):
+        self.assertEqual(-1, self.blockchain.connect_chunk(0, self.chunks[0].encode('hex')))
+        self.set_checkpoints({'191': hash_encode(Hash(self.chain[191]))})
+        for idx in range(3):
+            self.assertEqual(idx + 1,
+                             self.blockchain.connect_chunk(idx, self.chunks[idx].encode('hex')))
+        self.assertEqual(3 * BLOCKS_PER_CHUNK - 1, self.blockchain.height())
+
+    def test_checkpoint_mismatch_rolls_back(self):
+        self.set_checkpoints({'150': '00' * 32})
+        self.assertEqual(1, self.blockchain.connect_chunk(0, self.chunks[0].encode('hex')))
+        self.assertEqual(0, self.blockchain.connect_chunk(1, self.chunks[1].encode('hex')))
+        self.assertEqual(-1, self.blockchain.height())
+        self.assertIsNone(self.blockchain.read_raw_header(0))
+
+    def test_forged_branch_below_checkpoint_rolls_back(self):
+        count = MAX_CHUNK_REWINDS + 3
+        chain = make_raw_chain(count * BLOCKS_PER_CHUNK, pow=False)
+        forged = chain[:BLOCKS_PER_CHUNK] + make_raw_chain(
+            (count - 2) * BLOCKS_PER_CHUNK, prev_raw=chain[BLOCKS_PER_CHUNK - 1],
+            merkle_byte='\x03', pow=False)
+        self.set_checkpoints({str(len(chain) - 1): hash_encode(Hash(chain[-1]))})
+        for idx in range(count - 1):
+            data = ''.join(forged[idx * BLOCKS_PER_CHUNK:(idx + 1) * BLOCKS_PER_CHUNK])
+            self.assertEqual(idx + 1, self.blockchain.connect_chunk(idx, data.encode('hex')))
+        # the honest chunk with the checkpoint doesn't link to the forged branch
+        data = ''.join(chain[(count - 1) * BLOCKS_PER_CHUNK:])
+        self.assertEqual(0, self.blockchain.connect_chunk(count - 1, data.encode('hex')))
+        self.assertEqual(-1, self.blockchain.height())
+
+
+class TestBootstrapHeaders(BlockchainTestCase):
+    def setUp(self):
+        super(TestBootstrapHeaders, self).setUp()
+        self.chain = make_raw_chain(2 * BLOCKS_PER_CHUNK + 10)
+        self.bootstrap_path = os.path.join(self.tmp_dir, 'bootstrap_headers')
+        self.blockchain.headers_url = self.bootstrap_path
+
+    def write_bootstrap(self, headers):
+        with open(self.bootstrap_path, 'wb') as f:
+            f.write(''.join(headers))
+
+    def test_bootstrap_from_file(self):
+        self.write_bootstrap(self.chain)
+        self.blockchain.init()
+        self.assertEqual(len(self.chain) - 1, self.blockchain.height())
+        self.assertEqual(self.chain[-1], self.blockchain.read_raw_header(len(self.chain) - 1))
+        self.assertFalse(os.path.exists(self.blockchain.bootstrap_marker_path()))
+
+    def test_invalid_bootstrap_is_rejected(self):
+        bad_header = make_raw_chain(1, merkle_byte='\x03')[0]
+        self.write_bootstrap(self.chain[:BLOCKS_PER_CHUNK] + [bad_header] + self.chain[97:])
+        self.blockchain.init()
+        self.assertEqual(-1, self.blockchain.height())
+        self.assertFalse(os.path.exists(self.blockchain.bootstrap_marker_path()))
+
+    def test_invalid_bootstrap_rolls_back_to_checkpoint(self):
+        chain = make_raw_chain((BOOTSTRAP_BATCH_CHUNKS + 2) * BLOCKS_PER_CHUNK, pow=False)
+        self.blockchain.close()
+        self.config.options['checkpoints'] = {str(len(chain) - 1): '00' * 32}
+        self.blockchain = LbryCrdReg(self.config, None)
+        self.blockchain.headers_url = self.bootstrap_path
+        self.write_bootstrap(chain)
+        self.blockchain.init()
+        # the first batch linked up but was never tied to the checkpoint
+        self.assertEqual(-1, self.blockchain.height())
+        self.assertFalse(os.path.exists(self.blockchain.bootstrap_marker_path()))
+
+    def test_resume_bootstrap(self):
+        self.write_bootstrap(self.chain)
+        with open(self.blockchain.path(), 'wb') as f:
+            f.write(''.join(self.chain[:BLOCKS_PER_CHUNK + 5]))
+        open(self.blockchain.bootstrap_marker_path(), 'w').close()
+        self.blockchain.init()
+        self.assertEqual(len(self.chain) - 1, self.blockchain.height())
+
+    def test_existing_headers_file_is_kept(self):
+        self.write_bootstrap(self.chain)
+        with open(self.blockchain.path(), 'wb') as f:
+            f.write(''.join(self.chain[:5]))
+        self.blockchain.init()
+        self.assertEqual(4, self.blockchain.height())
+
+
+class TestForks(BlockchainTestCase):
+    def setUp(self):
+        super(TestForks, self).setUp()
+        self.chain = make_raw_chain(2 * BLOCKS_PER_CHUNK)
+        for idx in range(2):
+            self.blockchain.connect_chunk(idx, self.chunk(self.chain, idx).encode('hex'))
+
+    def chunk(self, chain, idx):
+        return ''.join(chain[idx * BLOCKS_PER_CHUNK:(idx + 1) * BLOCKS_PER_CHUNK])
+
+    def header(self, chain, height):
+        header = self.blockchain.deserialize_header(chain[height])
+        header['block_height'] = height
+        return header
+
+    def test_extend_tip(self):
+        chain = self.chain + make_raw_chain(2, prev_raw=self.chain[-1])
+        self.assertTrue(self.blockchain.connect_header(self.header(chain, 192)))
+        self.assertTrue(self.blockchain.connect_header(self.header(chain, 193)))
+        self.assertEqual(193, self.blockchain.height())
+
+    def test_gap_fetches_ancestors(self):
+        chain = self.chain + make_raw_chain(5, prev_raw=self.chain[-1])
+        tip = self.header(chain, 196)
+        self.assertEqual(195, self.blockchain.connect_header(tip))
+        tip_hash = Hash(chain[196])
+        self.assertTrue(self.blockchain.connect_ancestors(2, self.chunk(chain, 2).encode('hex'),
+                                                          tip_hash))
+        self.assertEqual(196, self.blockchain.height())
+
+    def test_reorg_to_branch_with_more_work(self):
+        fork = self.chain[:150] + make_raw_chain(50, prev_raw=self.chain[149], merkle_byte='\x03')
+        tip_hash = Hash(fork[199])
+        self.assertEqual(198, self.blockchain.connect_header(self.header(fork, 199)))
+        self.assertEqual(191, self.blockchain.connect_ancestors(
+            2, self.chunk(fork, 2).encode('hex'), tip_hash))
+        self.assertTrue(self.blockchain.connect_ancestors(
+            1, self.chunk(fork, 1).encode('hex'), tip_hash))
+        self.assertEqual(199, self.blockchain.height())
+        self.assertEqual(fork[150], self.blockchain.read_raw_header(150))
+        self.assertEqual(self.chain[149], self.blockchain.read_raw_header(149))
+        self.assertEqual(150, self.blockchain.get_height(hash_encode(Hash(fork[150]))))
+        self.assertIsNone(self.blockchain.get_height(hash_encode(Hash(self.chain[150]))))
+        self.assertEqual(149, self.blockchain.get_height(hash_encode(Hash(self.chain[149]))))
+
+    def test_keep_branch_with_less_work(self):
+        fork = self.chain[:150] + make_raw_chain(30, prev_raw=self.chain[149], merkle_byte='\x03')
+        tip_hash = Hash(fork[179])
+        self.assertEqual(178, self.blockchain.connect_header(self.header(fork, 179)))
+        self.assertTrue(self.blockchain.connect_ancestors(
+            1, self.chunk(fork, 1).encode('hex'), tip_hash))
+        self.assertEqual(191, self.blockchain.height())
+        self.assertEqual(self.chain[150], self.blockchain.read_raw_header(150))
+
+        # the competing branch overtakes our chain
+        fork += make_raw_chain(15, prev_raw=fork[-1], merkle_byte='\x03')
+        self.assertTrue(self.blockchain.connect_header(self.header(fork, 180)))
+        self.assertEqual(191, self.blockchain.height())
+        for height in range(181, 195):
+            self.assertTrue(self.blockchain.connect_header(self.header(fork, height)))
+        self.assertEqual(194, self.blockchain.height())
+        self.assertEqual(fork[150], self.blockchain.read_raw_header(150))
+
+    def test_invalid_branch(self):
+        chain = self.chain + make_raw_chain(1, prev_raw=self.chain[-1], pow=False)
+        while check_pow((chain[-1], REGTEST_TARGET)):
+            chain[-1] = make_raw_chain(1, prev_raw=self.chain[-1], pow=False,
+                                       timestamp=HEADER_STRUCT.unpack(chain[-1])[4] + 1)[0]
+        self.assertFalse(self.blockchain.connect_header(self.header(chain, 192)))
+        self.assertEqual(191, self.blockchain.height())
@@ -0,0 +1,46 @@
+import threading
+import unittest
+from functools import partial
+
+from lbryum.dispatcher import CallbackDispatcher, subscriber
+
+
+class Subscriber(object):
+    def on_response(self, response):
+        pass
+
+
+def on_response(response):
+    pass
+
+
+class TestDispatcher(unittest.TestCase):
+    def test_subscriber(self):
+        obj = Subscriber()
+        self.assertIs(obj, subscriber(obj.on_response))
+        self.assertIs(obj, subscriber(partial(obj.on_response, 1)))
+        self.assertIs(on_response, subscriber(on_response))
+
+    def test_order_kept_per_key(self):
+        dispatcher = CallbackDispatcher(4, 10)
+        results = {}
+
+        def record(key, value):
+            results.setdefault(key, []).append((value, threading.current_thread()))
+
+        keys = [Subscriber() for _ in range(8)]
+        for value in range(50):
+            for key in keys:
+                dispatcher.dispatch(key, record, key, value)
+        dispatcher.stop()
+        for key in keys:
+            self.assertEqual(range(50), [value for value, _ in results[key]])
+            self.assertEqual(1, len(set(thread for _, thread in results[key])))
+
+    def test_failing_callback_logged(self):
+        dispatcher = CallbackDispatcher(1, 10)
+        results = []
+        dispatcher.dispatch(on_response, lambda: 1 / 0)
+        dispatcher.dispatch(on_response, results.append, 'after')
+        dispatcher.stop()
+        self.assertEqual(['after'], results)
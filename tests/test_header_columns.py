@@ -0,0 +1,59 @@
+import unittest
+
+from lbryum.blockchain import HEADER_STRUCT
+from lbryum.header_columns import HeaderColumns, np
+
+from tests.test_blockchain import BlockchainTestCase, make_raw_chain, REGTEST_BITS
+
+
+def make_timed_chain(timestamps):
+    chain = []
+    for timestamp in timestamps:
+        chain += make_raw_chain(1, prev_raw=chain[-1] if chain else None, timestamp=timestamp)
+    return chain
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestHeaderColumns(unittest.TestCase):
+    def setUp(self):
+        super(TestHeaderColumns, self).setUp()
+        self.timestamps = [1000, 1150, 1290, 1600, 1450, 1750]
+        self.columns = HeaderColumns(''.join(make_timed_chain(self.timestamps)), start_height=10)
+
+    def test_columns(self):
+        self.assertEqual(6, len(self.columns))
+        self.assertEqual(self.timestamps, list(self.columns.timestamps))
+        self.assertEqual([REGTEST_BITS] * 6, list(self.columns.bits))
+        self.assertEqual(range(10, 16), list(self.columns.heights))
+
+    def test_time_queries(self):
+        self.assertEqual([11, 12, 14], list(self.columns.heights_between(1100, 1500)))
+        self.assertEqual([150, 140, 310, -150, 300], list(self.columns.block_intervals()))
+        self.assertEqual(150.0, self.columns.mean_block_time())
+        self.assertEqual(145.0, self.columns.mean_block_time(10, 12))
+        self.assertIsNone(self.columns.mean_block_time(12, 12))
+
+    def test_median_time_past(self):
+        self.assertEqual([1000, 1075, 1150, 1220, 1290, 1370],
+                         list(self.columns.median_time_past()))
+        self.assertEqual([1000, 1075, 1150, 1290, 1450, 1600],
+                         list(self.columns.median_time_past(span=3)))
+
+    def test_bits(self):
+        bits = [0x1d00ffff, 0x207fffff, 0x02008000, 0x1d800000]
+        data = ''.join(HEADER_STRUCT.pack(0, '', '', '', 0, b, 0) for b in bits)
+        columns = HeaderColumns(data)
+        self.assertEqual([True, False, False, False], list(columns.valid_bits()))
+        self.assertEqual(float(0xffff << 208), columns.targets()[0])
+        self.assertAlmostEqual(2.0, columns.work()[1], places=6)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestBlockchainColumns(BlockchainTestCase):
+    def test_header_columns(self):
+        chain = make_timed_chain(range(0, 1500, 150))
+        self.blockchain.store.write(0, ''.join(chain))
+        columns = self.blockchain.header_columns()
+        self.assertEqual(10, len(columns))
+        self.assertEqual(150.0, columns.mean_block_time())
+        self.assertAlmostEqual(2.0 / 150, columns.hash_rate(), places=6)
@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lbryum.constants import HEADER_SIZE
+from lbryum.hash_index import HashIndex
+from lbryum.hashing import Hash
+from lbryum.header_store import HeaderStore
+
+
+def fake_header(height):
+    return chr(height % 256) * HEADER_SIZE
+
+
+class TestHeaderStore(unittest.TestCase):
+    def setUp(self):
+        super(TestHeaderStore, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'blockchain_headers')
+        self.store = HeaderStore(self.path)
+
+    def tearDown(self):
+        super(TestHeaderStore, self).tearDown()
+        self.store.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_missing_file(self):
+        self.store.refresh()
+        self.assertEqual(0, self.store.count())
+        self.assertIsNone(self.store.read_raw(0))
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+        self.store.refresh()
+        self.assertEqual(0, self.store.count())
+        self.assertIsNone(self.store.read_raw(0))
+
+    def test_write_and_read(self):
+        self.store.write(0, fake_header(0) + fake_header(1))
+        self.assertEqual(2, self.store.count())
+        self.assertEqual(fake_header(0), self.store.read_raw(0))
+        self.assertEqual(fake_header(1), self.store.read_raw(1))
+        self.assertIsNone(self.store.read_raw(2))
+        self.assertIsNone(self.store.read_raw(-1))
+
+    def test_remap_on_growth(self):
+        self.store.write(0, fake_header(0))
+        self.store.write(1, fake_header(1))
+        self.assertEqual(fake_header(1), self.store.read_raw(1))
+        self.assertEqual(fake_header(0) + fake_header(1), self.store.read_range(0, 5))
+
+    def test_external_growth(self):
+        self.store.write(0, fake_header(0))
+        self.store.flush()
+        with open(self.path, 'ab') as f:
+            f.write(fake_header(1))
+        self.assertIsNone(self.store.read_raw(1))
+        self.store.refresh()
+        self.assertEqual(fake_header(1), self.store.read_raw(1))
+
+    def test_writes_are_held_until_flushed(self):
+        self.store.write(0, fake_header(0) + fake_header(1))
+        self.store.write(3, fake_header(3))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(self.store.exists())
+        self.assertEqual(4, self.store.count())
+        self.assertEqual(fake_header(1), self.store.read_raw(1))
+        self.assertEqual(fake_header(0) + fake_header(1), self.store.read_range(0, 4))
+        self.store.flush()
+        self.assertEqual(4 * HEADER_SIZE, os.path.getsize(self.path))
+        self.assertEqual(fake_header(3), self.store.read_raw(3))
+
+    def test_flush_when_full(self):
+        self.store.max_pending = 3
+        self.store.write(0, fake_header(0) + fake_header(1))
+        self.assertFalse(os.path.exists(self.path))
+        self.store.write(2, fake_header(2))
+        self.assertEqual(3 * HEADER_SIZE, os.path.getsize(self.path))
+
+    def test_truncate(self):
+        self.store.write(0, fake_header(0) + fake_header(1))
+        self.store.flush()
+        self.store.write(2, fake_header(2))
+        self.store.truncate(1)
+        self.assertEqual(1, self.store.count())
+        self.assertEqual(HEADER_SIZE, os.path.getsize(self.path))
+        self.assertIsNone(self.store.read_raw(2))
+
+    def test_overwrite_visible(self):
+        self.store.write(0, fake_header(0) + fake_header(1))
+        self.store.write(1, fake_header(7))
+        self.assertEqual(fake_header(7), self.store.read_raw(1))
+
+    def test_replace(self):
+        self.store.write(0, fake_header(0) + fake_header(1) + fake_header(2))
+        self.store.flush()
+        self.store.replace(1, fake_header(5) + fake_header(6) + fake_header(7))
+        self.assertEqual(4, self.store.count())
+        self.assertEqual(4 * HEADER_SIZE, os.path.getsize(self.path))
+        self.assertEqual(fake_header(0) + fake_header(5), self.store.read_range(0, 2))
+
+    def test_find(self):
+        self.store.write(0, fake_header(0) + fake_header(1))
+        self.assertEqual(1, self.store.find(Hash(fake_header(1))))
+        self.assertIsNone(self.store.find(Hash(fake_header(2))))
+        self.store.truncate(1)
+        self.assertIsNone(self.store.find(Hash(fake_header(1))))
+        self.store.write(1, fake_header(2))
+        self.assertEqual(1, self.store.find(Hash(fake_header(2))))
+
+    def test_index_persisted(self):
+        self.store.write(0, fake_header(0) + fake_header(1))
+        self.store.close()
+        self.store = HeaderStore(self.path)
+        self.store.refresh()
+        self.assertEqual(2, self.store.index.count)
+        self.assertEqual(1, self.store.find(Hash(fake_header(1))))
+
+    def test_index_follows_external_changes(self):
+        self.store.write(0, fake_header(0) + fake_header(1))
+        self.store.close()
+        with open(self.path, 'wb') as f:
+            f.write(fake_header(5))
+        self.store = HeaderStore(self.path)
+        self.store.refresh()
+        self.assertIsNone(self.store.find(Hash(fake_header(0))))
+        self.assertEqual(0, self.store.find(Hash(fake_header(5))))
+
+
+class TestHashIndex(unittest.TestCase):
+    def setUp(self):
+        super(TestHashIndex, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index = HashIndex(os.path.join(self.tmp_dir, 'index'))
+        self.index.open()
+
+    def tearDown(self):
+        super(TestHashIndex, self).tearDown()
+        self.index.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_grow_and_remove(self):
+        hashes = [Hash(str(i)) for i in range(40000)]
+        # colliding prefixes are resolved by the caller
+        hashes[7] = hashes[3][:4] + '\x00' * 28
+        self.index.append(hashes)
+        self.assertEqual(1 << 17, self.index.slots)
+        self.assertEqual([3, 7], sorted(self.index.candidates(hashes[3])))
+        self.index.remove(hashes[5:])
+        self.assertEqual(5, self.index.count)
+        self.assertEqual([3], self.index.candidates(hashes[3]))
+        for i, block_hash in enumerate(hashes[8:], 8):
+            self.assertEqual([], self.index.candidates(block_hash))
+        for i, block_hash in enumerate(hashes[:3]):
+            self.assertEqual([i], self.index.candidates(block_hash))
@@ -0,0 +1,148 @@
+import json
+import socket
+import unittest
+
+from lbryum.constants import PRIORITY_HIGH, PRIORITY_LOW
+from lbryum.interface import Interface, ServerStats
+
+
+class TestBatchRequests(unittest.TestCase):
+    def setUp(self):
+        super(TestBatchRequests, self).setUp()
+        self.remote, local = socket.socketpair()
+        self.remote.settimeout(1)
+        self.interface = Interface('server0:50001:t', local, batch_requests=True)
+
+    def tearDown(self):
+        super(TestBatchRequests, self).tearDown()
+        self.remote.close()
+        self.interface.close()
+
+    def receive_lines(self, count):
+        received = ''
+        while received.count('\n') < count:
+            received += self.remote.recv(4096)
+        return map(json.loads, received.splitlines())
+
+    def respond(self, message):
+        self.remote.sendall(json.dumps(message) + '\n')
+
+    def get_responses(self):
+        responses = []
+        while not responses:
+            responses = self.interface.get_responses()
+        return responses
+
+    def test_batch(self):
+        self.interface.queue_request('server.banner', [], 0)
+        self.interface.queue_request('blockchain.address.get_history', ['addr'], 1)
+        self.interface.send_requests()
+        batch, = self.receive_lines(1)
+        self.assertEqual([0, 1], [r['id'] for r in batch])
+        self.assertEqual('2.0', batch[0]['jsonrpc'])
+
+        self.respond([{'id': 1, 'result': []}, {'id': 0, 'result': 'hi'}])
+        responses = self.get_responses()
+        self.assertEqual([1, 0], [request[2] for request, _ in responses])
+        self.assertEqual('hi', responses[1][1]['result'])
+        self.assertFalse(self.interface.unanswered_requests)
+        self.assertFalse(self.interface.batched_ids)
+
+    def test_single_request_not_batched(self):
+        self.interface.queue_request('server.banner', [], 0)
+        self.interface.send_requests()
+        request, = self.receive_lines(1)
+        self.assertEqual(0, request['id'])
+
+    def test_batch_rejected(self):
+        self.interface.queue_request('server.banner', [], 0)
+        self.interface.queue_request('server.version', [], 1)
+        self.interface.send_requests()
+        self.receive_lines(1)
+        self.respond({'id': None, 'error': {'code': -32600, 'message': 'Invalid Request'}})
+        while not self.interface.unsent_requests:
+            self.assertEqual([], self.interface.get_responses())
+        self.assertFalse(self.interface.batch_requests)
+
+        self.interface.send_requests()
+        self.assertEqual([0, 1], [r['id'] for r in self.receive_lines(2)])
+
+    def test_rejected_batch_keeps_priorities(self):
+        self.interface.queue_request('blockchain.address.subscribe', ['a'], 0, PRIORITY_LOW)
+        self.interface.queue_request('blockchain.address.subscribe', ['b'], 1, PRIORITY_LOW)
+        self.interface.send_requests()
+        self.receive_lines(1)
+        self.respond({'id': None, 'error': {'code': -32600, 'message': 'Invalid Request'}})
+        while not self.interface.unsent_requests:
+            self.assertEqual([], self.interface.get_responses())
+        self.interface.queue_request('server.banner', [], 2)
+        self.assertEqual([2, 0, 1], [request[2] for request in self.interface.unsent_requests])
+        self.assertFalse(self.interface.sent_priorities)
+
+
+class TestInflightLimit(unittest.TestCase):
+    def test_requests_held_back_until_answered(self):
+        remote, local = socket.socketpair()
+        self.addCleanup(remote.close)
+        interface = Interface('server0:50001:t', local, max_inflight=2)
+        self.addCleanup(interface.close)
+        for message_id in range(3):
+            interface.queue_request('server.banner', [], message_id)
+        interface.send_requests()
+        self.assertEqual([0, 1], sorted(interface.unanswered_requests))
+        self.assertEqual(1, len(interface.unsent_requests))
+        self.assertFalse(interface.can_send())
+
+        remote.sendall(json.dumps({'id': 0, 'result': 'hi'}) + '\n')
+        while not interface.get_responses():
+            pass
+        self.assertTrue(interface.can_send())
+        interface.send_requests()
+        self.assertEqual([1, 2], sorted(interface.unanswered_requests))
+        self.assertFalse(interface.unsent_requests)
+
+
+class TestPriorities(unittest.TestCase):
+    def test_urgent_requests_sent_first(self):
+        remote, local = socket.socketpair()
+        self.addCleanup(remote.close)
+        interface = Interface('server0:50001:t', local, max_inflight=2)
+        self.addCleanup(interface.close)
+        interface.queue_request('blockchain.address.subscribe', ['a'], 0, PRIORITY_LOW)
+        interface.queue_request('blockchain.address.subscribe', ['b'], 1, PRIORITY_LOW)
+        interface.queue_request('server.banner', [], 2)
+        interface.queue_request('blockchain.claimtrie.getvalue', ['name'], 3, PRIORITY_HIGH)
+        interface.send_requests()
+        self.assertEqual([2, 3], sorted(interface.unanswered_requests))
+        self.assertEqual([0, 1], [request[2] for request in interface.unsent_requests])
+        self.assertEqual([PRIORITY_LOW] * 2, interface.unsent_priorities)
+
+
+class TestServerStats(unittest.TestCase):
+    def test_averages(self):
+        stats = ServerStats()
+        self.assertIsNone(stats.score())
+        stats.add_response(1.0, None)
+        self.assertEqual(1.0, stats.rtt)
+        self.assertEqual(1.0, stats.score())
+        stats.add_response(2.0, {'message': 'error'})
+        self.assertAlmostEqual(1.2, stats.rtt)
+        self.assertAlmostEqual(0.2, stats.error_rate)
+        stats.add_timeout()
+        self.assertEqual(1, stats.timeouts)
+        self.assertAlmostEqual(0.2, stats.failure_rate)
+        self.assertAlmostEqual(1.2 * 1.8 * 1.8, stats.score())
+
+    def test_interface_times_responses(self):
+        remote, local = socket.socketpair()
+        self.addCleanup(remote.close)
+        stats = ServerStats()
+        interface = Interface('server0:50001:t', local, stats=stats)
+        self.addCleanup(interface.close)
+        interface.queue_request('server.banner', [], 0)
+        interface.send_requests()
+        remote.sendall(json.dumps({'id': 0, 'result': 'hi'}) + '\n')
+        while not interface.get_responses():
+            pass
+        self.assertEqual(1, stats.responses)
+        self.assertIsNotNone(stats.rtt)
@@ -0,0 +1,57 @@
+import threading
+import time
+import unittest
+from functools import partial
+
+from lbryum.loop_monitor import LoopMonitor, callback_site
+
+
+class Wallet(object):
+    def receive_history(self, response):
+        return response
+
+
+def on_response(response):
+    return response
+
+
+class TestCallbackSite(unittest.TestCase):
+    def test_names(self):
+        self.assertEqual('tests.test_loop_monitor.on_response', callback_site(on_response))
+        self.assertEqual('tests.test_loop_monitor.Wallet.receive_history',
+                         callback_site(Wallet().receive_history))
+        self.assertEqual('tests.test_loop_monitor.on_response',
+                         callback_site(partial(on_response, 1)))
+
+
+class TestLoopMonitor(unittest.TestCase):
+    def setUp(self):
+        super(TestLoopMonitor, self).setUp()
+        self.monitor = LoopMonitor(stall_threshold=0, slow_threshold=0.01)
+
+    def test_callbacks_timed_by_site(self):
+        self.assertEqual(1, self.monitor.call(on_response, 1))
+        self.monitor.call(on_response, 2)
+        self.monitor.run_phase('run_jobs', time.sleep, 0.02)
+        stats = self.monitor.get_stats()
+        self.assertEqual(2, stats['callbacks']['tests.test_loop_monitor.on_response']['count'])
+        self.assertGreaterEqual(stats['phases']['run_jobs']['max'], 0.02)
+        self.assertFalse(self.monitor.running)
+
+    def test_stall_sampled_once(self):
+        self.monitor.stall_threshold = 1.0
+        self.monitor.thread_id = threading.current_thread().ident
+        self.monitor.running.append(('run_jobs', time.time() - 2))
+        self.monitor.running.append(('tests.test_loop_monitor.on_response', time.time()))
+        self.monitor.check()
+        self.monitor.check()
+        stall, = self.monitor.get_stats()['stalls']
+        self.assertEqual('run_jobs', stall['phase'])
+        self.assertEqual('tests.test_loop_monitor.on_response', stall['site'])
+        self.assertIn('test_stall_sampled_once', ''.join(stall['stack']))
+
+    def test_no_stall_below_threshold(self):
+        self.monitor.stall_threshold = 1.0
+        self.monitor.running.append(('run_jobs', time.time()))
+        self.monitor.check()
+        self.assertFalse(self.monitor.get_stats()['stalls'])
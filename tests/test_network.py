@@ -0,0 +1,648 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from lbryum import lbrycrd
+from lbryum.constants import BLOCKS_PER_CHUNK, COIN, MIN_RTT_SAMPLES
+from lbryum.constants import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
+from lbryum.errors import RequestQueueFull
+from lbryum.interface import ServerStats
+from lbryum.network import Network, pick_fastest_server, probe_servers
+from lbryum.network import read_probed_servers, save_probed_servers
+from lbryum.simple_config import SimpleConfig
+
+from tests.test_blockchain import make_raw_chain
+
+
+class OfflineNetwork(Network):
+    """A Network that doesn't probe or connect to any servers"""
+
+    def _set_online_servers(self):
+        self.online_servers = {}
+
+    def start_network(self, protocol, proxy):
+        self.disconnected_servers = set()
+        self.protocol = protocol
+
+
+class FakeInterface(object):
+    def __init__(self, server):
+        self.server = server
+        self.host = server.split(':')[0]
+        self.requests = []
+        self.priorities = {}
+        self.unsent_requests = []
+        self.unanswered_requests = {}
+        # requests are written as soon as they are queued
+        self.sent_times = {}
+        self.response_rtts = {}
+        self.responses = []
+        self.closed = False
+
+    def get_responses(self):
+        responses, self.responses = self.responses, []
+        return responses
+
+    def respond(self, message_id, **response):
+        response['id'] = message_id
+        self.response_rtts[message_id] = time.time() - self.sent_times.pop(message_id)
+        self.responses.append((self.unanswered_requests.pop(message_id), response))
+
+    def queue_request(self, method, params, message_id, priority=PRIORITY_NORMAL):
+        self.requests.append((method, params, message_id))
+        self.priorities[message_id] = priority
+        self.unanswered_requests[message_id] = method, params, message_id
+        self.sent_times[message_id] = time.time()
+
+    def close(self):
+        self.closed = True
+
+
+class NetworkTestCase(unittest.TestCase):
+    config_options = {}
+
+    def setUp(self):
+        super(NetworkTestCase, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self._address_prefixes = lbrycrd.SCRIPT_ADDRESS, lbrycrd.PUBKEY_ADDRESS
+        options = {
+            'lbryum_path': self.tmp_dir,
+            'chain': 'lbrycrd_regtest',
+            'server': 'server0:50001:t',
+        }
+        options.update(self.config_options)
+        self.config = SimpleConfig(
+            options, read_system_config_function=lambda: {}, read_user_config_function=lambda _: {})
+        self.network = OfflineNetwork(self.config)
+
+    def tearDown(self):
+        super(NetworkTestCase, self).tearDown()
+        self.network.blockchain.close()
+        self.network.poller.close()
+        self.network.waker.close()
+        if self.network.dispatcher:
+            self.network.dispatcher.stop()
+        lbrycrd.SCRIPT_ADDRESS, lbrycrd.PUBKEY_ADDRESS = self._address_prefixes
+        shutil.rmtree(self.tmp_dir)
+
+    def add_interface(self, server, height=None):
+        interface = FakeInterface(server)
+        self.network.interfaces[server] = interface
+        if height is not None:
+            self.network.heights[server] = height
+        return interface
+
+
+class TestChunkCatchUp(NetworkTestCase):
+    def chunk_requests(self, interface):
+        return [params[0] for method, params, _ in interface.requests
+                if method == 'blockchain.block.get_chunk']
+
+    def test_pipelined_chunks(self):
+        chain = make_raw_chain(4 * BLOCKS_PER_CHUNK)
+        chunks = [''.join(chain[i * BLOCKS_PER_CHUNK:(i + 1) * BLOCKS_PER_CHUNK]).encode('hex')
+                  for i in range(4)]
+        tip = 4 * BLOCKS_PER_CHUNK - 1
+        interfaces = [self.add_interface('server%d:50001:t' % i, tip) for i in range(2)]
+        self.network.on_header(interfaces[0], {'block_height': tip})
+        self.network.handle_bc_requests()
+
+        # all chunks are requested at once, spread over both interfaces
+        self.assertEqual([0, 2], self.chunk_requests(interfaces[0]))
+        self.assertEqual([1, 3], self.chunk_requests(interfaces[1]))
+
+        # out of order responses are buffered until they connect
+        self.network.on_get_chunk(interfaces[1], {'params': [1], 'result': chunks[1]})
+        self.assertEqual(0, self.network.get_local_height())
+        self.network.on_get_chunk(interfaces[0], {'params': [0], 'result': chunks[0]})
+        self.assertEqual(2 * BLOCKS_PER_CHUNK - 1, self.network.get_local_height())
+        self.network.on_get_chunk(interfaces[1], {'params': [3], 'result': chunks[3]})
+        self.network.on_get_chunk(interfaces[0], {'params': [2], 'result': chunks[2]})
+        self.assertEqual(tip, self.network.get_local_height())
+        self.assertFalse(self.network.bc_requests)
+        self.assertIsNone(self.network.chunk_next)
+
+    def test_timed_out_chunk_is_requested_elsewhere(self):
+        tip = 2 * BLOCKS_PER_CHUNK - 1
+        interfaces = [self.add_interface('server%d:50001:t' % i, tip) for i in range(2)]
+        self.network.on_header(interfaces[0], {'block_height': tip})
+        self.network.handle_bc_requests()
+        self.assertEqual([0], self.chunk_requests(interfaces[0]))
+        self.assertEqual([1], self.chunk_requests(interfaces[1]))
+
+        self.network.chunk_requests[0] = interfaces[0], 0
+        self.network.handle_bc_requests()
+        self.assertEqual([1, 0], self.chunk_requests(interfaces[1]))
+
+    def test_chunks_only_requested_from_servers_having_them(self):
+        interfaces = [self.add_interface('server0:50001:t', BLOCKS_PER_CHUNK),
+                      self.add_interface('server1:50001:t', 3 * BLOCKS_PER_CHUNK)]
+        self.network.on_header(interfaces[1], {'block_height': 3 * BLOCKS_PER_CHUNK})
+        self.network.handle_bc_requests()
+        self.assertEqual([0], self.chunk_requests(interfaces[0]))
+        self.assertEqual([1, 2], self.chunk_requests(interfaces[1]))
+
+
+class TestEventLoop(NetworkTestCase):
+    def test_send_wakes_loop(self):
+        start = time.time()
+        self.network.send([('server.banner', [])], lambda response: None)
+        self.network.wait_on_sockets()
+        self.assertLess(time.time() - start, 0.1)
+
+    def test_request_and_response(self):
+        server_socket, client_socket = socket.socketpair()
+        self.addCleanup(server_socket.close)
+        self.network.new_interface('server0:50001:t', client_socket)
+        responses = []
+        self.network.send([('server.banner', [])], responses.append)
+        self.network.process_pending_sends()
+        self.network.wait_on_sockets()
+
+        server_socket.settimeout(1)
+        received = ''
+        while received.count('\n') < 6:
+            received += server_socket.recv(4096)
+        requests = [json.loads(line) for line in received.splitlines()]
+        # the subscriptions for a new main interface go first
+        self.assertEqual('blockchain.headers.subscribe', requests[0]['method'])
+        self.assertEqual('server.banner', requests[-1]['method'])
+        response = json.dumps({'id': requests[-1]['id'], 'result': 'hi'}) + '\n'
+        server_socket.sendall(response)
+        self.network.wait_on_sockets()
+        self.assertEqual(['hi'], [r['result'] for r in responses])
+
+        stats = self.network.get_network_stats()
+        banner = stats['methods']['server.banner']
+        # a new main interface is asked for its banner too
+        self.assertEqual(2, banner['requests'])
+        self.assertEqual(1, banner['responses'])
+        self.assertEqual(len(response), banner['bytes_received'])
+        self.assertEqual(1, banner['response_times']['count'])
+        self.assertEqual(6, stats['servers']['server0:50001:t']['requests'])
+        self.assertEqual(len(received), stats['servers']['server0:50001:t']['bytes_sent'])
+        self.assertEqual(5, stats['queues']['interfaces']['server0:50001:t']['unanswered_requests'])
+
+        self.network.connection_down('server0:50001:t')
+        self.assertFalse(self.network.polled_interfaces)
+
+
+class TestLoopEngine(NetworkTestCase):
+    config_options = {'network_engine': 'loop'}
+
+    def run_loop(self, done, timeout=5):
+        deadline = time.time() + timeout
+        while not done() and time.time() < deadline:
+            self.network.maintain_sockets()
+            self.network.wait_on_sockets()
+
+    def test_connect(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        server = '127.0.0.1:%d:t' % listener.getsockname()[1]
+        self.network.start_interface(server)
+        self.run_loop(lambda: server in self.network.interfaces)
+        self.assertIn(server, self.network.interfaces)
+        self.assertNotIn(server, self.network.connecting)
+        self.assertNotIn(server, self.network.pending_connections)
+        connection, _ = listener.accept()
+        self.addCleanup(connection.close)
+        self.network.stop_network()
+
+    def test_connection_refused(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        server = '127.0.0.1:%d:t' % listener.getsockname()[1]
+        listener.close()
+        self.network.start_interface(server)
+        self.run_loop(lambda: server not in self.network.connecting)
+        self.assertNotIn(server, self.network.interfaces)
+        self.assertIn(server, self.network.disconnected_servers)
+        self.assertNotIn(server, self.network.pending_connections)
+
+
+class TestRequestCoalescing(NetworkTestCase):
+    def setUp(self):
+        super(TestRequestCoalescing, self).setUp()
+        self.network.interface = self.add_interface('server0:50001:t')
+
+    def respond(self, message_id, result):
+        method, params, callback = self.network.unanswered_requests.pop(message_id)[:3]
+        callback({'method': method, 'params': params, 'result': result})
+
+    def test_identical_requests_coalesced(self):
+        responses = []
+        for _ in range(3):
+            self.network.send([('blockchain.transaction.get', ['ab'])], responses.append)
+        self.network.send([('blockchain.transaction.get', ['cd'])], responses.append)
+        self.network.process_pending_sends()
+        requests = self.network.interface.requests
+        self.assertEqual([['ab'], ['cd']], [params for _, params, _ in requests])
+
+        self.respond(requests[0][2], 'tx')
+        self.assertEqual(['tx'] * 3, [r['result'] for r in responses])
+        self.assertFalse(self.network.inflight_requests.get(
+            self.network.get_request_key('blockchain.transaction.get', ['ab'])))
+
+        # once answered the next request goes to the server again
+        self.network.send([('blockchain.transaction.get', ['ab'])], responses.append)
+        self.network.process_pending_sends()
+        self.assertEqual(3, len(requests))
+
+    def test_coalesced_callers_get_their_own_result(self):
+        results = []
+
+        def format_claim(response):
+            result = response['result']
+            result['amount'] = float(result['amount']) / COIN
+            results.append(result)
+
+        for _ in range(2):
+            self.network.send([('blockchain.claimtrie.getclaimbyid', ['abc'])], format_claim)
+        self.network.process_pending_sends()
+        self.respond(self.network.interface.requests[0][2], {'amount': COIN})
+        self.assertEqual([{'amount': 1.0}] * 2, results)
+        self.assertIsNot(results[0], results[1])
+
+    def test_params_beyond_the_first_distinguish_requests(self):
+        for block_hash in ('aa', 'bb'):
+            self.network.send([('blockchain.claimtrie.getvalue', ['name', block_hash])],
+                              lambda r: None)
+        self.network.process_pending_sends()
+        self.assertEqual(2, len(self.network.interface.requests))
+
+    def test_broadcasts_not_coalesced(self):
+        for _ in range(2):
+            self.network.send([('blockchain.transaction.broadcast', ['00'])], lambda r: None)
+        self.network.process_pending_sends()
+        self.assertEqual(2, len(self.network.interface.requests))
+
+    def test_cached_response(self):
+        responses = []
+        request = ('blockchain.claimtrie.getclaimbyid', ['abc'])
+        self.network.send([request], responses.append)
+        self.network.process_pending_sends()
+        self.respond(self.network.interface.requests[0][2], {'claim_id': 'abc'})
+        self.network.send([request], responses.append)
+        self.network.process_pending_sends()
+        self.assertEqual(1, len(self.network.interface.requests))
+        self.assertEqual([{'claim_id': 'abc'}] * 2, [r['result'] for r in responses])
+
+        # a new block may change the claim
+        self.network.on_header(self.network.interface, {'block_height': 10})
+        self.network.send([request], responses.append)
+        self.network.process_pending_sends()
+        self.assertEqual(2, len(self.network.interface.requests))
+
+
+class TestBackpressure(NetworkTestCase):
+    config_options = {'max_pending_requests': 2, 'max_inflight_requests': 3,
+                      'send_timeout': 0.1}
+
+    def setUp(self):
+        super(TestBackpressure, self).setUp()
+        self.network.interface = self.add_interface('server0:50001:t')
+
+    def test_send_blocks_while_queue_full(self):
+        self.network.send([('blockchain.transaction.get', [txid]) for txid in ('aa', 'bb')],
+                          lambda r: None)
+        with self.assertRaises(RequestQueueFull):
+            self.network.send([('blockchain.transaction.get', ['cc'])], lambda r: None)
+        self.network.process_pending_sends()
+        self.network.send([('blockchain.transaction.get', ['cc'])], lambda r: None)
+        self.assertEqual(1, len(self.network.pending_sends))
+
+    def test_burst_larger_than_queue_accepted_when_empty(self):
+        self.network.send([('blockchain.transaction.get', [str(i)]) for i in range(5)],
+                          lambda r: None)
+        self.assertEqual(5, len(self.network.pending_sends))
+
+    def test_requests_queued_at_the_pace_of_the_server(self):
+        self.network.interface.unsent_requests = [None, None]
+        self.network.send([('blockchain.transaction.get', [txid]) for txid in ('aa', 'bb')],
+                          lambda r: None)
+        self.network.process_pending_sends()
+        self.assertEqual(1, len(self.network.interface.requests))
+        self.assertEqual(1, len(self.network.pending_sends))
+
+        self.network.interface.unsent_requests = []
+        self.network.process_pending_sends()
+        self.assertEqual(2, len(self.network.interface.requests))
+        self.assertFalse(self.network.pending_sends)
+
+    def test_interactive_requests_go_first(self):
+        self.network.max_pending = 100
+        self.network.send([('blockchain.address.get_history', [str(i)]) for i in range(10)],
+                          lambda r: None, PRIORITY_LOW)
+        self.network.send([('blockchain.claimtrie.getvalue', ['name'])], lambda r: None,
+                          PRIORITY_HIGH)
+        self.network.process_pending_sends()
+        requests = self.network.interface.requests
+        self.assertEqual(['blockchain.claimtrie.getvalue', 'blockchain.address.get_history',
+                          'blockchain.address.get_history'], [method for method, _, _ in requests])
+        self.assertEqual(PRIORITY_HIGH, self.network.interface.priorities[requests[0][2]])
+        self.assertEqual(8, len(self.network.pending_sends))
+
+
+class TestCallbackDispatch(NetworkTestCase):
+    config_options = {'callback_workers': 2}
+
+    def setUp(self):
+        super(TestCallbackDispatch, self).setUp()
+        self.network.interface = self.add_interface('server0:50001:t')
+        # pretend the test runs the network loop
+        self.network.on_network_thread = lambda: True
+        self.threads = []
+        self.results = []
+
+    def callback(self, response):
+        self.threads.append(threading.current_thread())
+        self.results.append(response['result'])
+
+    def test_callbacks_run_in_order_off_the_network_thread(self):
+        for txid in ('aa', 'bb', 'cc'):
+            self.network.send([('blockchain.transaction.broadcast', [txid])], self.callback)
+        self.network.process_pending_sends()
+        for method, params, message_id in self.network.interface.requests:
+            self.network.interface.respond(message_id, method=method, params=params,
+                                           result=params[0])
+        self.network.process_responses(self.network.interface)
+        self.network.dispatcher.stop()
+        self.assertEqual(['aa', 'bb', 'cc'], self.results)
+        self.assertEqual(1, len(set(self.threads)))
+        self.assertNotIn(threading.current_thread(), self.threads)
+
+    def test_jobs_not_queued_twice(self):
+        job = Job()
+        self.network.add_jobs([job])
+        job.event.clear()
+        self.network.run_jobs()
+        self.network.run_jobs()
+        job.event.set()
+        self.network.dispatcher.stop()
+        self.assertEqual(1, job.runs)
+        self.assertFalse(self.network.dispatched_jobs)
+
+
+class Job(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.runs = 0
+
+    def run(self):
+        self.event.wait()
+        self.runs += 1
+
+
+class TestReadBalancing(NetworkTestCase):
+    def setUp(self):
+        super(TestReadBalancing, self).setUp()
+        self.main = self.network.interface = self.add_interface('server0:50001:t', 100)
+        self.other = self.add_interface('server1:50001:t', 100)
+        self.lagging = self.add_interface('server2:50001:t', 99)
+
+    def send(self, method, params):
+        self.network.send([(method, params)], lambda r: None)
+        self.network.process_pending_sends()
+
+    def test_reads_spread_over_up_to_date_interfaces(self):
+        for txid in ('aa', 'bb', 'cc'):
+            self.send('blockchain.transaction.get', [txid])
+        self.send('blockchain.address.subscribe', ['addr'])
+        self.send('blockchain.transaction.broadcast', ['00'])
+        self.assertEqual([['aa'], ['cc'], ['addr'], ['00']],
+                         [params for _, params, _ in self.main.requests])
+        self.assertEqual([['bb']], [params for _, params, _ in self.other.requests])
+        self.assertFalse(self.lagging.requests)
+
+    def test_requests_resent_when_interface_closes(self):
+        self.send('blockchain.transaction.get', ['aa'])
+        self.send('blockchain.transaction.get', ['bb'])
+        self.assertEqual(1, len(self.other.requests))
+        self.network.connection_down(self.other.server)
+        self.assertEqual([['aa'], ['bb']], [params for _, params, _ in self.main.requests])
+        self.assertEqual(2, len(self.network.unanswered_requests))
+        self.assertFalse(self.network.request_interfaces)
+
+
+class TestServerSelection(NetworkTestCase):
+    def make_stats(self, rtt, responses=MIN_RTT_SAMPLES):
+        stats = ServerStats()
+        for _ in range(responses):
+            stats.add_response(rtt, None)
+        return stats
+
+    def test_pick_fastest_server(self):
+        stats = {'a': self.make_stats(0.5), 'b': self.make_stats(0.1)}
+        self.assertEqual('b', pick_fastest_server(['a', 'b', 'c'], stats, exploration_rate=0))
+        self.assertIn(pick_fastest_server(['c', 'd'], stats, exploration_rate=0), ['c', 'd'])
+        self.assertIsNone(pick_fastest_server([], stats))
+
+    def test_switch_to_faster_interface(self):
+        self.network.auto_connect = True
+        self.network.interface = self.add_interface('server0:50001:t', 100)
+        self.add_interface('server1:50001:t', 100)
+        self.add_interface('server2:50001:t', 99)
+        self.network.server_stats = {
+            'server0:50001:t': self.make_stats(1.0),
+            'server1:50001:t': self.make_stats(0.4),
+            'server2:50001:t': self.make_stats(0.1),
+        }
+        self.network.server_switch_time = 0
+        self.network.switch_to_faster_interface()
+        # server2 is faster but behind
+        self.assertEqual('server1:50001:t', self.network.default_server)
+        self.assertEqual('server1:50001:t', self.network.interface.server)
+
+
+class TestServerProbing(NetworkTestCase):
+    def setUp(self):
+        super(TestServerProbing, self).setUp()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(('127.0.0.1', 0))
+        self.servers = {
+            '127.0.0.1': {'t': str(self.listener.getsockname()[1])},
+            'localhost': {'t': str(closed.getsockname()[1])},
+        }
+        closed.close()
+        self.path = os.path.join(self.tmp_dir, 'online_servers.json')
+
+    def tearDown(self):
+        self.listener.close()
+        super(TestServerProbing, self).tearDown()
+
+    def test_probe_servers(self):
+        self.assertEqual(['127.0.0.1'], probe_servers(self.servers, workers=2).keys())
+
+    def test_probe_results_saved(self):
+        save_probed_servers(self.path, {'127.0.0.1': {}, 'gone.example.com': {}}, 1000.0)
+        online, probed = read_probed_servers(self.path, self.servers)
+        self.assertEqual({'127.0.0.1': self.servers['127.0.0.1']}, online)
+        self.assertEqual(1000.0, probed)
+        with open(self.path, 'w') as f:
+            f.write('{')
+        self.assertEqual(({}, None), read_probed_servers(self.path, self.servers))
+
+    def test_start_from_recent_probe(self):
+        self.config.set_key('default_servers', {'10.255.255.1': {'t': '50001'}})
+        save_probed_servers(self.path, {'10.255.255.1': {}}, time.time())
+        probes = []
+        # don't let the background probe write to the test directory
+        self.network._probe_servers = lambda servers, path: probes.append(servers)
+        start = time.time()
+        Network._set_online_servers(self.network)
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(['10.255.255.1'], self.network.online_servers.keys())
+        deadline = time.time() + 5
+        while not probes and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([{'10.255.255.1': {'t': '50001'}}], probes)
+
+
+class TestHedgedRequests(NetworkTestCase):
+    def setUp(self):
+        super(TestHedgedRequests, self).setUp()
+        self.main = self.network.interface = self.add_interface('server0:50001:t', 100)
+        self.other = self.add_interface('server1:50001:t', 100)
+        self.responses = []
+        self.network.send([('blockchain.transaction.get', ['aa'])], self.responses.append)
+        self.network.process_pending_sends()
+        self.message_id = self.main.requests[0][2]
+
+    def age_requests(self, seconds):
+        for interface in (self.main, self.other):
+            for message_id in interface.sent_times:
+                interface.sent_times[message_id] -= seconds
+        for waiters in self.network.inflight_requests.itervalues():
+            waiters[:] = [(callback, timeout, joined - seconds)
+                          for callback, timeout, joined in waiters]
+
+    def test_slow_request_hedged(self):
+        self.network.maintain_requests()
+        self.assertFalse(self.other.requests)
+        self.age_requests(1.5)
+        self.network.maintain_requests()
+        hedge_id = self.other.requests[0][2]
+        self.assertEqual(['aa'], self.other.requests[0][1])
+
+        self.other.respond(hedge_id, result='tx')
+        self.network.process_responses(self.other)
+        self.main.respond(self.message_id, result='tx')
+        self.network.process_responses(self.main)
+        self.assertEqual(['tx'], [r['result'] for r in self.responses])
+        self.assertFalse(self.network.unanswered_requests)
+        self.assertFalse(self.network.hedged_requests)
+
+    def test_error_waits_for_other_copy(self):
+        self.age_requests(1.5)
+        self.network.maintain_requests()
+        hedge_id = self.other.requests[0][2]
+        self.main.respond(self.message_id, error='busy')
+        self.network.process_responses(self.main)
+        self.assertFalse(self.responses)
+        self.other.respond(hedge_id, result='tx')
+        self.network.process_responses(self.other)
+        self.assertEqual(['tx'], [r['result'] for r in self.responses])
+
+    def test_deadline(self):
+        self.network.send([('blockchain.transaction.broadcast', ['00'])], self.responses.append,
+                          timeout=15)
+        self.network.process_pending_sends()
+        self.age_requests(16)
+        self.network.maintain_requests()
+        self.assertEqual(['request timed out'], [r['error'] for r in self.responses])
+        # the request sent without a timeout is still waited for
+        self.assertEqual(set(['blockchain.transaction.get']),
+                         set(r[0] for r in self.network.unanswered_requests.values()))
+        stats = self.network.get_network_stats()
+        self.assertEqual(1, stats['methods']['blockchain.transaction.broadcast']['timeouts'])
+        self.assertEqual(1, stats['servers']['server0:50001:t']['timeouts'])
+
+    def test_deadline_starts_when_written(self):
+        self.network.send([('blockchain.transaction.broadcast', ['00'])], self.responses.append,
+                          timeout=15)
+        self.network.process_pending_sends()
+        message_id = self.main.requests[-1][2]
+        del self.main.sent_times[message_id]
+        self.age_requests(16)
+        self.network.maintain_requests()
+        self.assertFalse(self.responses)
+        self.main.sent_times[message_id] = time.time() - 16
+        self.network.maintain_requests()
+        self.assertEqual(['request timed out'], [r['error'] for r in self.responses])
+
+    def test_only_late_caller_of_coalesced_request_fails(self):
+        waiting = []
+        self.network.send([('blockchain.transaction.get', ['aa'])], waiting.append, timeout=15)
+        self.network.process_pending_sends()
+        self.assertEqual(1, len(self.main.requests))
+        self.age_requests(16)
+        self.network.maintain_requests()
+        self.assertEqual(['request timed out'], [r['error'] for r in waiting])
+        self.assertFalse(self.responses)
+        self.main.respond(self.message_id, result='tx')
+        self.network.process_responses(self.main)
+        self.assertEqual(['tx'], [r['result'] for r in self.responses])
+        self.assertEqual(1, len(waiting))
+
+    def test_late_joiner_waits_from_when_it_joined(self):
+        self.age_requests(20)
+        joining = []
+        self.network.send([('blockchain.transaction.get', ['aa'])], joining.append, timeout=15)
+        self.network.process_pending_sends()
+        self.network.maintain_requests()
+        self.assertFalse(joining)
+        self.age_requests(16)
+        self.network.maintain_requests()
+        self.assertEqual(['request timed out'], [r['error'] for r in joining])
+        self.assertFalse(self.responses)
+
+    def test_timed_out_subscription_resent(self):
+        # the synchronizer's requests have no deadline, and are sent to the
+        # next main server until they are answered
+        self.network.send([('blockchain.address.subscribe', ['addr'])], self.responses.append,
+                          PRIORITY_LOW)
+        self.network.process_pending_sends()
+        self.age_requests(100)
+        self.network.maintain_requests()
+        self.assertFalse(self.responses)
+        self.network.interface = self.other
+        self.network.send_subscriptions()
+        self.assertIn(('blockchain.address.subscribe', ['addr']),
+                      [(method, params) for method, params, _ in self.other.requests])
+        self.assertFalse(self.network.get_network_stats()['methods'])
+
+    def test_requests_sent_again_keep_their_priority(self):
+        self.network.send([('blockchain.address.get_history', ['addr'])], self.responses.append,
+                          PRIORITY_LOW)
+        self.network.process_pending_sends()
+        self.age_requests(1.5)
+        self.network.maintain_requests()
+        hedge_id, = [i for method, _, i in self.other.requests
+                     if method == 'blockchain.address.get_history']
+        self.assertEqual(PRIORITY_LOW, self.other.priorities[hedge_id])
+
+        self.network.interface = self.other
+        self.network.send_subscriptions()
+        priorities = dict((method, self.other.priorities[i])
+                          for method, _, i in self.other.requests[-6:])
+        self.assertEqual(PRIORITY_LOW, priorities['blockchain.address.get_history'])
+        self.assertEqual(PRIORITY_NORMAL, priorities['blockchain.transaction.get'])
+
+    def test_hedge_delay(self):
+        self.assertEqual(1.0, self.network.get_hedge_delay('blockchain.transaction.get'))
+        self.network.response_times['blockchain.transaction.get'].extend(
+            [0.1] * 95 + [2.0] * 5)
+        self.assertEqual(0.25, self.network.get_hedge_delay('blockchain.transaction.get'))
+        self.network.response_times['blockchain.transaction.get'].extend([0.5] * 10)
+        self.assertEqual(0.5, self.network.get_hedge_delay('blockchain.transaction.get'))
@@ -0,0 +1,44 @@
+import unittest
+
+from lbryum.network_stats import Histogram, NetworkStats
+
+
+class TestHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = Histogram((0.1, 1.0))
+        self.assertIsNone(histogram.percentile(0.5))
+        for value in [0.05] * 90 + [0.5] * 9 + [3.0]:
+            histogram.add(value)
+        self.assertEqual(0.1, histogram.percentile(0.5))
+        self.assertEqual(1.0, histogram.percentile(0.95))
+        self.assertEqual(3.0, histogram.percentile(1.0))
+        self.assertEqual(100, histogram.count)
+        self.assertEqual({'<=0.1': 90, '<=1': 9, '>1': 1}, histogram.as_dict()['buckets'])
+
+    def test_percentile_capped_at_largest_sample(self):
+        histogram = Histogram((0.1, 1.0))
+        histogram.add(0.2)
+        self.assertEqual(0.2, histogram.percentile(0.5))
+
+
+class TestNetworkStats(unittest.TestCase):
+    def test_counted_by_method_and_server(self):
+        stats = NetworkStats()
+        stats.add_request('server0', 'server.banner', 40)
+        stats.add_request('server1', 'server.banner', 40)
+        stats.add_response('server0', 'server.banner', 0.2, 100, None)
+        stats.add_response('server1', 'server.banner', 0.4, 50, {'message': 'error'})
+        stats.add_notification('server0', 'blockchain.headers.subscribe', 200)
+        stats.add_timeout('server1', 'server.version')
+
+        result = stats.as_dict()
+        banner = result['methods']['server.banner']
+        self.assertEqual((2, 2, 1), (banner['requests'], banner['responses'], banner['errors']))
+        self.assertEqual((80, 150), (banner['bytes_sent'], banner['bytes_received']))
+        self.assertAlmostEqual(0.3, banner['response_times']['mean'])
+        server0 = result['servers']['server0']
+        self.assertEqual((1, 300), (server0['notifications'], server0['bytes_received']))
+        self.assertEqual(1, result['servers']['server1']['timeouts'])
+
+        stats.clear()
+        self.assertEqual({'methods': {}, 'servers': {}}, stats.as_dict())
@@ -0,0 +1,62 @@
+import select
+import socket
+import time
+import unittest
+
+from lbryum.poller import SelectPoller, PollPoller, EpollPoller, Waker, EVENT_READ, EVENT_WRITE
+
+
+class PollerTests(object):
+    poller_class = None
+
+    def setUp(self):
+        super(PollerTests, self).setUp()
+        self.poller = self.poller_class()
+        self.a, self.b = socket.socketpair()
+
+    def tearDown(self):
+        super(PollerTests, self).tearDown()
+        self.poller.close()
+        self.a.close()
+        self.b.close()
+
+    def test_read_and_write_events(self):
+        self.poller.register(self.a, EVENT_READ, 'a')
+        self.assertEqual([], self.poller.select(0))
+        self.b.send('x')
+        self.assertEqual([('a', EVENT_READ)], self.poller.select(1))
+        self.poller.modify(self.a, EVENT_READ | EVENT_WRITE, 'a')
+        self.assertEqual([('a', EVENT_READ | EVENT_WRITE)], self.poller.select(1))
+        self.poller.unregister(self.a)
+        self.assertEqual([], self.poller.select(0))
+
+    def test_register_twice(self):
+        self.poller.register(self.a, EVENT_READ)
+        self.assertRaises(KeyError, self.poller.register, self.a, EVENT_WRITE)
+
+    def test_waker(self):
+        waker = Waker()
+        self.addCleanup(waker.close)
+        self.poller.register(waker, EVENT_READ, waker)
+        start = time.time()
+        self.assertEqual([], self.poller.select(0.05))
+        self.assertGreaterEqual(time.time() - start, 0.04)
+        waker.wake()
+        waker.wake()
+        self.assertEqual([(waker, EVENT_READ)], self.poller.select(1))
+        waker.clear()
+        self.assertEqual([], self.poller.select(0))
+
+
+class TestSelectPoller(PollerTests, unittest.TestCase):
+    poller_class = SelectPoller
+
+
+@unittest.skipUnless(hasattr(select, 'poll'), "poll is not available")
+class TestPollPoller(PollerTests, unittest.TestCase):
+    poller_class = PollPoller
+
+
+@unittest.skipUnless(hasattr(select, 'epoll'), "epoll is not available")
+class TestEpollPoller(PollerTests, unittest.TestCase):
+    poller_class = EpollPoller
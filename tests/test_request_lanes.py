@@ -0,0 +1,24 @@
+import unittest
+
+from lbryum.constants import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
+from lbryum.request_lanes import RequestLanes
+
+
+class TestRequestLanes(unittest.TestCase):
+    def test_weighted_round_robin(self):
+        lanes = RequestLanes((2, 1, 1))
+        lanes.extend(PRIORITY_LOW, ['l1', 'l2', 'l3'])
+        lanes.extend(PRIORITY_HIGH, ['h1', 'h2', 'h3', 'h4', 'h5'])
+        lanes.extend(PRIORITY_NORMAL, ['n1'])
+        self.assertEqual(9, len(lanes))
+        self.assertEqual(['h1', 'h2', 'n1', 'l1', 'h3', 'h4'], lanes.take(6))
+        self.assertEqual(['l2', 'h5', 'l3'], lanes.take(10))
+        self.assertFalse(lanes)
+        self.assertEqual([], lanes.take(1))
+
+    def test_turn_carries_over_between_calls(self):
+        lanes = RequestLanes((2, 1, 1))
+        lanes.extend(PRIORITY_HIGH, ['h%d' % i for i in range(6)])
+        lanes.extend(PRIORITY_LOW, ['l1', 'l2'])
+        taken = [lanes.take(1)[0] for _ in range(6)]
+        self.assertEqual(['h0', 'h1', 'l1', 'h2', 'h3', 'l2'], taken)
@@ -0,0 +1,62 @@
+import unittest
+
+from lbryum.hashing import Hash, hash_encode
+from lbryum.response_cache import ResponseCache
+
+RAW_TX = '01000000' + '00' * 10
+TXID = hash_encode(Hash(RAW_TX.decode('hex')))
+
+
+def response(method, params, result):
+    return {'method': method, 'params': params, 'result': result}
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        super(TestResponseCache, self).setUp()
+        self.cache = ResponseCache(max_size=100)
+
+    def test_transaction_checked_against_hash(self):
+        self.cache.put('a', response('blockchain.transaction.get', [TXID], RAW_TX))
+        self.cache.put('b', response('blockchain.transaction.get', ['00' * 32], RAW_TX))
+        self.assertEqual(RAW_TX, self.cache.get('a')['result'])
+        self.assertIsNone(self.cache.get('b'))
+        self.cache.new_tip()
+        self.assertIsNotNone(self.cache.get('a'))
+
+    def test_invalidated_on_new_tip(self):
+        self.cache.put('a', response('blockchain.claimtrie.getclaimbyid', ['id'], {'x': 1}))
+        self.cache.put('b', response('blockchain.claimtrie.getvalue', ['n', 'hash'], {'y': 1}))
+        self.cache.put('c', response('blockchain.claimtrie.getvaluesforuris', ['hash', 'u'], {}))
+        self.assertEqual({'x': 1}, self.cache.get('a')['result'])
+        self.assertEqual({'y': 1}, self.cache.get('b')['result'])
+        self.cache.new_tip()
+        self.assertEqual(0, len(self.cache))
+
+    def test_results_are_copied(self):
+        result = {'amount': 100000000, 'supports': [['txid', 0, 100]]}
+        self.cache.put('a', response('blockchain.claimtrie.getclaimbyid', ['id'], result))
+        result['amount'] = 1.0
+        first = self.cache.get('a')
+        first['result']['supports'][0] = {'txid': 'txid'}
+        first['params'].append('x')
+        second = self.cache.get('a')
+        self.assertEqual({'amount': 100000000, 'supports': [['txid', 0, 100]]}, second['result'])
+        self.assertEqual(['id'], second['params'])
+
+    def test_not_cached(self):
+        self.cache.put('a', response('blockchain.address.get_history', ['addr'], []))
+        self.cache.put('b', dict(response('blockchain.claimtrie.getclaimbyid', ['id'], None),
+                                 error='oops'))
+        self.assertEqual(0, len(self.cache))
+
+    def test_least_recently_used_evicted(self):
+        for key in 'ab':
+            self.cache.put(key, response('blockchain.claimtrie.getclaimbyid', [key], 'x' * 38))
+        self.assertEqual(80, self.cache.size)
+        self.cache.get('a')
+        self.cache.put('c', response('blockchain.claimtrie.getclaimbyid', ['c'], 'x' * 38))
+        self.assertEqual(['a', 'c'], list(self.cache.entries))
+        self.assertEqual(80, self.cache.size)
+        self.cache.put('e', response('blockchain.claimtrie.getclaimbyid', ['e'], 'x' * 200))
+        self.assertIsNone(self.cache.get('e'))
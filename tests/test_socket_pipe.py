@@ -0,0 +1,54 @@
+import json
+import socket
+import unittest
+
+from lbryum.errors import Timeout
+from lbryum.socket_pipe import SocketPipe
+
+
+class TestSocketPipe(unittest.TestCase):
+    def setUp(self):
+        super(TestSocketPipe, self).setUp()
+        self.remote, local = socket.socketpair()
+        self.pipe = SocketPipe(local, read_size=7)
+        self.pipe.set_timeout(0.0)
+
+    def tearDown(self):
+        super(TestSocketPipe, self).tearDown()
+        self.remote.close()
+        self.pipe.socket.close()
+
+    def get_all(self):
+        messages = []
+        while True:
+            try:
+                messages.append(self.pipe.get())
+            except Timeout:
+                return messages
+
+    def test_messages_split_over_reads(self):
+        self.remote.sendall('{"id": 1}\n{"id": 2}\n{"id"')
+        self.assertEqual([{'id': 1}, {'id': 2}], self.get_all())
+        self.assertEqual('{"id"', str(self.pipe.buffer))
+        self.remote.sendall(': 3, "result": "%s"}\n' % ('x' * 100))
+        self.assertEqual([{'id': 3, 'result': 'x' * 100}], self.get_all())
+        self.assertEqual(0, len(self.pipe.buffer))
+
+    def test_invalid_message_dropped(self):
+        self.remote.sendall('not json\n{"id": 1}\n')
+        self.assertEqual([{'id': 1}], self.get_all())
+        self.assertEqual(10, self.pipe.message_size)
+
+    def test_closed_remotely(self):
+        self.remote.sendall('{"id": 1}\n')
+        self.remote.close()
+        self.assertEqual({'id': 1}, self.pipe.get())
+        self.assertIsNone(self.pipe.get())
+
+    def test_send(self):
+        self.assertEqual([10, 10], self.pipe.send_all([{'id': 1}, {'id': 2}]))
+        self.remote.settimeout(1)
+        received = ''
+        while received.count('\n') < 2:
+            received += self.remote.recv(1024)
+        self.assertEqual([{'id': 1}, {'id': 2}], map(json.loads, received.splitlines()))